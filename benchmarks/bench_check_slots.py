@@ -0,0 +1,63 @@
+"""
+Benchmark the slot checking engines of examine.evaluate.
+
+Compares the 'dict' engine, which builds a preview per slot, with the
+vectorized 'numpy' engine for 10k and 100k slot configurations of the seeded
+synthetic pools of mock_htcondor.synthetic, one per node. The plain
+total (no previews printed), the verbose case, and a node budget of 10 nodes
+(--maxnodes) are timed, and the totals of both engines are checked for
+equality.
+
+Run from the repository root:
+
+    python benchmarks/bench_check_slots.py
+"""
+
+import sys
+import time
+
+from os.path import abspath, dirname
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from htcrystalball import collect, examine  # noqa: E402
+from mock_htcondor.synthetic import synthetic_ads  # noqa: E402
+
+SIZES = [10000, 100000]
+JOB = {'n_cpus': 2, 'ram': 8.0, 'disk_space': 10.0, 'n_gpus': 0}
+
+
+def synthetic_config(n_configs: int) -> dict:
+    """Creates a slot configuration of n_configs single-slot nodes of mock_htcondor.synthetic."""
+    return collect.collect_slots(synthetic_ads(nodes=n_configs, slots_per_node=1))
+
+
+def timed(engine: str, static: list, partitionable: list, verbose: bool,
+          max_nodes: int = 0) -> (float, int):
+    """Returns the runtime and total of one evaluation."""
+    start = time.perf_counter()
+    _, total_jobs = examine.evaluate(static, partitionable, max_nodes=max_nodes,
+                                     verbose=verbose, engine=engine, **JOB)
+    return time.perf_counter() - start, total_jobs
+
+
+def main() -> None:
+    """Times both engines for all benchmark sizes."""
+    # import the numpy engine before timing it
+    timed('numpy', [], [], False)
+
+    print(f"{'configs':>10} {'verbose':>8} {'maxnodes':>8} {'dict s':>8} {'numpy s':>8} {'speedup':>8}")
+    for size in SIZES:
+        config = synthetic_config(size)
+        static = examine.filter_slots(config, 'Static')
+        partitionable = examine.filter_slots(config, 'Partitionable')
+        for verbose, max_nodes in ((False, 0), (True, 0), (False, 10)):
+            dict_time, dict_total = timed('dict', static, partitionable, verbose, max_nodes)
+            numpy_time, numpy_total = timed('numpy', static, partitionable, verbose, max_nodes)
+            assert dict_total == numpy_total
+            print(f"{size:>10} {str(verbose):>8} {max_nodes:>8} {dict_time:>8.3f} {numpy_time:>8.3f} "
+                  f"{dict_time / numpy_time:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
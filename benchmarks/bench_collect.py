@@ -0,0 +1,66 @@
+"""
+Benchmark the slot deduplication in collect.collect_slots.
+
+Generates the seeded synthetic pools of mock_htcondor.synthetic from 1k to
+1M slot ads, as the other benchmarks do, and reports how long
+collect.collect_slots needs for each size. A linear implementation keeps the
+time per ad roughly constant across sizes.
+
+It also reports the peak memory of collecting from a list of all ads, as
+returned by Collector.query, and from a stream of ads, as handed out by the
+xquery of the mock collector. The latter only depends on the number of
+configurations, but the HTCondor bindings have no streaming collector query,
+so it only applies to the mock.
+
+Run from the repository root:
+
+    python benchmarks/bench_collect.py
+"""
+
+import sys
+import time
+import tracemalloc
+
+from os.path import abspath, dirname
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from htcrystalball import collect  # noqa: E402
+from mock_htcondor.synthetic import synthetic_ads  # noqa: E402
+
+SIZES = [1000, 10000, 100000, 1000000]
+SLOTS_PER_NODE = 64
+
+
+def stream_ads(n_ads: int) -> object:
+    """Generates n_ads slot ads of a synthetic pool with many duplicate slot configurations."""
+    return synthetic_ads(nodes=max(1, n_ads // SLOTS_PER_NODE), slots_per_node=SLOTS_PER_NODE)
+
+
+def peak_memory(make_ads: object) -> float:
+    """Returns the peak memory in MiB of creating the ads with make_ads and collecting their slots."""
+    tracemalloc.start()
+    collect.collect_slots(make_ads())
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 2**20
+
+
+def main() -> None:
+    """Times collect.collect_slots for all benchmark sizes."""
+    print(f"{'ads':>10} {'configs':>10} {'seconds':>10} {'us/ad':>8} {'list MiB':>9} {'stream MiB':>10}")
+    for size in SIZES:
+        ads = list(stream_ads(size))
+        start = time.perf_counter()
+        slots = collect.collect_slots(ads)
+        elapsed = time.perf_counter() - start
+        configs = sum(len(node) for node in slots.values())
+        del ads
+        list_peak = peak_memory(lambda: list(stream_ads(size)))
+        stream_peak = peak_memory(lambda: stream_ads(size))
+        print(f"{size:>10} {configs:>10} {elapsed:>10.3f} {elapsed / size * 1e6:>8.2f} "
+              f"{list_peak:>9.1f} {stream_peak:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Benchmark the job fit queries of index.FitIndex.
+
+Builds the index of 10k and 100k slot configurations once and times the
+queries of a few job shapes, from small jobs that fit most slots to large
+ones that fit only a few, against a full scan of examine.check_slot_by_type
+as batch.job_counter did before. The totals of both are checked for
+equality.
+
+Run from the repository root:
+
+    python benchmarks/bench_index.py
+"""
+
+import sys
+import time
+
+from os.path import abspath, dirname
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+sys.path.insert(0, dirname(abspath(__file__)))
+
+from bench_check_slots import synthetic_config  # noqa: E402
+from htcrystalball import examine  # noqa: E402
+from htcrystalball.index import FitIndex  # noqa: E402
+
+SIZES = [10000, 100000]
+# (cpus, ram in GiB, disk in GiB, gpus)
+SHAPES = [(2, 8.0, 10.0, 0), (1, 1.0, 0.0, 4), (64, 400.0, 10.0, 0), (24, 200.0, 1000.0, 4)]
+
+
+def scan(static: list, partitionable: list, shape: tuple) -> int:
+    """Counts the jobs of a shape by checking every slot."""
+    n_cpu, ram, disk, n_gpu = shape
+    total = 0
+    for slot_type, slots in (('Partitionable', partitionable), ('Static', static)):
+        for slot in slots:
+            _, preview = examine.check_slot_by_type(slot, n_cpu, ram, disk, slot_type, n_gpu)
+            total += preview['sim_jobs'] * preview['SimSlots']
+    return total
+
+
+def main() -> None:
+    """Times the index and the scan for all benchmark sizes and shapes."""
+    print(f"{'configs':>10} {'shape':>24} {'fitting':>8} {'scan ms':>9} {'index ms':>9} {'speedup':>8}")
+    for size in SIZES:
+        config = synthetic_config(size)
+        static = examine.filter_slots(config, 'Static')
+        partitionable = examine.filter_slots(config, 'Partitionable')
+
+        start = time.perf_counter()
+        index = FitIndex(static, partitionable)
+        print(f"{size:>10} {'build':>24} {'':>8} {'':>9} {(time.perf_counter() - start) * 1000:>9.1f}")
+
+        for shape in SHAPES:
+            start = time.perf_counter()
+            expected = scan(static, partitionable, shape)
+            scan_time = time.perf_counter() - start
+            start = time.perf_counter()
+            total = index.count(*shape)
+            index_time = time.perf_counter() - start
+            assert total == expected
+            print(f"{size:>10} {str(shape):>24} {len(index.candidates(*shape)):>8} {scan_time * 1000:>9.1f} "
+                  f"{index_time * 1000:>9.1f} {scan_time / max(index_time, 1e-9):>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
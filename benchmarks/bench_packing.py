@@ -0,0 +1,48 @@
+"""
+Benchmark packing a job mix with packing.pack.
+
+Packs mixes of up to millions of jobs into the seeded synthetic pools of
+mock_htcondor.synthetic with thousands of nodes. As identical slots are
+packed as groups, the runtime depends on the number of slot configurations
+and shapes, not on the number of jobs.
+
+Run from the repository root:
+
+    python benchmarks/bench_packing.py
+"""
+
+import sys
+import time
+
+from os.path import abspath, dirname
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from htcrystalball import collect, packing  # noqa: E402
+from mock_htcondor.synthetic import synthetic_ads  # noqa: E402
+
+POOLS = [1000, 5000]
+JOBS = [10000, 1000000, 10000000]
+
+
+def synthetic_config(n_nodes: int) -> dict:
+    """Creates the slot configuration of a pool of n_nodes nodes of mock_htcondor.synthetic."""
+    return collect.collect_slots(synthetic_ads(nodes=n_nodes))
+
+
+def main() -> None:
+    """Times packing a 70/30 mix of small and large jobs."""
+    print(f"{'nodes':>8} {'jobs':>10} {'running':>10} {'seconds':>8}")
+    for n_nodes in POOLS:
+        config = synthetic_config(n_nodes)
+        for n_jobs in JOBS:
+            mix = [(1, 4.0, 1.0, 0, int(n_jobs * 0.7)), (8, 64.0, 10.0, 0, int(n_jobs * 0.3))]
+            start = time.perf_counter()
+            report = packing.pack(config, mix)
+            elapsed = time.perf_counter() - start
+            running = sum(shape['running'] for shape in report['shapes'])
+            print(f"{n_nodes:>8} {n_jobs:>10} {running:>10} {elapsed:>8.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Benchmark the memory of slot configurations and previews.
+
+Builds 1M slot configurations and their previews for a job, once as the
+plain dicts HTCrystalBall used before and once as the records of
+records.py. Reports the bytes per slot measured with tracemalloc and the
+time needed without tracing.
+
+Run from the repository root:
+
+    python benchmarks/bench_records.py
+"""
+
+import sys
+import time
+import tracemalloc
+
+from os.path import abspath, dirname
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from htcrystalball import examine  # noqa: E402
+from htcrystalball.records import SlotRecord  # noqa: E402
+
+N_SLOTS = 1000000
+
+
+def slot_fields(i: int) -> dict:
+    """Returns the fields of the i-th synthetic slot configuration."""
+    return {'TotalSlotCpus': 1 + i % 64, 'TotalSlotGPUs': i % 2, 'TotalSlotDisk': 3333.0 + i,
+            'TotalSlotMemory': 7.5 + i, 'SlotType': 'Partitionable', 'SimSlots': 1,
+            'Machine': f'cpu{i}'}
+
+
+def measure(build: object) -> (float, float):
+    """Returns the bytes per slot kept by the result of build and the seconds it takes."""
+    start = time.perf_counter()
+    build()
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size / N_SLOTS, elapsed
+
+
+def main() -> None:
+    """Measures slot configurations and previews as dicts and as records."""
+    fields = [slot_fields(i) for i in range(N_SLOTS)]
+    records = [SlotRecord(**slot) for slot in fields]
+
+    def previews() -> list:
+        return [examine.check_slot_by_type(slot, 1, 2.0, 1.0, 'Partitionable')[1] for slot in records]
+
+    def preview_dicts() -> list:
+        return [dict(examine.check_slot_by_type(slot, 1, 2.0, 1.0, 'Partitionable')[1])
+                for slot in fields]
+
+    print(f"{'variant':>20} {'bytes/slot':>11} {'seconds':>8}")
+    for name, build in [
+        ('dict slots', lambda: [dict(slot) for slot in fields]),
+        ('SlotRecord slots', lambda: [SlotRecord(**slot) for slot in fields]),
+        ('dict previews', preview_dicts),
+        ('PreviewRecord', previews),
+    ]:
+        per_slot, elapsed = measure(build)
+        print(f"{name:>20} {per_slot:>11.0f} {elapsed:>8.3f}")
+
+
+if __name__ == '__main__':
+    main()
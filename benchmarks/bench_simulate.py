@@ -0,0 +1,47 @@
+"""
+Benchmark the discrete-event wall-time simulation with simulate.simulate.
+
+Simulates up to millions of jobs on the seeded synthetic pools of
+mock_htcondor.synthetic with thousands of nodes and random speed ratings.
+Identical job slots finish together and are one event, so the runtime
+depends on the number of job waves and slot configurations, not on the
+number of jobs.
+
+Run from the repository root:
+
+    python benchmarks/bench_simulate.py
+"""
+
+import sys
+import time
+
+from os.path import abspath, dirname
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from htcrystalball import collect, examine, simulate  # noqa: E402
+from mock_htcondor.synthetic import synthetic_ads  # noqa: E402
+
+POOLS = [1000, 5000]
+JOBS = [10000, 1000000, 10000000]
+
+
+def synthetic_slots(n_nodes: int) -> list:
+    """Creates the partitionable slots of a pool of n_nodes nodes of mock_htcondor.synthetic."""
+    return examine.filter_slots(collect.collect_slots(synthetic_ads(nodes=n_nodes)), 'Partitionable')
+
+
+def main() -> None:
+    """Times simulating 1-core jobs of one hour."""
+    print(f"{'nodes':>8} {'jobs':>10} {'makespan':>10} {'seconds':>8}")
+    for n_nodes in POOLS:
+        slots = synthetic_slots(n_nodes)
+        for n_jobs in JOBS:
+            start = time.perf_counter()
+            report = simulate.simulate(slots, 1, 2.0, 1.0, 0, n_jobs, 60.0)
+            elapsed = time.perf_counter() - start
+            print(f"{n_nodes:>8} {n_jobs:>10} {report['makespan']:>10.1f} {elapsed:>8.3f}")
+
+
+if __name__ == '__main__':
+    main()
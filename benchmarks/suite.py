@@ -0,0 +1,214 @@
+"""
+Benchmark suite timing every stage of HTCrystalBall on synthetic pools.
+
+Generates seeded pools with mock_htcondor.synthetic from 1k to 1M slot ads
+and measures, per pool size, the runtime and the peak memory (tracemalloc)
+of each stage:
+
+    query      creating the list of slot ads, as Collector.query does
+    collect    deduplicating the ads with collect.collect_slots
+    filter     splitting the configuration with examine.filter_slots
+    check      examine.evaluate with the dict engine, without sorting
+    numpy      examine.evaluate with the numpy engine, if NumPy is installed
+    sort       natsorting the previews by machine, as examine.evaluate does
+    display    printing the verbose table with display.results through rich
+    output     writing the previews as JSON lines with display.write_results
+
+The results are written as JSON and can be compared against a previous run
+to catch regressions. Runs offline and does not need an HTCondor pool.
+
+Run from the repository root:
+
+    python benchmarks/suite.py --output bench.json
+    python benchmarks/suite.py --sizes 1000,10000 --compare bench.json
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+from os.path import abspath, dirname
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from natsort import natsorted  # noqa: E402
+
+from htcrystalball import collect, display, examine  # noqa: E402
+from mock_htcondor.synthetic import synthetic_ads  # noqa: E402
+
+SIZES = [1000, 10000, 100000, 1000000]
+JOB = {'n_cpus': 2, 'ram': 8.0, 'disk_space': 10.0, 'n_gpus': 0, 'max_nodes': 0}
+
+
+def stages(size: int, pool: dict, display_limit: int) -> list:
+    """
+    Returns the stages of one pool size as (name, function) pairs.
+
+    Each function takes the result of the previous stage, so the stages run
+    in a pipeline and can be measured one by one.
+    """
+    def query(_):
+        return list(synthetic_ads(nodes=max(1, size // pool['slots_per_node']), **pool))
+
+    def collect_slots(ads):
+        return collect.collect_slots(ads)
+
+    def filter_slots(config):
+        return examine.filter_slots(config, 'Static'), examine.filter_slots(config, 'Partitionable')
+
+    def check(slots):
+        results = {'preview': []}
+        for slot_type, type_slots in zip(('Static', 'Partitionable'), slots):
+            for slot in type_slots:
+                _, preview = examine.check_slot_by_type(slot, JOB['n_cpus'], JOB['ram'],
+                                                        JOB['disk_space'], slot_type, JOB['n_gpus'])
+                results['preview'].append(preview)
+        results['slots_by_type'] = slots
+        return results
+
+    def numpy(results):
+        examine.evaluate(*results['slots_by_type'], verbose=False, engine='numpy', **JOB)
+        return results
+
+    def sort(results):
+        results['preview'] = natsorted(results['preview'], key=lambda y: y["Machine"].lower())
+        return results
+
+    def show(results):
+        if len(results['preview']) > display_limit:
+            return results
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            display.results(results, True, False, JOB['n_cpus'], 1000, 60.0)
+        return results
+
+    def output(results):
+        with open(os.devnull, 'w') as devnull:
+            display.write_results(results, 'jsonl', JOB['n_cpus'], 1000, 60.0, stream=devnull)
+        return None
+
+    pipeline = [('query', query), ('collect', collect_slots), ('filter', filter_slots),
+                ('check', check)]
+    if importlib.util.find_spec('numpy') is not None:
+        pipeline.append(('numpy', numpy))
+    pipeline += [('sort', sort), ('display', show), ('output', output)]
+    return pipeline
+
+
+def run(sizes: list, pool: dict, memory: bool, display_limit: int) -> list:
+    """
+    Runs all stages for all sizes.
+
+    Every pipeline runs once for the runtime and, if memory is given, once
+    more under tracemalloc for the peak memory, since tracing slows down
+    allocations considerably.
+
+    Returns:
+        One result dict per size and stage.
+    """
+    results = []
+    for size in sizes:
+        pipeline = stages(size, pool, display_limit)
+        timings = {}
+        value = None
+        for name, stage in pipeline:
+            start = time.perf_counter()
+            value = stage(value)
+            timings[name] = time.perf_counter() - start
+            if name == 'collect':
+                configs = sum(len(slots) for slots in value.values())
+
+        peaks = {}
+        if memory:
+            value = None
+            for name, stage in pipeline:
+                tracemalloc.start()
+                value = stage(value)
+                peaks[name] = tracemalloc.get_traced_memory()[1] / 2**20
+                tracemalloc.stop()
+        del value
+
+        for name, _ in pipeline:
+            skipped = name == 'display' and configs > display_limit
+            results.append({
+                'ads': size,
+                'configs': configs,
+                'stage': name,
+                'seconds': None if skipped else round(timings[name], 6),
+                'peak_mib': None if skipped or not memory else round(peaks[name], 3),
+            })
+            print(f"{size:>9} {configs:>9} {name:>8} "
+                  f"{'skipped' if skipped else format(timings[name], '.3f'):>9} "
+                  f"{format(peaks[name], '.1f') if memory and not skipped else '-':>9}", flush=True)
+
+    return results
+
+
+def compare(results: list, baseline: dict, threshold: float) -> int:
+    """
+    Prints the runtime ratio of each stage against a previous run.
+
+    Returns:
+        The number of stages that are slower than threshold times the baseline.
+    """
+    before = {(row['ads'], row['stage']): row for row in baseline['results']}
+    regressions = 0
+    print(f"\n{'ads':>9} {'stage':>8} {'before':>9} {'now':>9} {'ratio':>6}")
+    for row in results:
+        old = before.get((row['ads'], row['stage']))
+        if old is None or not old['seconds'] or row['seconds'] is None:
+            continue
+        ratio = row['seconds'] / old['seconds']
+        flag = ' REGRESSION' if ratio > threshold else ''
+        regressions += bool(flag)
+        print(f"{row['ads']:>9} {row['stage']:>8} {old['seconds']:>9.3f} {row['seconds']:>9.3f} "
+              f"{ratio:>6.2f}{flag}")
+    return regressions
+
+
+def main() -> None:
+    """Parses the arguments, runs the suite, and stores or compares the results."""
+    parser = argparse.ArgumentParser(description="Times every stage of HTCrystalBall on synthetic pools.")
+    parser.add_argument("--sizes", default=','.join(map(str, SIZES)),
+                        help="Comma separated numbers of slot ads (default: %(default)s)")
+    parser.add_argument("--slots-per-node", type=int, default=8)
+    parser.add_argument("--partitionable-ratio", type=float, default=0.7)
+    parser.add_argument("--gpu-share", type=float, default=0.1)
+    parser.add_argument("--duplicate-ratio", type=float, default=0.9)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--display-limit", type=int, default=20000,
+                        help="Skip the display stage above this number of configurations")
+    parser.add_argument("--no-memory", action='store_true', help="Skip measuring the peak memory")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Compare the runtimes against this JSON file")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="Runtime ratio above which a stage counts as a regression")
+    args = parser.parse_args()
+    # the output goes to /dev/null, which would select the plain output
+    display.PLAIN = False
+
+    pool = {'slots_per_node': args.slots_per_node, 'partitionable_ratio': args.partitionable_ratio,
+            'gpu_share': args.gpu_share, 'duplicate_ratio': args.duplicate_ratio, 'seed': args.seed}
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    print(f"{'ads':>9} {'configs':>9} {'stage':>8} {'seconds':>9} {'peak MiB':>9}")
+    results = run(sizes, pool, not args.no_memory, args.display_limit)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'python': platform.python_version(), 'platform': platform.platform(),
+                       'pool': pool, 'results': results}, output, indent=1)
+
+    if args.compare:
+        with open(args.compare, 'r') as baseline:
+            regressions = compare(results, json.load(baseline), args.threshold)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""Evaluates a stream of job shapes against one slot configuration."""
+
+import csv
+import itertools
+import json
+import sys
+
+from argparse import ArgumentTypeError
+
+from htcrystalball import examine, LOGGER
+from htcrystalball.utils import split_num_str, to_binary_gigabyte, to_minutes, \
+    validate_storage_size, validate_duration, wall_time, core_hours
+
+RESULT_FIELDS = ['total_jobs', 'core_hours', 'wall_time', 'error']
+
+
+def read_shapes(stream: object) -> (str, object):
+    """
+    Detects the format of a job shape stream and returns a row iterator.
+
+    Each row is a dictionary with the keys cpu, ram and optionally gpu, disk,
+    jobs and time, given in the same format as the command line arguments.
+    Rows are read lazily, so arbitrarily long streams can be processed. A
+    malformed JSON line is returned as the ValueError it raised, so that it
+    is reported like any other invalid row.
+
+    Args:
+        stream: A text stream of JSON lines or of CSV with a header row
+
+    Returns:
+        The detected format, 'jsonl' or 'csv', and an iterator over the rows.
+    """
+    lines = (line for line in stream if line.strip())
+    first = next(lines, '')
+
+    if first.lstrip().startswith('{'):
+        return 'jsonl', (decode_line(line) for line in itertools.chain([first], lines))
+
+    return 'csv', csv.DictReader(itertools.chain([first], lines))
+
+
+def decode_line(line: str) -> object:
+    """Decodes a JSON line, or returns the ValueError if it is malformed."""
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return e
+
+
+def job_counter(static: list, partitionable: list, engine: str = 'dict',
+                index: object = None) -> object:
+    """
+    Creates a function that counts the jobs of a given shape on the slots.
+
+    The slots are prepared once, converted to arrays for the 'numpy' engine
+    or sorted into an index.FitIndex for the 'dict' engine, so that each call
+    only pays for the fitting itself. The index only checks the slots that
+    can fit the job.
+
+    Args:
+        index: Optional. The index.FitIndex of the slots for the 'dict'
+            engine, which is built if not given
+
+    Returns:
+        A function (n_cpu, ram, disk, n_gpu) -> number of jobs that can run.
+    """
+    if engine == 'numpy':
+        try:
+            from htcrystalball import columnar
+        except ImportError:
+            LOGGER.warning("NumPy is not installed, falling back to the dict engine")
+        else:
+            columns = columnar.to_columns(partitionable + static)
+
+            def count_numpy(n_cpu: int, ram: float, disk: float, n_gpu: int) -> int:
+                _, jobs = columnar.fit_jobs(columns, n_cpu, ram, disk, n_gpu)
+                return int((jobs * columns['SimSlots']).sum())
+
+            return count_numpy
+
+    if index is None:
+        from htcrystalball.index import FitIndex
+
+        index = FitIndex(static, partitionable)
+    return index.count
+
+
+def parse_shape(shape: dict) -> (int, float, float, int, int, float):
+    """
+    Converts a job shape given in command line notation into numbers.
+
+    Args:
+        shape: A dictionary with the keys cpu, ram and optionally gpu, disk,
+            jobs and time
+
+    Returns:
+        The number of CPUs, RAM and disk in GiB, the number of GPUs, the
+        number of jobs and the job duration in minutes.
+
+    Raises:
+        ValueError: If a value is malformed or of a wrong type, the CPUs or
+            RAM are missing, the CPUs or GPUs are negative, or the number
+            of jobs is not positive. Only a missing number of jobs means one.
+    """
+    try:
+        cpu = int(shape.get('cpu') or 0)
+        gpu = int(shape.get('gpu') or 0)
+        jobs = shape.get('jobs')
+        jobs = 1 if jobs in (None, '') else int(jobs)
+        ram = validate_storage_size(str(shape.get('ram') or '0G'))
+        disk = validate_storage_size(str(shape.get('disk') or '0G'))
+        duration = validate_duration(str(shape.get('time') or ''))
+    except (ArgumentTypeError, TypeError) as e:
+        raise ValueError(str(e)) from e
+
+    ram = to_binary_gigabyte(*split_num_str(ram, 0.0, 'GiB'))
+    disk = to_binary_gigabyte(*split_num_str(disk, 0.0, 'GiB'))
+    duration = to_minutes(*split_num_str(duration, 0.0, 'min'))
+
+    if cpu == 0:
+        raise ValueError("No number of CPU workers given")
+    if ram == 0.0:
+        raise ValueError("No RAM amount given")
+    if cpu < 0 or gpu < 0:
+        raise ValueError("The number of CPU workers or GPUs is negative")
+    if jobs <= 0:
+        raise ValueError("The number of jobs must be positive")
+
+    return cpu, ram, disk, gpu, jobs, duration
+
+
+def evaluate_shape(shape: dict, count_jobs: object) -> dict:
+    """
+    Evaluates a single job shape.
+
+    Args:
+        shape: A row as returned by read_shapes
+        count_jobs: A function as returned by job_counter
+
+    Returns:
+        The input row extended by the total number of matching jobs, the
+        core-hours and the wall time in minutes. Invalid rows get an error
+        message instead, and rows that are no JSON object only get the
+        error. The surplus fields of a CSV row longer than the header,
+        which csv.DictReader keeps under the key None, are left out.
+    """
+    if not isinstance(shape, dict):
+        row = {field: None for field in RESULT_FIELDS}
+        if isinstance(shape, ValueError):
+            row['error'] = f"Malformed JSON line: {shape}"
+        else:
+            row['error'] = f"A job shape must be a JSON object, not {json.dumps(shape)}"
+        return row
+
+    row = {key: value for key, value in shape.items() if key is not None}
+    row.update({field: None for field in RESULT_FIELDS})
+
+    if None in shape:
+        row['error'] = f"The row has more fields than the header: {','.join(map(str, shape[None]))}"
+        return row
+
+    try:
+        cpu, ram, disk, gpu, jobs, duration = parse_shape(shape)
+    except ValueError as e:
+        row['error'] = str(e)
+        return row
+
+    row['total_jobs'] = count_jobs(cpu, ram, disk, gpu)
+    if duration > 0.0 and row['total_jobs'] > 0:
+        row['core_hours'] = core_hours(jobs, duration, cpu)
+        row['wall_time'] = wall_time(jobs, row['total_jobs'], duration)
+
+    return row
+
+
+def run(config: dict, source: str, engine: str = 'dict',
+        output: object = None) -> int:
+    """
+    Evaluates all job shapes of a file against one slot configuration.
+
+    Results are written as soon as a shape is evaluated, in the same format
+    as the input, and are not kept in memory.
+
+    Args:
+        config: The slot configuration as created by collect.collect_slots
+        source: A path to a CSV or JSON lines file, or '-' for stdin
+        engine: Optional. The engine used for checking the slots
+        output: Optional. The text stream to write to, defaults to stdout
+
+    Returns:
+        The number of evaluated job shapes.
+    """
+    output = output or sys.stdout
+    static = examine.filter_slots(config, 'Static')
+    partitionable = examine.filter_slots(config, 'Partitionable')
+    count_jobs = job_counter(static, partitionable, engine)
+
+    stream = sys.stdin if source == '-' else open(source, 'r', newline='')
+    try:
+        fmt, shapes = read_shapes(stream)
+        writer = None
+        n_shapes = 0
+        for n_shapes, shape in enumerate(shapes, start=1):
+            row = evaluate_shape(shape, count_jobs)
+            if fmt == 'jsonl':
+                output.write(json.dumps(row) + '\n')
+            else:
+                if writer is None:
+                    writer = csv.DictWriter(output, fieldnames=list(row))
+                    writer.writeheader()
+                writer.writerow(row)
+            output.flush()
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+    return n_shapes
@@ -0,0 +1,589 @@
+"""Compiler for the ClassAd expressions of job requirements and slot policies."""
+
+import math
+import re
+
+from functools import lru_cache
+
+
+class Undefined:
+    """The UNDEFINED value of ClassAd expressions, e.g. of a missing attribute."""
+
+    def __repr__(self) -> str:
+        return 'UNDEFINED'
+
+    def __bool__(self) -> bool:
+        return False
+
+
+class Error:
+    """The ERROR value of ClassAd expressions, e.g. of comparing a string with a number."""
+
+    def __repr__(self) -> str:
+        return 'ERROR'
+
+    def __bool__(self) -> bool:
+        return False
+
+
+UNDEFINED = Undefined()
+ERROR = Error()
+
+TOKEN = re.compile(r'''
+    \s*(?:
+        (?P<real>(?:[0-9]+\.[0-9]*|\.[0-9]+)(?:[eE][-+]?[0-9]+)?|[0-9]+[eE][-+]?[0-9]+)
+      | (?P<int>0[xX][0-9a-fA-F]+|[0-9]+)
+      | (?P<string>"(?:[^"\\]|\\.)*")
+      | (?P<name>[A-Za-z_][\w]*(?:\.[A-Za-z_][\w]*)*)
+      | (?P<op>=\?=|=!=|==|!=|<=|>=|&&|\|\||[-+*/%<>!?:(),{}])
+    )''', re.VERBOSE)
+
+KEYWORDS = {'true': True, 'false': False, 'undefined': UNDEFINED, 'error': ERROR}
+
+# Binary operators by precedence, lowest first
+PRECEDENCE = [('||',), ('&&',), ('==', '!=', '=?=', '=!=', 'is', 'isnt'),
+              ('<', '<=', '>', '>='), ('+', '-'), ('*', '/', '%')]
+
+
+def tokenize(text: str) -> list:
+    """
+    Splits an expression into (kind, value) tokens.
+
+    Raises:
+        ValueError: If the expression contains an unknown character
+    """
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = TOKEN.match(text, position)
+        if match is None or match.end() == position:
+            raise ValueError(f"Unexpected character in ClassAd expression: {text[position:]}")
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'real':
+            value = float(value)
+        elif kind == 'int':
+            value = int(value, 0)
+        elif kind == 'string':
+            value = re.sub(r'\\(.)', r'\1', value[1:-1])
+        elif kind == 'name' and value.lower() in ('is', 'isnt'):
+            kind, value = 'op', value.lower()
+        tokens.append((kind, value))
+        position = match.end()
+    return tokens
+
+
+class Expression:
+    """
+    A compiled ClassAd expression.
+
+    Calling it with two ads evaluates it, where MY refers to the first ad and
+    TARGET to the second one. The ads are mappings with lower case attribute
+    names. Attribute references without a scope are looked up in MY first,
+    then in TARGET. Values of an ad that are Expression objects are
+    evaluated with the scopes of that ad.
+
+    Attributes:
+        text: The expression as given
+        references: The referenced attributes as (scope, name) pairs, where
+            scope is 'my', 'target' or None and name is lower case
+    """
+
+    def __init__(self, text: str, function: object, references: set):
+        self.text = text
+        self.function = function
+        self.references = frozenset(references)
+
+    def __call__(self, my: dict, target: dict = None) -> object:
+        return self.function(my, target if target is not None else {})
+
+    def attributes(self, other: object = ()) -> list:
+        """
+        Returns the attributes the expression reads from the other ad.
+
+        Args:
+            other: Optional. The names of the attributes of the own (MY) ad,
+                unscoped references to them are not read from the other ad
+
+        Returns:
+            The names in lower case, sorted.
+        """
+        own = {name.lower() for name in other}
+        return sorted({name for scope, name in self.references
+                       if scope == 'target' or scope is None and name not in own})
+
+    def __repr__(self) -> str:
+        return f'Expression({self.text!r})'
+
+
+@lru_cache(maxsize=1024)
+def compile_expression(text: str) -> Expression:
+    """
+    Compiles a ClassAd expression into an Expression.
+
+    Compiled expressions are cached by their text, so the policies shared by
+    thousands of slots are compiled only once.
+
+    Supported are literals (numbers, strings, true, false, undefined,
+    error, lists), attribute references with MY. and TARGET. scopes, the
+    arithmetic, comparison, meta-comparison (=?=, =!=, is, isnt) and logical
+    operators, the conditional operator, and common functions such as
+    ifThenElse, isUndefined, regexp, stringListMember and member.
+
+    Raises:
+        ValueError: If the expression is malformed or uses an unsupported function
+    """
+    references = set()
+    parser = Parser(tokenize(text), references, text)
+    function = parser.expression()
+    if parser.position != len(parser.tokens):
+        raise ValueError(f"Unexpected {parser.tokens[parser.position][1]} in ClassAd expression: {text}")
+    return Expression(text, function, references)
+
+
+class Parser:
+    """A recursive descent parser that turns tokens into evaluation closures."""
+
+    def __init__(self, tokens: list, references: set, text: str):
+        self.tokens = tokens
+        self.position = 0
+        self.references = references
+        self.text = text
+
+    def peek(self) -> tuple:
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def take(self, value: str = None) -> tuple:
+        token = self.peek()
+        if token[0] is None or value is not None and token != ('op', value):
+            raise ValueError(f"Expected {value or 'more'} in ClassAd expression: {self.text}")
+        self.position += 1
+        return token
+
+    def expression(self) -> object:
+        condition = self.binary(0)
+        if self.peek() != ('op', '?'):
+            return condition
+        self.take('?')
+        then = self.expression()
+        self.take(':')
+        otherwise = self.expression()
+        return lambda my, target: conditional(condition(my, target), then, otherwise, my, target)
+
+    def binary(self, level: int) -> object:
+        if level == len(PRECEDENCE):
+            return self.unary()
+        left = self.binary(level + 1)
+        while self.peek()[0] == 'op' and self.peek()[1] in PRECEDENCE[level]:
+            operator = self.take()[1]
+            right = self.binary(level + 1)
+            left = binary_operation(operator, left, right)
+        return left
+
+    def unary(self) -> object:
+        token = self.peek()
+        if token in (('op', '!'), ('op', '-'), ('op', '+')):
+            self.take()
+            operand = self.unary()
+            return unary_operation(token[1], operand)
+        return self.primary()
+
+    def primary(self) -> object:
+        kind, value = self.take()
+        if kind in ('int', 'real', 'string'):
+            return lambda my, target: value
+        if kind == 'op' and value == '(':
+            inner = self.expression()
+            self.take(')')
+            return inner
+        if kind == 'op' and value == '{':
+            items = self.arguments('}')
+            return lambda my, target: tuple(item(my, target) for item in items)
+        if kind != 'name':
+            raise ValueError(f"Unexpected {value} in ClassAd expression: {self.text}")
+
+        if self.peek() == ('op', '('):
+            self.take('(')
+            return call(value, self.arguments(')'), self.text)
+        if value.lower() in KEYWORDS:
+            constant = KEYWORDS[value.lower()]
+            return lambda my, target: constant
+        return self.reference(value)
+
+    def arguments(self, closing: str) -> list:
+        items = []
+        if self.peek() == ('op', closing):
+            self.take(closing)
+            return items
+        while True:
+            items.append(self.expression())
+            if self.take()[1] == closing:
+                return items
+
+    def reference(self, name: str) -> object:
+        scope, _, attribute = name.lower().rpartition('.')
+        if scope not in ('', 'my', 'target'):
+            raise ValueError(f"Unsupported scope {scope} in ClassAd expression: {self.text}")
+        self.references.add((scope or None, attribute))
+        if scope == 'my':
+            return lambda my, target: lookup(my, target, attribute)
+        if scope == 'target':
+            return lambda my, target: lookup(target, my, attribute)
+
+        def unscoped(my: dict, target: dict) -> object:
+            if attribute in my:
+                return lookup(my, target, attribute)
+            return lookup(target, my, attribute)
+        return unscoped
+
+
+def lookup(ad: dict, other: dict, attribute: str) -> object:
+    """Returns the value of an attribute, evaluating expressions with the scopes of its ad."""
+    value = ad.get(attribute, UNDEFINED)
+    if isinstance(value, Expression):
+        return value(ad, other)
+    return value
+
+
+def is_number(value: object) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def to_bool(value: object) -> object:
+    """Converts a value for the logical operators: bool, UNDEFINED or ERROR."""
+    if isinstance(value, bool) or value is UNDEFINED:
+        return value
+    if is_number(value):
+        return value != 0
+    return ERROR
+
+
+def conditional(condition: object, then: object, otherwise: object, my: dict, target: dict) -> object:
+    condition = to_bool(condition)
+    if condition is True:
+        return then(my, target)
+    if condition is False:
+        return otherwise(my, target)
+    return condition
+
+
+def arithmetic(operator: str, left: object, right: object) -> object:
+    if left is ERROR or right is ERROR:
+        return ERROR
+    if left is UNDEFINED or right is UNDEFINED:
+        return UNDEFINED
+    left = int(left) if isinstance(left, bool) else left
+    right = int(right) if isinstance(right, bool) else right
+    if not is_number(left) or not is_number(right):
+        return ERROR
+    if operator == '+':
+        return left + right
+    if operator == '-':
+        return left - right
+    if operator == '*':
+        return left * right
+    if right == 0:
+        return ERROR
+    if operator == '/':
+        return int(left / right) if isinstance(left, int) and isinstance(right, int) else left / right
+    return int(math.fmod(left, right)) if isinstance(left, int) and isinstance(right, int) \
+        else math.fmod(left, right)
+
+
+def comparison(operator: str, left: object, right: object) -> object:
+    if left is ERROR or right is ERROR:
+        return ERROR
+    if left is UNDEFINED or right is UNDEFINED:
+        return UNDEFINED
+    if isinstance(left, str) and isinstance(right, str):
+        left, right = left.lower(), right.lower()
+    else:
+        left = int(left) if isinstance(left, bool) else left
+        right = int(right) if isinstance(right, bool) else right
+        if not is_number(left) or not is_number(right):
+            return ERROR
+    if operator == '==':
+        return left == right
+    if operator == '!=':
+        return left != right
+    if operator == '<':
+        return left < right
+    if operator == '<=':
+        return left <= right
+    if operator == '>':
+        return left > right
+    return left >= right
+
+
+def identical(left: object, right: object) -> bool:
+    """The meta-comparison =?=: the same type and value, strings case-sensitive."""
+    if is_number(left) and is_number(right):
+        return left == right
+    return type(left) is type(right) and left == right
+
+
+def binary_operation(operator: str, left: object, right: object) -> object:
+    """Returns the closure of a binary operation on two closures."""
+    if operator == '&&':
+        def logical_and(my: dict, target: dict) -> object:
+            first = to_bool(left(my, target))
+            if first is False or first is ERROR:
+                return first
+            second = to_bool(right(my, target))
+            if second is False or second is ERROR:
+                return second
+            return UNDEFINED if UNDEFINED in (first, second) else True
+        return logical_and
+    if operator == '||':
+        def logical_or(my: dict, target: dict) -> object:
+            first = to_bool(left(my, target))
+            if first is True or first is ERROR:
+                return first
+            second = to_bool(right(my, target))
+            if second is True or second is ERROR:
+                return second
+            return UNDEFINED if UNDEFINED in (first, second) else False
+        return logical_or
+    if operator in ('=?=', 'is'):
+        return lambda my, target: identical(left(my, target), right(my, target))
+    if operator in ('=!=', 'isnt'):
+        return lambda my, target: not identical(left(my, target), right(my, target))
+    if operator in ('+', '-', '*', '/', '%'):
+        return lambda my, target: arithmetic(operator, left(my, target), right(my, target))
+    return lambda my, target: comparison(operator, left(my, target), right(my, target))
+
+
+def unary_operation(operator: str, operand: object) -> object:
+    """Returns the closure of a unary operation on a closure."""
+    if operator == '!':
+        def logical_not(my: dict, target: dict) -> object:
+            value = to_bool(operand(my, target))
+            return not value if isinstance(value, bool) else value
+        return logical_not
+    if operator == '-':
+        return lambda my, target: arithmetic('-', 0, operand(my, target))
+    return lambda my, target: arithmetic('+', 0, operand(my, target))
+
+
+def strict(function: object) -> object:
+    """Wraps a function so that UNDEFINED and ERROR arguments are passed through."""
+    def wrapper(*values: object) -> object:
+        for value in values:
+            if value is ERROR or value is UNDEFINED:
+                return value
+        try:
+            return function(*values)
+        except (TypeError, ValueError, IndexError, re.error):
+            return ERROR
+    return wrapper
+
+
+def string_list(items: str, delimiters: str = ', ') -> list:
+    return [item for item in re.split('[' + re.escape(delimiters) + ']+', items) if item]
+
+
+def regexp(pattern: str, target: str, options: str = '') -> bool:
+    flags = re.IGNORECASE if 'i' in options.lower() else 0
+    return re.search(pattern, target, flags) is not None
+
+
+def to_int(value: object) -> int:
+    if isinstance(value, str):
+        value = float(value)
+    return int(value)
+
+
+def to_real(value: object) -> float:
+    return float(value)
+
+
+def to_string(value: object) -> str:
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+
+FUNCTIONS = {
+    'isundefined': lambda value: value is UNDEFINED,
+    'iserror': lambda value: value is ERROR,
+    'isstring': lambda value: isinstance(value, str),
+    'isinteger': lambda value: isinstance(value, int) and not isinstance(value, bool),
+    'isreal': lambda value: isinstance(value, float),
+    'isboolean': lambda value: isinstance(value, bool),
+    'islist': lambda value: isinstance(value, tuple),
+    'int': strict(to_int),
+    'real': strict(to_real),
+    'string': strict(to_string),
+    'floor': strict(lambda value: int(math.floor(value))),
+    'ceiling': strict(lambda value: int(math.ceil(value))),
+    'round': strict(lambda value: int(round(value))),
+    'toupper': strict(lambda value: value.upper()),
+    'tolower': strict(lambda value: value.lower()),
+    'size': strict(lambda value: len(value)),
+    'strcat': strict(lambda *values: ''.join(to_string(value) for value in values)),
+    'substr': strict(lambda value, offset, length=None: value[offset:] if length is None
+                     else value[offset:offset + length]),
+    'regexp': strict(regexp),
+    'stringlistmember': strict(lambda item, items, delimiters=', ':
+                               item in string_list(items, delimiters)),
+    'stringlistimember': strict(lambda item, items, delimiters=', ':
+                                item.lower() in (entry.lower() for entry in string_list(items, delimiters))),
+    'member': strict(lambda item, items: any(identical(item, entry) or
+                                             comparison('==', item, entry) is True for entry in items)),
+    'min': strict(lambda *values: min(values)),
+    'max': strict(lambda *values: max(values)),
+}
+
+
+def call(name: str, arguments: list, text: str) -> object:
+    """Returns the closure of a function call."""
+    if name.lower() == 'ifthenelse':
+        if len(arguments) != 3:
+            raise ValueError(f"ifThenElse needs 3 arguments in ClassAd expression: {text}")
+        condition, then, otherwise = arguments
+        return lambda my, target: conditional(condition(my, target), then, otherwise, my, target)
+
+    function = FUNCTIONS.get(name.lower())
+    if function is None:
+        raise ValueError(f"Unsupported function {name} in ClassAd expression: {text}")
+
+    def evaluate_call(my: dict, target: dict) -> object:
+        try:
+            return function(*(argument(my, target) for argument in arguments))
+        except TypeError:
+            return ERROR
+    return evaluate_call
+
+
+# The attributes of a vanilla universe job ad on submission, which START and
+# requirements expressions commonly read, by lower case name
+JOB_DEFAULTS = {
+    'jobuniverse': 5,
+    'jobstatus': 1,
+    'numjobstarts': 0,
+    'numshadowstarts': 0,
+    'jobruncount': 0,
+    'numrestarts': 0,
+    'numckpts': 0,
+    'jobprio': 0,
+    'minhosts': 1,
+    'maxhosts': 1,
+    'currenthosts': 0,
+    'wantcheckpoint': False,
+    'wantremotesyscalls': False,
+}
+
+
+def job_ad(cpu: int, gpu: int, ram: float, disk: float, attributes: dict = None,
+           owner: str = None) -> dict:
+    """
+    Synthesises the ad of a job with the given requests.
+
+    The ad starts from JOB_DEFAULTS, an idle vanilla universe job that has
+    not run yet, so policies like TARGET.JobUniverse == 5 can be evaluated.
+    The given attributes take precedence over these defaults.
+
+    Args:
+        cpu: The number of CPU cores
+        gpu: The number of GPUs
+        ram: The RAM in GiB
+        disk: The disk space in GiB
+        attributes: Optional. Further attributes as ClassAd expression text
+            by name, e.g. the +Name attributes of a submit file
+        owner: Optional. The Owner of the job
+
+    Returns:
+        The job ad with lower case attribute names and the requests in the
+        units of HTCondor (RequestMemory in MiB, RequestDisk in KiB).
+
+    Raises:
+        ValueError: If an attribute is not a valid expression
+    """
+    ad = dict(JOB_DEFAULTS, requestcpus=cpu, requestgpus=gpu, requestmemory=int(ram * 1024),
+              requestdisk=int(disk * 1024**2))
+    if owner is not None:
+        ad['owner'] = owner
+    for name, text in (attributes or {}).items():
+        ad[name.lower()] = compile_expression(text)
+    return ad
+
+
+def slot_ad(slot: dict) -> dict:
+    """Returns the ClassAd attributes of a slot record with lower case names."""
+    return slot.get('Attributes') or {}
+
+
+def matcher(expression: str, job: dict, slot_scope: str = 'target') -> object:
+    """
+    Creates a function that tells whether a slot matches an expression.
+
+    The expression is compiled once. The results are memoised by the values
+    of the slot attributes the expression reads, so a pool with a few
+    hundred distinct slot configurations needs only a few hundred
+    evaluations, however many slots it has.
+
+    Args:
+        expression: The ClassAd expression, e.g. the requirements of a job
+        job: The job ad with lower case attribute names
+        slot_scope: Optional. 'target' if the expression belongs to the job
+            (requirements), 'my' if it belongs to the slot (START)
+
+    Returns:
+        A function (slot) -> bool, which is True if the expression
+        evaluates to true. The slot attributes are read from
+        slot['Attributes'], see collect.format_slot.
+    """
+    compiled = compile_expression(expression)
+    names = compiled.attributes(job) if slot_scope == 'target' else \
+        sorted({name for scope, name in compiled.references if scope != 'target'})
+    results = {}
+
+    def matches(slot: dict) -> bool:
+        ad = slot_ad(slot)
+        key = tuple(ad.get(name) for name in names)
+        if key not in results:
+            value = compiled(job, ad) if slot_scope == 'target' else compiled(ad, job)
+            results[key] = value is True
+        return results[key]
+
+    matches.attributes = names
+    matches.evaluations = results
+    return matches
+
+
+def policy_matcher(job: dict, attribute: str = 'start') -> object:
+    """
+    Creates a function that tells whether the policy of a slot accepts a job.
+
+    The policy, e.g. START, is an expression of the slot, evaluated with MY
+    referring to the slot and TARGET to the job. Each policy is compiled
+    once by its text, since the slots of a pool share a handful of
+    policies. The results are memoised by the attributes of the slot.
+
+    Args:
+        job: The job ad with lower case attribute names
+        attribute: Optional. The lower case name of the policy attribute
+
+    Returns:
+        A function (slot) -> bool, which is True if the policy evaluates to
+        true or the slot has no such attribute. A policy that cannot be
+        compiled rejects the job.
+    """
+    results = {}
+
+    def accepts(slot: dict) -> bool:
+        ad = slot_ad(slot)
+        key = tuple(sorted(ad.items()))
+        if key not in results:
+            policy = ad.get(attribute, True)
+            if isinstance(policy, str):
+                try:
+                    policy = compile_expression(policy)(ad, job)
+                except ValueError:
+                    policy = ERROR
+            results[key] = policy is True
+        return results[key]
+
+    accepts.evaluations = results
+    return accepts
@@ -1,40 +1,492 @@
 """Retrieve, format, and store a system's condor slot configuration."""
 
+import glob
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+from os.path import join as opj
+
+from htcrystalball import SLOTS_CONFIGURATION
+from htcrystalball.records import SlotRecord, field_getter, to_dicts, to_slot_records
 from htcrystalball.utils import kib_to_gib, mib_to_gib
 
+# Slot policies kept as expression text, together with the slot attributes they read
+POLICIES = ('start',)
+
+# The name of a dynamic slot, e.g. slot1_3@node, and of its partitionable parent, slot1@node
+DYNAMIC_NAME = re.compile(r'^(.*)_[0-9]+@(.*)$')
+
+# The resources a dynamic slot claims from its parent, in the units of the slot ads
+CLAIMED = ('TotalSlotCpus', 'TotalSlotGPUs', 'TotalSlotDisk', 'TotalSlotMemory')
+
+# The number of cached snapshots kept, the most recently written ones
+CACHE_FILES = 16
+
+key_fields = field_getter('TotalSlotCpus', 'TotalSlotGPUs', 'TotalSlotDisk',
+                          'TotalSlotMemory', 'SlotType')
+
+
+def slot_key(nodename: str, slot: dict) -> tuple:
+    """
+    Builds the hashable key that identifies a slot configuration on a node.
+
+    Two slots of a node share a key exactly when their formatted dicts are
+    equal, so the key can replace list scans for deduplication. The extra
+    Attributes of a slot are part of the key, so slots that differ in an
+    attribute of the job requirements are kept apart.
+    """
+    attributes = slot.get('Attributes')
+    if attributes:
+        return (nodename, *key_fields(slot), tuple(sorted(attributes.items())))
+    return (nodename, *key_fields(slot))
+
+
+def attribute_value(value: object) -> object:
+    """Returns an attribute value of a slot ad as a hashable, JSON serializable value."""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    # expressions and lists of the bindings are kept as their ClassAd text
+    return str(value)
+
+
+def slot_attributes(slot: object, attributes: object) -> dict:
+    """
+    Returns further attributes of a slot ad by lower case name.
+
+    A policy of POLICIES is kept as expression text, and the slot attributes
+    it reads are kept as well. Their names are only known from the policy,
+    so the ads need to be queried without a projection. Expressions the
+    bindings can evaluate on their own are kept as their value.
+    """
+    # attribute names of ClassAds are case-insensitive
+    names = {str(name).lower(): name for name in slot}
+    wanted = [name for name in attributes if name in names]
+    for policy in POLICIES:
+        if policy in wanted:
+            from htcrystalball import classad
+
+            try:
+                references = classad.compile_expression(str(slot[names[policy]])).references
+            except ValueError:
+                continue
+            wanted += sorted(name for scope, name in references if scope != 'target' and name in names)
+
+    evaluate = getattr(slot, 'eval', None)
+    result = {}
+    for name in wanted:
+        value = slot[names[name]]
+        if evaluate is not None and name not in POLICIES and attribute_value(value) is not value:
+            value = evaluate(names[name])
+        result[name] = attribute_value(value)
+    return result
+
+
+def format_slot(slot: object, attributes: object = ()) -> SlotRecord:
+    """
+    Converts a slot ad of the collector into a slot configuration record.
+
+    The benchmark ratings Mips and KFlops are kept if the ad has them. They
+    vary between measurements and are therefore not part of the slot_key.
+
+    Args:
+        slot: The slot ad
+        attributes: Optional. The names of further attributes to keep in
+            Attributes with lower case names, e.g. those read by the job
+            requirements, see slot_attributes. Missing attributes are left
+            out.
+    """
+    slot_as_dict = SlotRecord(
+        TotalSlotCpus=int(slot.get('TotalSlotCpus', 0)),
+        TotalSlotGPUs=int(slot.get('TotalSlotGPUs', 0)),
+        TotalSlotDisk=kib_to_gib(float(slot.get('TotalSlotDisk', 0.0))),
+        TotalSlotMemory=mib_to_gib(float(slot.get('TotalSlotMemory', 0.0))),
+        SlotType=slot['SlotType'],
+        Mips=int(slot['Mips']) if slot.get('Mips') is not None else None,
+        KFlops=int(slot['KFlops']) if slot.get('KFlops') is not None else None
+    )
+    kept = slot_attributes(slot, attributes) if attributes else None
+    if kept:
+        slot_as_dict['Attributes'] = kept
+
+    return slot_as_dict
+
+
+def add_slot(unique_slots: dict, seen: dict, slot: object, attributes: object = ()) -> tuple:
+    """
+    Adds a slot ad to a deduplicated slot configuration.
+
+    Args:
+        unique_slots: The slot configuration as created by collect_slots
+        seen: The slot configuration records of unique_slots by slot_key
+        slot: The slot ad to add
+        attributes: Optional. The further attributes to keep, see format_slot
+
+    Returns:
+        The key of the slot configuration the ad was counted for.
+    """
+    nodename = slot['Machine']
+    slot_as_dict = format_slot(slot, attributes)
 
-def collect_slots(content: object) -> dict:
+    key = slot_key(nodename, slot_as_dict)
+    if key in seen:
+        seen[key]['SimSlots'] += 1
+    else:
+        slot_as_dict['SimSlots'] = 1
+        seen[key] = slot_as_dict
+        unique_slots.setdefault(nodename, []).append(slot_as_dict)
+
+    return key
+
+
+def remove_slot(unique_slots: dict, seen: dict, key: tuple) -> None:
+    """
+    Removes one slot counted for key from a deduplicated slot configuration.
+
+    The configuration is dropped once no slot is left for it, and the node
+    once it has no configurations left.
+    """
+    slot_as_dict = seen[key]
+    slot_as_dict['SimSlots'] -= 1
+    if slot_as_dict['SimSlots'] > 0:
+        return
+
+    del seen[key]
+    nodename = key[0]
+    unique_slots[nodename] = [slot for slot in unique_slots[nodename] if slot is not slot_as_dict]
+    if not unique_slots[nodename]:
+        del unique_slots[nodename]
+
+
+def collect_slots(content: object, attributes: object = ()) -> dict:
     """Get the condor config and create a dict."""
     unique_slots = {}
-    sim_slot_values = []
+    seen = {}
 
     for slot in content:
-        nodename = slot['Machine']
-
-        slot_as_dict = {
-            'TotalSlotCpus': int(slot.get('TotalSlotCpus', 0)),
-            'TotalSlotGPUs': int(slot.get('TotalSlotGPUs', 0)),
-            'TotalSlotDisk': kib_to_gib(float(slot.get('TotalSlotDisk', 0.0))),
-            'TotalSlotMemory': mib_to_gib(float(slot.get('TotalSlotMemory', 0.0))),
-            'SlotType': slot['SlotType']
-        }
-
-        if nodename not in unique_slots:
-            unique_slots[nodename] = []
-            unique_slots[nodename].append(slot_as_dict)
-            sim_slot_values.append({'node': nodename, "slot": slot_as_dict, "sim_slots": 1})
-        elif slot_as_dict not in unique_slots[nodename]:
-            unique_slots[nodename].append(slot_as_dict)
-            sim_slot_values.append({'node': nodename, "slot": slot_as_dict, "sim_slots": 1})
-        elif slot_as_dict in unique_slots[nodename]:
-            for slot_number in range(len(sim_slot_values)):
-                if slot_as_dict == sim_slot_values[slot_number]["slot"] \
-                        and nodename == sim_slot_values[slot_number]["node"]:
-                    sim_slot_values[slot_number]["sim_slots"] += 1
-
-    for elem in sim_slot_values:
-        for slot_number in range(len(unique_slots[elem["node"]])):
-            if elem["slot"] == unique_slots[elem["node"]][slot_number]:
-                unique_slots[elem["node"]][slot_number]["SimSlots"] = elem["sim_slots"]
+        add_slot(unique_slots, seen, slot, attributes)
 
     return unique_slots
+
+
+def claimed_resources(dynamic: object) -> dict:
+    """
+    Sums up the resources claimed by dynamic slots per partitionable parent.
+
+    The dynamic slots are grouped by the name of their parent in a single
+    pass, so tens of thousands of them are only held as one sum per parent.
+
+    Args:
+        dynamic: The ads of the dynamic slots with Name and the attributes
+            of CLAIMED
+
+    Returns:
+        The claimed cpus, GPUs, disk (KiB) and memory (MiB) as a list by the
+        name of the parent slot.
+    """
+    claimed = {}
+    for slot in dynamic:
+        match = DYNAMIC_NAME.match(str(slot.get('Name', '')))
+        if match is None:
+            continue
+        parent = f'{match.group(1)}@{match.group(2)}'
+        totals = claimed.get(parent)
+        if totals is None:
+            totals = claimed[parent] = [0, 0, 0.0, 0.0]
+        totals[0] += int(slot.get('TotalSlotCpus', 0))
+        totals[1] += int(slot.get('TotalSlotGPUs', 0))
+        totals[2] += float(slot.get('TotalSlotDisk', 0.0))
+        totals[3] += float(slot.get('TotalSlotMemory', 0.0))
+    return claimed
+
+
+def subtract_claimed(content: object, claimed: dict) -> object:
+    """
+    Passes slot ads through with the resources that are in use subtracted.
+
+    A partitionable slot keeps only the resources not claimed by its dynamic
+    slots. A static slot that is claimed has no resources left. The ads of
+    content are not modified, changed ones are passed on as copies.
+
+    Args:
+        content: An iterable of slot ads with Name and State
+        claimed: The claimed resources by parent name, see claimed_resources
+    """
+    for slot in content:
+        if slot['SlotType'] == 'Partitionable':
+            totals = claimed.get(slot.get('Name'))
+            if totals is not None:
+                slot = dict(slot)
+                for attribute, used in zip(CLAIMED, totals):
+                    slot[attribute] = max(0.0, float(slot.get(attribute, 0.0)) - used)
+        elif slot['SlotType'] == 'Static' and slot.get('State') == 'Claimed':
+            slot = dict(slot, **{attribute: 0 for attribute in CLAIMED})
+        yield slot
+
+
+def report_progress(content: object, stream: object = None, interval: float = 0.5) -> object:
+    """
+    Passes slot ads through unchanged while reporting how many arrived.
+
+    The count is rewritten on a single line of stream at most every interval
+    seconds and once more when content is exhausted.
+
+    Args:
+        content: An iterable of slot ads, e.g. a streaming collector query
+        stream: Optional. The text stream to report to, defaults to stderr
+        interval: Optional. The minimum number of seconds between two reports
+    """
+    stream = stream or sys.stderr
+    count = 0
+    reported = time.monotonic()
+
+    for count, slot in enumerate(content, start=1):
+        yield slot
+        if count % 1000 == 0 and time.monotonic() - reported >= interval:
+            reported = time.monotonic()
+            stream.write(f"\rCollected {count} slot ads")
+            stream.flush()
+
+    stream.write(f"\rCollected {count} slot ads\n")
+    stream.flush()
+
+
+def merge_pools(configs: dict) -> dict:
+    """
+    Merges the slot configurations of several pools into one.
+
+    Each slot is tagged with the pool it belongs to in 'Pool'. Nodes of the
+    same name in different pools keep their slots apart by this tag.
+
+    Args:
+        configs: The slot configurations as created by collect_slots by pool
+
+    Returns:
+        The merged slot configuration.
+    """
+    merged = {}
+    for pool, config in configs.items():
+        for nodename, slots in config.items():
+            merged.setdefault(nodename, []).extend(SlotRecord(**dict(slot, Pool=pool)) for slot in slots)
+
+    return merged
+
+
+def query_pools(load: object, pools: list, timeout: float) -> (dict, dict):
+    """
+    Loads the slot configurations of several pools concurrently.
+
+    Every pool is loaded in its own daemon thread. Threads still running
+    after timeout seconds are abandoned, so a hanging collector neither
+    delays the result nor the exit of the program.
+
+    Args:
+        load: A function taking a pool and returning its slot configuration
+        pools: The pools to load, duplicates are loaded once
+        timeout: The number of seconds to wait for all pools
+
+    Returns:
+        The slot configurations by pool in the order of pools, and an error
+        message by pool for the pools that failed or timed out.
+    """
+    pools = list(dict.fromkeys(pools))
+    configs = {}
+    errors = {}
+
+    def load_pool(pool: str) -> None:
+        try:
+            configs[pool] = load(pool)
+        except (Exception, SystemExit) as e:
+            errors[pool] = str(e) or type(e).__name__
+
+    threads = [threading.Thread(target=load_pool, args=(pool,), daemon=True) for pool in pools]
+    for thread in threads:
+        thread.start()
+
+    deadline = time.monotonic() + timeout
+    for pool, thread in zip(pools, threads):
+        thread.join(max(0.0, deadline - time.monotonic()))
+        if thread.is_alive():
+            errors[pool] = f'no answer within {timeout:g} seconds'
+
+    return {pool: configs[pool] for pool in pools if pool in configs and pool not in errors}, \
+        {pool: errors[pool] for pool in pools if pool in errors}
+
+
+def snapshot_slots(content: object, attributes: object = ()) -> dict:
+    """
+    Collects the slot configuration like collect_slots and remembers which
+    slot ad was counted for which configuration.
+
+    The slot ads need the attributes Name and LastHeardFrom in addition to
+    the ones used by collect_slots. The further attributes are kept as in
+    format_slot.
+
+    Returns:
+        A snapshot with the slot configuration in 'slots', the names of the
+        slots counted for each configuration in 'members', see member_names,
+        and the latest LastHeardFrom in 'last_heard'. It can be brought up to
+        date with refresh_slots.
+    """
+    unique_slots = {}
+    seen = {}
+    names = {}
+    last_heard = 0
+
+    # content may be a stream of ads, so each ad is folded in and dropped right away
+    for slot in content:
+        key = add_slot(unique_slots, seen, slot, attributes)
+        names.setdefault(key, []).append(slot['Name'])
+        last_heard = max(last_heard, int(slot.get('LastHeardFrom', 0)))
+
+    return {'slots': unique_slots, 'members': member_names(unique_slots, names), 'last_heard': last_heard}
+
+
+def member_names(unique_slots: dict, names: dict) -> dict:
+    """
+    Lists the slot names counted for each configuration of a slot configuration.
+
+    The names are listed per node in the order of its configurations, so a
+    configuration is found by its position rather than by a copy of its key.
+    The cache thus grows with the slot names and the configurations, and a
+    snapshot is loaded without rebuilding the keys.
+
+    Args:
+        unique_slots: The slot configuration as created by collect_slots
+        names: The slot names by slot_key
+
+    Returns:
+        The lists of slot names by node, one per configuration.
+    """
+    return {node: [names[slot_key(node, slot)] for slot in slots] for node, slots in unique_slots.items()}
+
+
+def refresh_slots(snapshot: dict, changed: object, names: object, attributes: object = ()) -> dict:
+    """
+    Updates a snapshot in place with the slot ads that changed since it was taken.
+
+    Args:
+        snapshot: A snapshot as created by snapshot_slots
+        changed: The slot ads with a LastHeardFrom of at least the snapshot's
+            last_heard. Ads that did not change are counted only once.
+        names: The names of all slots currently in the pool. Slots of the
+            snapshot that are missing here are removed.
+        attributes: Optional. The further attributes to keep, as given to
+            snapshot_slots
+
+    Returns:
+        The updated snapshot.
+    """
+    unique_slots = snapshot['slots']
+    seen = {}
+    members = {}
+    for node, slots in unique_slots.items():
+        for slot, names_of_slot in zip(slots, snapshot['members'][node]):
+            key = slot_key(node, slot)
+            seen[key] = slot
+            members.update(dict.fromkeys(names_of_slot, key))
+
+    for slot in changed:
+        name = slot['Name']
+        if name in members:
+            remove_slot(unique_slots, seen, members[name])
+        members[name] = add_slot(unique_slots, seen, slot, attributes)
+        snapshot['last_heard'] = max(snapshot['last_heard'], int(slot.get('LastHeardFrom', 0)))
+
+    for name in set(members).difference(names):
+        remove_slot(unique_slots, seen, members.pop(name))
+
+    grouped = {}
+    for name, key in members.items():
+        grouped.setdefault(key, []).append(name)
+    snapshot['members'] = member_names(unique_slots, grouped)
+    return snapshot
+
+
+def cache_file(host: str, projection: list, directory: str = None) -> str:
+    """
+    Returns the path of the slot cache for a collector and query projection.
+
+    The file name is derived from both values, so a different collector host
+    or a changed QUERY_DATA never reuses a stale slot configuration.
+    """
+    digest = hashlib.sha1(json.dumps([host, list(projection)]).encode()).hexdigest()
+    return opj(directory or SLOTS_CONFIGURATION, f'slots-{digest[:16]}.json')
+
+
+def load_snapshot(host: str, projection: list, directory: str = None) -> dict:
+    """
+    Loads the cached snapshot of a slot configuration regardless of its age.
+
+    Returns:
+        The snapshot as stored by store_snapshot with its creation time in
+        'created', or None if there is no cache for host and projection.
+    """
+    try:
+        with open(cache_file(host, projection, directory), 'r') as cache:
+            cached = json.load(cache)
+        if cached.get('host') != host or cached.get('projection') != list(projection):
+            return None
+        cached['slots'] = to_slot_records(cached['slots'])
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+    return cached
+
+
+def store_snapshot(snapshot: dict, host: str, projection: list,
+                   directory: str = None) -> None:
+    """
+    Stores a snapshot as created by snapshot_slots in the cache.
+
+    The cache is written to a temporary file first and then moved into place,
+    so concurrent calls never read a partially written cache. A cache that
+    cannot be written is silently skipped. Older snapshots are pruned with
+    prune_cache.
+    """
+    path = cache_file(host, projection, directory)
+    cached = dict(snapshot)
+    cached.update({
+        'slots': to_dicts(snapshot['slots']),
+        'host': host,
+        'projection': list(projection),
+        'created': time.time()
+    })
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as cache:
+            json.dump(cached, cache)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+    prune_cache(os.path.dirname(path))
+
+
+def prune_cache(directory: str = None, keep: int = CACHE_FILES) -> None:
+    """
+    Removes all but the keep most recently written snapshots from the cache.
+
+    Every collector and set of queried attributes, e.g. of --requirements,
+    gets a cache file of its own, so the files of those no longer used would
+    pile up otherwise. Files that vanish or cannot be removed meanwhile, e.g.
+    by a concurrent call, are skipped.
+    """
+    snapshots = []
+    for path in glob.glob(opj(directory or SLOTS_CONFIGURATION, 'slots-*.json')):
+        try:
+            snapshots.append((os.path.getmtime(path), path))
+        except OSError:
+            continue
+
+    for _, path in sorted(snapshots, reverse=True)[keep:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
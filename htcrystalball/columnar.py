@@ -0,0 +1,161 @@
+"""Vectorized slot checking on columnar slot configurations using NumPy."""
+
+import numpy as np
+
+from htcrystalball.examine import best_nodes, node_key
+from htcrystalball.records import PreviewRecord
+
+
+def to_columns(slots: list) -> dict:
+    """
+    Converts a list of slot configurations into contiguous arrays.
+
+    Args:
+        slots: A list of slot configurations as returned by examine.filter_slots
+
+    Returns:
+        A dictionary of one array per resource and the number of similar slots.
+    """
+    return {
+        'TotalSlotCpus': np.fromiter((slot['TotalSlotCpus'] for slot in slots),
+                                     dtype=np.int64, count=len(slots)),
+        'TotalSlotMemory': np.fromiter((slot['TotalSlotMemory'] for slot in slots),
+                                       dtype=np.float64, count=len(slots)),
+        'TotalSlotDisk': np.fromiter((slot['TotalSlotDisk'] for slot in slots),
+                                     dtype=np.float64, count=len(slots)),
+        'TotalSlotGPUs': np.fromiter((slot['TotalSlotGPUs'] for slot in slots),
+                                     dtype=np.int64, count=len(slots)),
+        'SimSlots': np.fromiter((slot['SimSlots'] for slot in slots),
+                                dtype=np.int64, count=len(slots))
+    }
+
+
+def fit_jobs(columns: dict, n_cpu: int, ram: float, disk: float,
+             n_gpu: int) -> (np.ndarray, np.ndarray):
+    """
+    Calculates the fit mask and the number of similar jobs for all slots at once.
+
+    Uses the same semantics as examine.check_slot_by_type: a slot that does
+    not fit a single job runs zero jobs, otherwise the scarcest requested
+    resource limits the number of jobs.
+    """
+    fits = (n_cpu <= columns['TotalSlotCpus']) & (ram <= columns['TotalSlotMemory']) \
+        & (disk <= columns['TotalSlotDisk']) & (n_gpu <= columns['TotalSlotGPUs'])
+
+    if n_cpu <= 0:
+        return fits, np.zeros(len(fits), dtype=np.int64)
+
+    jobs = np.floor(columns['TotalSlotCpus'] / n_cpu)
+    if ram > 0.0:
+        jobs = np.minimum(jobs, np.floor(columns['TotalSlotMemory'] / ram))
+    if disk > 0.0:
+        jobs = np.minimum(jobs, np.floor(columns['TotalSlotDisk'] / disk))
+    if n_gpu > 0:
+        jobs = np.minimum(jobs, np.floor(columns['TotalSlotGPUs'] / n_gpu))
+
+    return fits, np.where(fits, jobs, 0).astype(np.int64)
+
+
+def count_jobs(columns: dict, n_cpus: np.ndarray, rams: np.ndarray, disks: np.ndarray,
+               n_gpu: int, chunk_cells: int = 1 << 22) -> np.ndarray:
+    """
+    Counts the jobs of many job shapes on all slots at once.
+
+    Uses the fit semantics of fit_jobs, broadcast over a shapes x slots
+    matrix. The shapes are taken in chunks of at most chunk_cells cells, so
+    the memory needed stays bounded for large pools.
+
+    Args:
+        columns: The slot columns as returned by to_columns
+        n_cpus: The CPUs of each shape, at least 1
+        rams: The RAM of each shape
+        disks: The disk space of each shape
+        n_gpu: The number of GPUs of every shape
+
+    Returns:
+        The number of jobs of each shape that can run at once.
+    """
+    totals = np.zeros(len(n_cpus), dtype=np.int64)
+    cpus = columns['TotalSlotCpus'][np.newaxis, :]
+    memory = columns['TotalSlotMemory'][np.newaxis, :]
+    disk = columns['TotalSlotDisk'][np.newaxis, :]
+    gpus = columns['TotalSlotGPUs']
+    step = max(1, chunk_cells // max(1, len(columns['SimSlots'])))
+    for start in range(0, len(n_cpus), step):
+        n_cpu = np.asarray(n_cpus[start:start + step])[:, np.newaxis]
+        ram = np.asarray(rams[start:start + step], dtype=np.float64)[:, np.newaxis]
+        job_disk = np.asarray(disks[start:start + step], dtype=np.float64)[:, np.newaxis]
+
+        jobs = np.floor_divide(cpus, n_cpu)
+        jobs = np.where(ram > 0.0, np.minimum(jobs, np.floor(memory / np.where(ram > 0.0, ram, 1.0))), jobs)
+        jobs = np.where(job_disk > 0.0, np.minimum(jobs, np.floor(disk / np.where(job_disk > 0.0, job_disk, 1.0))),
+                        jobs)
+        fits = (n_cpu <= cpus) & (ram <= memory) & (job_disk <= disk) & (n_gpu <= gpus)
+        if n_gpu > 0:
+            jobs = np.minimum(jobs, gpus // n_gpu)
+        totals[start:start + step] = (np.where(fits, jobs, 0) * columns['SimSlots']).sum(axis=1)
+    return totals
+
+
+def preview(slot: dict, fits: bool, n_jobs: int, n_cpu: int, ram: float,
+            disk: float, n_gpu: int) -> PreviewRecord:
+    """Builds the preview record of a single slot for a precomputed number of jobs."""
+    # the requested resources are those of all similar jobs if the job fits and of a single job otherwise
+    scale = n_jobs if fits else 1
+    return PreviewRecord(
+        Machine=slot['Machine'],
+        SlotType=slot['SlotType'],
+        fits='YES' if fits else 'NO',
+        TotalSlotCpus=slot['TotalSlotCpus'],
+        requested_cpu=n_cpu*scale,
+        TotalSlotGPUs=slot['TotalSlotGPUs'],
+        requested_gpu=n_gpu*scale,
+        TotalSlotMemory=slot['TotalSlotMemory'],
+        requested_ram=ram*scale,
+        TotalSlotDisk=slot['TotalSlotDisk'],
+        requested_disk=disk*scale,
+        sim_jobs=n_jobs if fits else 0,
+        SimSlots=slot['SimSlots'],
+        Pool=slot.get('Pool')
+    )
+
+
+def check_slots(static: list, partitionable: list, n_cpus: int,
+                ram: float, disk_space: float, n_gpus: int, max_nodes: int,
+                verbose: bool) -> (dict, int):
+    """
+    Checks all slots in one vectorized pass.
+
+    Preview dictionaries are only built for the rows that are printed: all
+    slots in verbose mode, the slots of the best max_nodes nodes if a node
+    limit is given, and none otherwise.
+
+    Returns:
+        The result dictionary as built by examine.evaluate and the total
+        number of matching jobs.
+    """
+    slots = partitionable + static
+    columns = to_columns(slots)
+    fits, jobs = fit_jobs(columns, n_cpus, ram, disk_space, n_gpus)
+
+    # same order as examine.order_node_preview: jobs descending, CPUs ascending, stable
+    order = np.lexsort((np.arange(len(slots)), columns['TotalSlotCpus'], -jobs))
+    slot_jobs = jobs * columns['SimSlots']
+    if max_nodes != 0:
+        node_jobs = {}
+        for row, n_jobs in zip(order.tolist(), slot_jobs[order].tolist()):
+            node = node_key(slots[row])
+            node_jobs[node] = node_jobs.get(node, 0) + n_jobs
+        nodes = best_nodes(node_jobs, max_nodes)
+        order = order[[node_key(slots[row]) in nodes for row in order.tolist()]]
+    elif not verbose:
+        order = order[:0]
+
+    total_jobs = int(slot_jobs[order].sum()) if max_nodes != 0 else int(slot_jobs.sum())
+
+    previews = [
+        preview(slots[row], bool(fits[row]), int(jobs[row]), n_cpus, ram, disk_space, n_gpus)
+        for row in order.tolist()
+    ]
+
+    return {'preview': previews}, total_jobs
@@ -1,72 +1,254 @@
 """Display styling functions for console output."""
-import math
+import heapq
+import re
+import sys
 
-from rich.console import Console
-from rich.table import Table
+from htcrystalball.records import field_getter
+from htcrystalball.utils import minutes_to_hours, hours_to_days, compare_requested_available, \
+    wall_time as estimate_wall_time, core_hours as estimate_core_hours
 
-from htcrystalball.utils import minutes_to_hours, hours_to_days, compare_requested_available
+
+# Use the plain output instead of rich: None decides by whether stdout is a terminal
+PLAIN = None
+
+MARKUP = re.compile(r'\[/?(?:#[0-9a-fA-F]{6}|[a-z]+(?: [a-z]+)*)\]')
+
+# The number of rows printed at once by print_table
+CHUNK_ROWS = 200
+
+# The fields of a preview written by write_results, after jobs and Pool
+PREVIEW_FIELDS = ['Machine', 'SlotType', 'SimSlots', 'fits', 'sim_jobs',
+                  'requested_cpu', 'TotalSlotCpus', 'requested_ram', 'TotalSlotMemory',
+                  'requested_disk', 'TotalSlotDisk', 'requested_gpu', 'TotalSlotGPUs']
+
+
+class PlainTable:
+    """A table with the interface of rich.table.Table used here, printed as tab separated text."""
+
+    def __init__(self, caption: str = None, show_header: bool = True, **_):
+        self.caption = caption
+        self.show_header = show_header
+        self.columns = []
+        self.rows = []
+
+    def add_column(self, header: str, **_) -> None:
+        """Adds a column with the given header."""
+        self.columns.append(header)
+
+    def add_row(self, *cells: str) -> None:
+        """Adds a row of cells, which may contain rich markup."""
+        self.rows.append(cells)
+
+
+class PlainConsole:
+    """
+    A console with the interface of rich.console.Console used here.
+
+    Prints text without rich markup and tables as tab separated lines, and
+    never imports rich. Used when the output is not a terminal.
+    """
+
+    def __init__(self, file: object = None):
+        self.file = file
+
+    def print(self, renderable: object = "", style: str = None) -> None:
+        """Prints a text or a PlainTable."""
+        if isinstance(renderable, PlainTable):
+            lines = ['\t'.join(renderable.columns)] if renderable.show_header else []
+            lines += ['\t'.join(row) for row in renderable.rows]
+            if renderable.caption:
+                lines.append(renderable.caption)
+            text = '\n'.join(lines)
+        else:
+            text = str(renderable)
+        print(MARKUP.sub('', text), file=self.file or sys.stdout)
+
+
+def make_console() -> object:
+    """
+    Returns a rich Console if stdout is a terminal and a PlainConsole otherwise.
+
+    rich takes a considerable part of the startup time, so it is only
+    imported for interactive output. PLAIN overrides the detection.
+    """
+    plain = PLAIN
+    if plain is None:
+        plain = not getattr(sys.stdout, 'isatty', lambda: False)()
+    if plain:
+        return PlainConsole()
+
+    from rich.console import Console
+    return Console()
+
+
+def make_table(console: object, caption: str, show_header: bool = True) -> object:
+    """Returns a table with the given caption that can be printed on console."""
+    if isinstance(console, PlainConsole):
+        return PlainTable(caption, show_header=show_header)
+
+    from rich.table import Table
+    return Table(caption=caption, show_header=show_header, header_style="bold cyan", show_edge=False)
+
+
+def print_table(console: object, caption: str, columns: list, rows: object,
+                chunk_rows: int = None) -> None:
+    """
+    Print rows as a table in chunks, so that the first rows appear at once.
+
+    Every chunk is printed as a table of its own as soon as it is full, with
+    the header above the first chunk and the caption below the last one. The
+    columns are at least as wide as in the chunks before, so they stay
+    aligned as long as the values do not grow much wider further down.
+
+    Args:
+        console: The console to print to
+        caption: The caption below the table
+        columns: The columns as (header, justify) pairs
+        rows: An iterable of rows, each a tuple of cells that may contain rich markup
+        chunk_rows: Optional. The number of rows per chunk, defaults to CHUNK_ROWS
+    """
+    chunk_rows = chunk_rows or CHUNK_ROWS
+    plain = isinstance(console, PlainConsole)
+    widths = [len(header) for header, _ in columns]
+    chunk = []
+    first = True
+
+    def flush(chunk_caption: str) -> None:
+        table = make_table(console, chunk_caption, show_header=first)
+        for (header, justify), width in zip(columns, widths):
+            table.add_column(header, justify=justify, min_width=width)
+        for row in chunk:
+            table.add_row(*row)
+        console.print(table)
+
+    for row in rows:
+        if len(chunk) == chunk_rows:
+            flush(None)
+            chunk = []
+            first = False
+        if not plain:
+            widths = [max(width, len(MARKUP.sub('', cell))) for width, cell in zip(widths, row)]
+        chunk.append(row)
+    flush(caption)
+
+
+def select_previews(previews: list, only_fitting: bool = False, top: int = None,
+                    jobs: object = None) -> object:
+    """
+    Selects the previews to show.
+
+    Args:
+        previews: The previews, or per-machine groups, in display order
+        only_fitting: Optional. Leave out previews that do not fit a single job
+        top: Optional. Only keep the top previews with the most jobs, ordered by
+            the number of jobs
+        jobs: Optional. A function returning the number of jobs of a preview,
+            defaults to sim_jobs times SimSlots
+
+    Returns:
+        An iterable of the selected previews.
+    """
+    jobs = jobs or (lambda slot: slot['sim_jobs']*slot['SimSlots'])
+    if only_fitting:
+        previews = (slot for slot in previews if jobs(slot) > 0)
+    if top is not None:
+        previews = heapq.nlargest(top, previews, key=jobs)
+    return previews
+
+
+def group_previews(previews: list) -> list:
+    """
+    Sums up the previews of every machine.
+
+    Returns:
+        One dict per machine, in the order of the previews, with the Machine,
+        its Pool if any, the number of jobs, slot configurations and slots,
+        the number of slots that fit a job, and the CPUs, RAM, disk and GPUs
+        of all its slots.
+    """
+    groups = {}
+    for slot in previews:
+        key = (slot.get('Pool'), slot['Machine'])
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {'Machine': slot['Machine'], 'Pool': slot.get('Pool'), 'jobs': 0,
+                                   'configs': 0, 'slots': 0, 'fitting': 0, 'TotalSlotCpus': 0,
+                                   'TotalSlotMemory': 0.0, 'TotalSlotDisk': 0.0, 'TotalSlotGPUs': 0}
+        sim_slots = slot['SimSlots']
+        group['jobs'] += slot['sim_jobs']*sim_slots
+        group['configs'] += 1
+        group['slots'] += sim_slots
+        group['fitting'] += sim_slots if slot['sim_jobs'] > 0 else 0
+        group['TotalSlotCpus'] += slot['TotalSlotCpus']*sim_slots
+        group['TotalSlotMemory'] += slot['TotalSlotMemory']*sim_slots
+        group['TotalSlotDisk'] += slot['TotalSlotDisk']*sim_slots
+        group['TotalSlotGPUs'] += slot['TotalSlotGPUs']*sim_slots
+    return list(groups.values())
+
+
+def duration(minutes: float) -> str:
+    """Formats a duration in minutes as minutes, hours or days, whichever reads best."""
+    time = minutes
+    unit = "minute(s)"
+    if time >= 60:
+        time = minutes_to_hours(time)
+        unit = "hour(s)"
+    if time > 100:
+        time = hours_to_days(time)
+        unit = "day(s)"
+    return str(time) + " " + unit
 
 
 def results(result: dict, verbose: bool, matlab: bool,
-            n_cores: int, n_jobs: int, wall_time: float) -> None:
+            n_cores: int, n_jobs: int, wall_time: float,
+            total_jobs: int = None, simulation: dict = None, pools: dict = None,
+            only_fitting: bool = False, top: int = None, group: bool = False,
+            calibration: dict = None) -> None:
     """
     Print out the preview result to the console using rich tables.
 
+    The verbose table is printed in chunks while it is formatted, so the
+    first rows appear at once regardless of the size of the pool.
+
     Args:
         result: A dictionary of slot configurations including occupancy values
-            for the requested job size.
+            for the requested job size, and the number of slots left out by
+            the job requirements in 'excluded' and by their START policy in
+            'rejected' if they were checked. 'current' is set if the
+            resources in use were subtracted (--current).
         verbose: A value to extend the generated output.
         matlab: A bool telling whether matlab mode output is needed
         n_cores: number of requested cores for wall-time calculation
         n_jobs: number of requested jobs for wall-time execution
         wall_time: time per job, needed for total wall-time execution
+        total_jobs: Optional. The total number of matching jobs if already
+            known, otherwise it is summed up from the previews
+        simulation: Optional. The report of simulate.simulate, replaces the
+            estimate of the wall time
+        pools: Optional. The number of matching jobs of each pool on its own,
+            printed in addition to the combined result
+        only_fitting: Optional. Leave out the slots, or with group the
+            machines, that do not fit a single job from the verbose table
+        top: Optional. Only list the slots, or with group the machines, with
+            the most jobs in the verbose table, ordered by the number of jobs
+        group: Optional. List one summary row per machine in the verbose
+            table instead of one row per slot configuration
+        calibration: Optional. The runtime statistics of userlog.calibrate
+            the wall_time was taken from, printed with a pessimistic
+            estimate for jobs that run as long as the 90th percentile
     """
-    console = Console()
+    console = make_console()
     color_node = "#add8e6"
-    # create table headers for verbose output
-    if verbose:
-        table = Table(caption="Prediction per node", show_header=True,
-                      header_style="bold cyan", show_edge=False)
-        table.add_column("Jobs", justify="right")
-        table.add_column("Node", justify="center")
-        table.add_column("Slot", justify="right")
-        table.add_column("CPUs", justify="right")
-        table.add_column("RAM", justify="center")
-        table.add_column("Disk", justify="center")
-        table.add_column("GPUs", justify="center")
-
-    total_jobs = 0
-    for slot in result['preview']:
-        total_jobs += slot['sim_jobs']*slot['SimSlots']
-
-        if int(slot['sim_jobs']) == 0:
-            node_jobs = 0
-            job_cell = f"[red]{node_jobs}[/red]"
-        else:
-            node_jobs = slot['sim_jobs']*slot['SimSlots']
-            job_cell = f"{node_jobs}"
-        # create table row for verbose output
-        if verbose:
-            if slot["SimSlots"] != 1:
-                slot["SimSlots"] = "1.."+str(slot["SimSlots"])
 
-            color_cpu = compare_requested_available(slot['requested_cpu'], slot['TotalSlotCpus'])
-            color_ram = compare_requested_available(slot['requested_ram'], slot['TotalSlotMemory'])
-            color_disk = compare_requested_available(slot['requested_disk'], slot['TotalSlotDisk'])
-            color_gpu = compare_requested_available(slot['requested_gpu'], slot['TotalSlotGPUs'])
+    if total_jobs is None:
+        total_jobs = sum(slot['sim_jobs']*slot['SimSlots'] for slot in result['preview'])
 
-            table.add_row(
-                job_cell,
-                f"[{color_node}]{slot['Machine']}[/{color_node}]",
-                f"{slot['SimSlots']}",
-                f"[{color_cpu}]{slot['requested_cpu']}/{slot['TotalSlotCpus']}[/{color_cpu}]",
-                f"[{color_ram}]{slot['requested_ram']}/{slot['TotalSlotMemory']}G[/{color_ram}]",
-                f"[{color_disk}]{slot['requested_disk']}/{slot['TotalSlotDisk']}G[/{color_disk}]",
-                f"[{color_gpu}]{slot['requested_gpu']}/{slot['TotalSlotGPUs']}[/{color_gpu}]"
-            )
     # write table and wall-time info to console
     if verbose:
-        console.print(table)
+        if group:
+            machine_rows(result['preview'], console, bool(pools), only_fitting, top)
+        else:
+            slot_rows(result['preview'], console, bool(pools), only_fitting, top)
         console.print("LEGEND:")
         console.print("[green]█[/green] (<= 90%); [yellow]█[/yellow] (90-100%); [red]█[/red] (> 100%)")
         console.print("")
@@ -79,32 +261,393 @@ def results(result: dict, verbose: bool, matlab: bool,
                           "Use --verbose for details and a per-slot-config analysis.")
         else:
             if matlab:
+                nodes = list(dict.fromkeys((slot.get('Pool'), slot['Machine']) for slot in result['preview']))
                 console.print("A maximum of " + str(total_jobs) + " jobs of this size "
-                              "can run using only " + str(len(result['preview'])) + " nodes.")
+                              "can run using only " + str(len(nodes)) + " nodes.")
                 console.print("")
                 console.print("The following nodes are suggested:")
-                for slot in result['preview']:
-                    console.print(slot['Machine'], style=color_node)
+                for pool, machine in nodes:
+                    console.print(machine if pool is None else f"{machine} ({pool})", style=color_node)
                 console.print("")
             else:
                 console.print(str(total_jobs) + " jobs of this size can run on this pool.")
                 console.print("")
 
+    if result.get('excluded'):
+        console.print(str(result['excluded']) + " slots do not meet the job requirements and were left out.")
+        console.print("")
+    if result.get('rejected'):
+        console.print(str(result['rejected']) + " slots reject the job by their START policy and were left out.")
+        console.print("")
+
+    if pools:
+        pool_results(pools, n_jobs, wall_time, console)
+
     if wall_time > 0.0 and n_jobs > 0 and total_jobs > 0:
-        time = int(max(math.ceil(n_jobs / total_jobs),1)*wall_time + 0.5)
-        unit = "minute(s)"
-        if time >= 60:
-            time = minutes_to_hours(time)
-            unit = "hour(s)"
-        if time > 100:
-            time = hours_to_days(time)
-            unit = "day(s)"
-        core_hours = math.ceil(n_jobs * wall_time * n_cores / 60.0)
+        if simulation is not None:
+            time = round(simulation['makespan'])
+        else:
+            time = estimate_wall_time(n_jobs, total_jobs, wall_time)
+        core_hours = estimate_core_hours(n_jobs, wall_time, n_cores)
         console.print("A total of "+str(core_hours)+" core-hour(s) "
                       "will be used and " + str(n_jobs) + " job(s) will complete in about " +
-                      str(time)+" "+unit+".")
+                      duration(time)+".")
+        if simulation is not None:
+            simulated(simulation, verbose, console)
+        if calibration is not None:
+            calibrated(calibration, n_jobs, total_jobs, console)
     else:
         console.print("No --jobs or --time specified. No duration estimate will be given.")
 
     console.print("")
+    if result.get('current'):
+        console.print("The above number(s) are for the current load of the pool.")
+    else:
+        console.print("The above number(s) are for an idle pool.")
+
+
+def slot_rows(previews: list, console: object, pools: bool = False,
+              only_fitting: bool = False, top: int = None) -> None:
+    """
+    Print out the verbose table with one row per slot configuration.
+
+    Args:
+        previews: The previews in display order
+        console: The console to print to
+        pools: Optional. Add the pool of every slot configuration
+        only_fitting: Optional. Leave out slot configurations that do not fit a job
+        top: Optional. Only list the slot configurations with the most jobs
+    """
+    color_node = "#add8e6"
+    columns = [("Jobs", "right")] + ([("Pool", "center")] if pools else []) + [
+        ("Node", "center"), ("Slot", "right"), ("CPUs", "right"), ("RAM", "center"),
+        ("Disk", "center"), ("GPUs", "center")]
+
+    def rows():
+        for slot in select_previews(previews, only_fitting, top):
+            if int(slot['sim_jobs']) == 0:
+                job_cell = "[red]0[/red]"
+            else:
+                job_cell = f"{slot['sim_jobs']*slot['SimSlots']}"
+            slot_cell = f"{slot['SimSlots']}" if slot['SimSlots'] == 1 else f"1..{slot['SimSlots']}"
+
+            color_cpu = compare_requested_available(slot['requested_cpu'], slot['TotalSlotCpus'])
+            color_ram = compare_requested_available(slot['requested_ram'], slot['TotalSlotMemory'])
+            color_disk = compare_requested_available(slot['requested_disk'], slot['TotalSlotDisk'])
+            color_gpu = compare_requested_available(slot['requested_gpu'], slot['TotalSlotGPUs'])
+
+            yield (
+                job_cell,
+                *([slot.get('Pool', '')] if pools else []),
+                f"[{color_node}]{slot['Machine']}[/{color_node}]",
+                slot_cell,
+                f"[{color_cpu}]{slot['requested_cpu']}/{slot['TotalSlotCpus']}[/{color_cpu}]",
+                f"[{color_ram}]{slot['requested_ram']}/{slot['TotalSlotMemory']}G[/{color_ram}]",
+                f"[{color_disk}]{slot['requested_disk']}/{slot['TotalSlotDisk']}G[/{color_disk}]",
+                f"[{color_gpu}]{slot['requested_gpu']}/{slot['TotalSlotGPUs']}[/{color_gpu}]"
+            )
+
+    print_table(console, "Prediction per node", columns, rows())
+
+
+def machine_rows(previews: list, console: object, pools: bool = False,
+                 only_fitting: bool = False, top: int = None) -> None:
+    """
+    Print out the verbose table with one summary row per machine.
+
+    The Slots column gives the slots that fit a job out of all slots of the
+    machine: green if all of them fit, yellow if some and red if none. The
+    resources are the totals of all slots of the machine.
+
+    Args:
+        previews: The previews in display order
+        console: The console to print to
+        pools: Optional. Add the pool of every machine
+        only_fitting: Optional. Leave out machines without any matching job
+        top: Optional. Only list the machines with the most jobs
+    """
+    color_node = "#add8e6"
+    columns = [("Jobs", "right")] + ([("Pool", "center")] if pools else []) + [
+        ("Node", "center"), ("Configs", "right"), ("Slots", "right"), ("CPUs", "right"),
+        ("RAM", "right"), ("Disk", "right"), ("GPUs", "right")]
+
+    def rows():
+        groups = group_previews(previews)
+        for machine in select_previews(groups, only_fitting, top, jobs=lambda group: group['jobs']):
+            job_cell = f"{machine['jobs']}" if machine['jobs'] > 0 else "[red]0[/red]"
+            color = "green" if machine['fitting'] == machine['slots'] \
+                else "yellow" if machine['fitting'] > 0 else "red"
+            yield (
+                job_cell,
+                *([machine['Pool'] or ''] if pools else []),
+                f"[{color_node}]{machine['Machine']}[/{color_node}]",
+                f"{machine['configs']}",
+                f"[{color}]{machine['fitting']}/{machine['slots']}[/{color}]",
+                f"{machine['TotalSlotCpus']}",
+                f"{round(machine['TotalSlotMemory'], 2)}G",
+                f"{round(machine['TotalSlotDisk'], 2)}G",
+                f"{machine['TotalSlotGPUs']}",
+            )
+
+    print_table(console, "Prediction per machine", columns, rows())
+
+
+def write_results(result: dict, output_format: str, n_cores: int, n_jobs: int,
+                  wall_time: float, total_jobs: int = None, simulation: dict = None,
+                  pools: dict = None, stream: object = None, only_fitting: bool = False,
+                  top: int = None, calibration: dict = None) -> None:
+    """
+    Write the preview result in a machine-readable format, without rich.
+
+    Every preview is written as soon as it is formatted, so the time per row
+    is constant and the output is never held in memory. The previews are not
+    modified and all numbers are written as numbers.
+
+    Args:
+        result: A dictionary of slot configurations including occupancy values
+            for the requested job size.
+        output_format: 'json' for a single object with the summary and a
+            preview list, 'jsonl' for one line per preview followed by a
+            summary line, or 'csv' for one row per preview
+        n_cores: number of requested cores for the core-hours
+        n_jobs: number of requested jobs for wall-time execution
+        wall_time: time per job, needed for total wall-time execution
+        total_jobs: Optional. The total number of matching jobs if already
+            known, otherwise it is summed up from the previews
+        simulation: Optional. The report of simulate.simulate, replaces the
+            estimate of the wall time
+        pools: Optional. The number of matching jobs of each pool on its own
+        stream: Optional. The text stream to write to, defaults to stdout
+        only_fitting: Optional. Leave out the previews that do not fit a job
+        top: Optional. Only write the previews with the most jobs, ordered by
+            the number of jobs
+        calibration: Optional. The runtime statistics of userlog.calibrate
+            the wall_time was taken from, written with the wall time for
+            jobs that run as long as the 90th percentile
+    """
+    import csv
+    import json
+
+    stream = stream or sys.stdout
+    if total_jobs is None:
+        total_jobs = sum(slot['sim_jobs']*slot['SimSlots'] for slot in result['preview'])
+
+    summary = {'total_jobs': total_jobs, 'core_hours': None, 'wall_time': None,
+               'simulated': simulation is not None}
+    if wall_time > 0.0 and n_jobs > 0 and total_jobs > 0:
+        summary['core_hours'] = estimate_core_hours(n_jobs, wall_time, n_cores)
+        summary['wall_time'] = simulation['makespan'] if simulation is not None \
+            else estimate_wall_time(n_jobs, total_jobs, wall_time)
+    if pools:
+        summary['pools'] = pools
+    if calibration is not None:
+        summary['calibration'] = calibration
+        summary['wall_time_p90'] = estimate_wall_time(n_jobs, total_jobs, calibration['p90']) \
+            if n_jobs > 0 and total_jobs > 0 else None
+    for key in ('excluded', 'rejected', 'current'):
+        if key in result:
+            summary[key] = result[key]
+
+    fields = ['jobs'] + (['Pool'] if pools else []) + PREVIEW_FIELDS
+    get_fields = field_getter(*fields[1:])
+
+    def rows():
+        for slot in select_previews(result['preview'], only_fitting, top):
+            yield (slot['sim_jobs']*slot['SimSlots'],) + get_fields(slot)
+
+    if output_format == 'csv':
+        writer = csv.writer(stream)
+        writer.writerow(fields)
+        writer.writerows(rows())
+    elif output_format == 'jsonl':
+        encode = json.JSONEncoder().encode
+        for row in rows():
+            stream.write(encode({'record': 'slot', **dict(zip(fields, row))}) + '\n')
+        stream.write(encode({'record': 'summary', **summary}) + '\n')
+    elif output_format == 'json':
+        encode = json.JSONEncoder().encode
+        stream.write(encode(summary)[:-1] + ', "preview": [')
+        separator = '\n'
+        for row in rows():
+            stream.write(separator + encode(dict(zip(fields, row))))
+            separator = ',\n'
+        stream.write(']}\n')
+    else:
+        raise ValueError(f'output_format must be json, jsonl or csv, not {output_format}')
+
+
+def pool_results(pools: dict, n_jobs: int, wall_time: float, console: object) -> None:
+    """
+    Print out the number of matching jobs and the wall time of each pool on its own.
+
+    Args:
+        pools: The total number of matching jobs by pool
+        n_jobs: number of requested jobs for wall-time execution
+        wall_time: time per job, needed for total wall-time execution
+        console: The console to print to
+    """
+    table = make_table(console, "Prediction per pool")
+    table.add_column("Pool", justify="center")
+    table.add_column("Jobs", justify="right")
+    table.add_column("Wall time", justify="right")
+    for pool, pool_jobs in pools.items():
+        if wall_time > 0.0 and n_jobs > 0 and pool_jobs > 0:
+            time = duration(estimate_wall_time(n_jobs, pool_jobs, wall_time))
+        else:
+            time = "-"
+        table.add_row(pool, f"{pool_jobs}" if pool_jobs > 0 else "[red]0[/red]", time)
+    console.print(table)
+    console.print("")
+
+
+def simulated(simulation: dict, verbose: bool, console: object) -> None:
+    """
+    Print out the details of a wall-time simulation.
+
+    Args:
+        simulation: The report as returned by simulate.simulate
+        verbose: Print the speed, jobs and utilization of every node
+        console: The console to print to
+    """
+    console.print("The duration was simulated taking the speed of "
+                  + str(len(simulation['nodes'])) + " node(s) into account.")
+    if not verbose:
+        return
+
+    columns = [("Node", "center"), ("Speed", "right"), ("Jobs", "right"), ("Utilization", "right")]
+    rows = ((f"[#add8e6]{machine if pool is None else f'{machine} ({pool})'}[/#add8e6]",
+             f"{stats['speed']:.2f}", f"{stats['jobs']}", f"{stats['utilization']:.0%}")
+            for (pool, machine), stats in simulation['nodes'].items())
+    console.print("")
+    print_table(console, "Simulation per node", columns, rows)
+
+
+def calibrated(calibration: dict, n_jobs: int, total_jobs: int, console: object) -> None:
+    """
+    Print out the runtimes the job duration was calibrated from.
+
+    Args:
+        calibration: The runtime statistics as returned by userlog.calibrate
+        n_jobs: number of requested jobs for wall-time execution
+        total_jobs: The total number of matching jobs
+        console: The console to print to
+    """
+    console.print("The job duration was calibrated from " + str(calibration['jobs']) + " completed "
+                  "job(s): median " + duration(round(calibration['p50'], 1)) + ", 90th percentile " +
+                  duration(round(calibration['p90'], 1)) + ", longest " +
+                  duration(round(calibration['max'], 1)) + ".")
+    console.print("If the jobs run as long as the 90th percentile, they will complete in about " +
+                  duration(estimate_wall_time(n_jobs, total_jobs, calibration['p90'])) + ".")
+
+
+def log_status(status: dict, console: object) -> None:
+    """
+    Print out the progress of a job cluster and when it will be done.
+
+    Args:
+        status: The projection of watch.project
+        console: The console to print to
+    """
+    import time
+
+    counts = ", ".join(str(status[state]) + " " + state for state in
+                       ('completed', 'running', 'idle', 'held', 'removed') if status[state] or
+                       state in ('completed', 'running', 'idle'))
+    if status['idle'] + status['running'] + status['held'] == 0 and \
+            status['completed'] + status['removed'] > 0:
+        outlook = "all jobs are done."
+    elif status['remaining'] is None:
+        outlook = "no job duration known yet, give --time or wait for the first job to complete."
+    elif status['idle'] + status['running'] == 0:
+        outlook = "the remaining jobs are held."
+    else:
+        outlook = "the jobs will complete in about " + duration(int(status['remaining'] + 0.5)) + "."
+    console.print(time.strftime("%H:%M:%S") + " " + counts + ": " + outlook)
+
+
+def optimize_results(report: dict, n_jobs: int, current: bool = False) -> None:
+    """
+    Print out the job shapes found by optimize.optimize using rich tables.
+
+    Args:
+        report: The report as returned by optimize.optimize
+        n_jobs: The number of jobs of the cluster
+        current: Optional. The resources in use were subtracted (--current)
+    """
+    console = make_console()
+    table = make_table(console, "Job shapes by makespan")
+    for header in ("CPUs", "RAM", "Disk", "GPUs", "Jobs at once", "Job time", "Makespan"):
+        table.add_column(header, justify="right")
+
+    for shape in report['shapes']:
+        table.add_row(
+            f"{shape['cpu']}", f"{round(shape['ram'], 2):g}G", f"{round(shape['disk'], 2):g}G",
+            f"{shape['gpu']}", f"{shape['total_jobs']}", duration(round(shape['duration'], 1)),
+            duration(shape['makespan'])
+        )
+
+    console.print(table)
+    console.print("")
+    console.print(str(report['evaluated']) + " job shape(s) were evaluated, " + str(len(report['shapes'])) +
+                  " of them are not dominated by a shape that needs fewer resources and is as fast.")
+    console.print("")
+
+    reference = report['reference']
+    requested = ("the requested " + str(reference['cpu']) + " CPUs and " +
+                 f"{round(reference['ram'], 2):g}G RAM")
+    if not report['shapes']:
+        console.print("No job shape within the bounds fits any compute slots.")
+    else:
+        best = report['shapes'][0]
+        console.print("Requesting " + str(best['cpu']) + " CPUs and " + f"{round(best['ram'], 2):g}G RAM" +
+                      " per job, the " + str(n_jobs) + " job(s) will complete in about " +
+                      duration(best['makespan']) + ".")
+    if reference['makespan'] is None:
+        console.print("With " + requested + ", the jobs do not fit any compute slots.")
+    else:
+        console.print("With " + requested + ", they will complete in about " +
+                      duration(reference['makespan']) + ".")
+    console.print("")
+    if current:
+        console.print("The above number(s) are for the current load of the pool.")
+    else:
+        console.print("The above number(s) are for an idle pool.")
+
+
+def mix_results(report: dict) -> None:
+    """
+    Print out the packing of a job mix to the console using rich tables.
+
+    Args:
+        report: The packing report as returned by packing.pack
+    """
+    console = make_console()
+    table = make_table(console, "Prediction per job shape")
+    table.add_column("CPUs", justify="right")
+    table.add_column("RAM", justify="right")
+    table.add_column("Disk", justify="right")
+    table.add_column("GPUs", justify="right")
+    table.add_column("Jobs", justify="right")
+    table.add_column("Running", justify="right")
+    table.add_column("Waiting", justify="right")
+
+    for shape in report['shapes']:
+        color = "red" if shape['running'] == 0 else "yellow" if shape['waiting'] > 0 else "green"
+        table.add_row(
+            f"{shape['cpu']}", f"{shape['ram']}G", f"{shape['disk']}G", f"{shape['gpu']}",
+            f"{shape['jobs']}", f"[{color}]{shape['running']}[/{color}]", f"{shape['waiting']}"
+        )
+
+    console.print(table)
+    console.print("")
+    console.print("TOTAL RUNNING: " + str(sum(shape['running'] for shape in report['shapes'])))
+    console.print("")
+
+    free, stranded = report['free'], report['stranded']
+    console.print(f"Left over: {free['TotalSlotCpus']:g} CPUs, {free['TotalSlotMemory']:g}G RAM, "
+                  f"{free['TotalSlotDisk']:g}G disk, {free['TotalSlotGPUs']:g} GPUs")
+    console.print(f"Of which fragmented (too small for any job of the mix): "
+                  f"{stranded['TotalSlotCpus']:g} CPUs, {stranded['TotalSlotMemory']:g}G RAM, "
+                  f"{stranded['TotalSlotDisk']:g}G disk, {stranded['TotalSlotGPUs']:g} GPUs")
+    console.print("")
     console.print("The above number(s) are for an idle pool.")
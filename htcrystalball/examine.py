@@ -1,11 +1,17 @@
 """Examines user input on the HTCondor slot configuration."""
+import heapq
+
 from argparse import ArgumentTypeError
-from natsort import natsorted
 
-from htcrystalball import display, collect, LOGGER
+from htcrystalball import display, collect, timing, LOGGER
+from htcrystalball.records import PreviewRecord, field_getter
 from htcrystalball.utils import split_num_str, to_minutes, to_binary_gigabyte, parse_submit_file
 
 
+slot_fields = field_getter('Machine', 'TotalSlotCpus', 'TotalSlotMemory', 'TotalSlotDisk',
+                           'TotalSlotGPUs', 'SimSlots')
+
+
 def filter_slots(slots: dict, slot_type: str) -> list:
     """Filters the slots stored in a dictionary according to the given type."""
     result = []
@@ -20,7 +26,11 @@ def filter_slots(slots: dict, slot_type: str) -> list:
 
 def prepare(cpu: int, gpu: int, ram: str, disk: str, jobs: int,
             job_duration: str, maxnodes: int, file: str, verbose: bool,
-            content: object) -> bool:
+            content: object, config: dict = None, engine: str = 'dict',
+            simulate: bool = False, output: str = None, only_fitting: bool = False,
+            top: int = None, group: bool = False, requirements: str = None,
+            start: bool = False, current: bool = False, calibration: dict = None,
+            watch_log: str = None, interval: float = 0.0, reload: object = None) -> bool:
     """
     Prepares for the examination of job requests.
     Loads the slot configuration, handles user input, and invokes checks for a
@@ -30,38 +40,66 @@ def prepare(cpu: int, gpu: int, ram: str, disk: str, jobs: int,
         gpu: User input of GPU units
         ram: User input of the amount of RAM
         disk: User input of the amount of disk space
-        jobs: User input of the number of similar jobs
+        jobs: User input of the number of similar jobs. None takes the
+            number of jobs queued by the .submit file, or 1 without a file
         job_duration: User input of the duration time for a single job
         file: A path to a .submit file
         maxnodes:
         verbose:
         content: the loaded HTCondor slots configuration
+        config: Optional. The slot configuration as created by
+            collect.collect_slots, e.g. from the cache. Replaces content.
+        engine: Optional. The engine used for checking the slots, allowed
+            {'dict', 'numpy'}
+        simulate: Optional. Estimate the wall time by a simulation
+        output: Optional. Write the results as 'json', 'jsonl' or 'csv'
+            instead of printing tables
+        only_fitting: Optional. Only list the slots that fit a job
+        top: Optional. Only list the slots with the most jobs
+        group: Optional. List one summary row per machine
+        requirements: Optional. A ClassAd expression the slots must match,
+            combined with the requirements of the .submit file
+        start: Optional. Leave out the slots whose START expression rejects
+            the job, see classad.policy_matcher
+        current: Optional. The resources in use are already subtracted from
+            the slot configuration, see main.load_current
+        calibration: Optional. The runtime statistics of an earlier run as
+            returned by userlog.calibrate. Its median replaces a missing
+            job_duration.
+        watch_log: Optional. A path to the job event log of the submitted
+            jobs, whose progress is then followed with watch.follow
+        interval: Optional. The number of seconds between the updates of
+            watch_log
+        reload: Optional. A function without arguments returning a fresh
+            slot configuration, which watch_log checks the job against again
+            on every update
 
     Returns:
         If all needed parameters were given
     """
-    config = collect.collect_slots(content)
+    if config is None:
+        config = collect.collect_slots(content)
 
     slots_static = filter_slots(config, 'Static')
     slots_partitionable = filter_slots(config, 'Partitionable')
 
+    attributes = {}
     if file != "":
         try:
-            file_params = parse_submit_file(file)
-            if file_params["cpu"] != 0:
-                cpu = file_params["cpu"]
-            if file_params["gpu"] != 0:
-                gpu = file_params["gpu"]
-            if file_params["ram"] != "":
-                ram = file_params["ram"]
-            if file_params["disk"] != "":
-                disk = file_params["disk"]
+            cpu, gpu, ram, disk, jobs = apply_submit_file(file, cpu, gpu, ram, disk, jobs)
+            requirements = job_requirements(file, requirements)
+            attributes = parse_submit_file(file)["attributes"]
         except ArgumentTypeError:
             LOGGER.warning("Wrong storage unit given in .submit file --- ABORTING")
             return False
         except ValueError as e:
             LOGGER.warning("Wrong input type in .submit file --- ABORTING\n"+str(e))
             return False
+        except OSError as e:
+            LOGGER.warning("Cannot read the item data of the .submit file --- ABORTING\n"+str(e))
+            return False
+    if jobs is None:
+        jobs = 1
 
     [ram, ram_unit] = split_num_str(ram, 0.0, 'GiB')
     ram = to_binary_gigabyte(ram, ram_unit)
@@ -70,6 +108,14 @@ def prepare(cpu: int, gpu: int, ram: str, disk: str, jobs: int,
 
     [job_duration, duration_unit] = split_num_str(job_duration, 0.0, 'min')
     job_duration = to_minutes(job_duration, duration_unit)
+    if calibration is not None and job_duration == 0.0:
+        job_duration = calibration['p50']
+
+    try:
+        matches, policy = job_matchers(cpu, gpu, ram, disk, attributes, requirements, start)
+    except ValueError as e:
+        LOGGER.warning("Wrong job requirements or attributes given --- ABORTING\n"+str(e))
+        return False
 
     if cpu == 0:
         LOGGER.warning("No number of CPU workers given --- ABORTING")
@@ -77,21 +123,158 @@ def prepare(cpu: int, gpu: int, ram: str, disk: str, jobs: int,
         LOGGER.warning("No RAM amount given --- ABORTING")
     elif job_duration > 0.0 and jobs == 0:
         LOGGER.warning("No Job amount for wall-time calculation given --- ABORTING")
-    elif jobs > 1 and job_duration == 0.0:
+    elif jobs > 1 and job_duration == 0.0 and watch_log is None:
         LOGGER.warning("No execution time for Jobs has been given --- ABORTING")
     else:
         check_slots(
             slots_static, slots_partitionable, cpu, ram, disk, gpu, jobs,
-            job_duration, maxnodes, verbose
+            job_duration, maxnodes, verbose, engine, simulate, output,
+            only_fitting, top, group, matches, policy, current, calibration,
+            watch_log, interval, reload
         )
         return True
     return False
 
 
+def apply_submit_file(file: str, cpu: int, gpu: int, ram: str,
+                      disk: str, jobs: int = None) -> (int, int, str, str, int):
+    """
+    Replaces typed resource requests by the ones given in a .submit file.
+
+    Requests that are missing in the file keep their typed value. If no
+    number of jobs was typed, the jobs queued by the file are taken. A file
+    with several job shapes contributes the shape with the most jobs.
+
+    Raises:
+        ArgumentTypeError: If the file contains a malformed storage size
+        ValueError: If the file contains a malformed number
+    """
+    file_params = parse_submit_file(file)
+    if file_params["shapes"] > 1:
+        LOGGER.warning(f"{file} queues {file_params['shapes']} job shapes, using the one with "
+                       f"the most jobs ({file_params['jobs']} of {file_params['total_jobs']}). "
+                       f"Use --mix {file} to pack all of them.")
+    if jobs is None and file_params["jobs"] != 0:
+        jobs = file_params["jobs"]
+    if file_params["cpu"] != 0:
+        cpu = file_params["cpu"]
+    if file_params["gpu"] != 0:
+        gpu = file_params["gpu"]
+    if file_params["ram"] != "":
+        ram = file_params["ram"]
+    if file_params["disk"] != "":
+        disk = file_params["disk"]
+
+    return cpu, gpu, ram, disk, jobs
+
+
+def job_requirements(file: str, requirements: str = None) -> str:
+    """
+    Combines the requirements expression of a .submit file with a typed one.
+
+    Both have to be met, as a job only matches slots that meet all of its
+    requirements. A file with several job shapes contributes the
+    requirements of the shape with the most jobs, as in apply_submit_file.
+
+    Returns:
+        The combined ClassAd expression, or '' if there are no requirements.
+
+    Raises:
+        ArgumentTypeError: If the file contains a malformed storage size
+        ValueError: If the file contains a malformed number
+    """
+    expressions = [expression for expression in
+                   (parse_submit_file(file)["requirements"] if file else "", requirements or "")
+                   if expression.strip()]
+    if len(expressions) == 1:
+        return expressions[0]
+    return ' && '.join(f'({expression})' for expression in expressions)
+
+
+def job_owner() -> str:
+    """Returns the name of the user, who owns the jobs, or None if it is unknown."""
+    import getpass
+
+    try:
+        return getpass.getuser()
+    except (KeyError, OSError):
+        return None
+
+
+def job_matchers(cpu: int, gpu: int, ram: float, disk: float, attributes: dict,
+                 requirements: str = None, start: bool = False) -> (object, object):
+    """
+    Compiles the checks of the slots against a job.
+
+    Returns:
+        A classad.matcher of the requirements and a classad.policy_matcher
+        of the START policies, each None if not asked for.
+
+    Raises:
+        ValueError: If the requirements or the job attributes are malformed
+    """
+    if not requirements and not start:
+        return None, None
+    from htcrystalball import classad
+
+    job = classad.job_ad(cpu, gpu, ram, disk, attributes, job_owner())
+    matches = classad.matcher(requirements, job) if requirements else None
+    return matches, classad.policy_matcher(job) if start else None
+
+
+def select_slots(static: list, partitionable: list, requirements: object = None,
+                 start: object = None) -> (list, list, int, int):
+    """
+    Leaves out the slots rejected by the requirements or the START policies.
+
+    Args:
+        requirements: Optional. A function (slot) -> bool as created by
+            classad.matcher
+        start: Optional. A function (slot) -> bool as created by
+            classad.policy_matcher
+
+    Returns:
+        The remaining static and partitionable slots, the number of slots
+        the requirements excluded and the number the policies rejected,
+        each None if not checked.
+    """
+    excluded = None
+    if requirements is not None:
+        with timing.phase('match') as stats:
+            static, excluded_static = match_slots(static, requirements)
+            partitionable, excluded_partitionable = match_slots(partitionable, requirements)
+            excluded = excluded_static + excluded_partitionable
+            stats['evaluations'] = len(requirements.evaluations)
+    rejected = None
+    if start is not None:
+        with timing.phase('start') as stats:
+            static, rejected_static = match_slots(static, start)
+            partitionable, rejected_partitionable = match_slots(partitionable, start)
+            rejected = rejected_static + rejected_partitionable
+            stats['evaluations'] = len(start.evaluations)
+    return static, partitionable, excluded, rejected
+
+
+def match_slots(slots: list, requirements: object) -> (list, int):
+    """
+    Filters the slots that match the job requirements.
+
+    Returns:
+        The matching slots and the number of slots left out.
+    """
+    matching = [slot for slot in slots if requirements(slot)]
+    return matching, sum(slot['SimSlots'] for slot in slots) - sum(slot['SimSlots'] for slot in matching)
+
+
 def check_slots(static: list, partitionable: list, n_cpus: int,
                 ram: float, disk_space: float, n_gpus: int,
                 n_jobs: int, job_duration: float, max_nodes: int,
-                verbose: bool) -> dict:
+                verbose: bool, engine: str = 'dict', simulate: bool = False,
+                output: str = None, only_fitting: bool = False, top: int = None,
+                group: bool = False, requirements: object = None,
+                start: object = None, current: bool = False,
+                calibration: dict = None, watch_log: str = None,
+                interval: float = 0.0, reload: object = None) -> dict:
     """
     Handles the checking for all node/slot types and invokes the output
     methods.
@@ -107,74 +290,190 @@ def check_slots(static: list, partitionable: list, n_cpus: int,
         job_duration: The duration for each job to execute
         max_nodes: The maximum number of nodes to execute the jobs
         verbose: Flag to extend the output.
+        engine: Optional. The engine used for checking the slots, allowed
+            {'dict', 'numpy'}
+        simulate: Optional. Estimate the wall time by simulating the jobs on
+            the matching slots instead of assuming waves of equally fast jobs
+        output: Optional. Write the results as 'json', 'jsonl' or 'csv' with
+            display.write_results instead of printing tables. The previews
+            of all slots are written, as in verbose mode.
+        only_fitting: Optional. Only list the slots, or machines, that fit a
+            job in the verbose table and the output
+        top: Optional. Only list the top slots, or machines, with the most
+            jobs in the verbose table and the output
+        group: Optional. List one summary row per machine in the verbose table
+        requirements: Optional. A function (slot) -> bool as created by
+            classad.matcher. The slots it rejects are left out, and their
+            number is reported as 'excluded' in the results.
+        start: Optional. A function (slot) -> bool as created by
+            classad.policy_matcher. The slots whose policy rejects the job
+            are left out, and their number is reported as 'rejected'.
+        current: Optional. The slots have the resources in use subtracted,
+            which is reported as 'current' in the results
+        calibration: Optional. The runtime statistics the job duration was
+            calibrated from, which are reported with the wall time
+        watch_log: Optional. A path to the job event log of the submitted
+            jobs, whose progress is followed with watch.follow after the
+            results are displayed
+        interval: Optional. The number of seconds between the updates of
+            watch_log
+        reload: Optional. A function without arguments returning a fresh
+            slot configuration as created by collect.collect_slots. The
+            wall time of watch_log is then projected on the slots it
+            returns on every update, which are checked like the given ones.
 
     Returns:
 
     """
-    results = {'slots': [], 'preview': []}
+    static, partitionable, excluded, rejected = select_slots(static, partitionable, requirements, start)
 
-    for node in partitionable:
-        node_dict, preview_node = check_slot_by_type(
-            slot=node,
-            n_cpu=n_cpus,
-            n_gpu=n_gpus,
-            ram=ram,
-            disk=disk_space,
-            slot_type='Partitionable'
+    with timing.phase('check') as stats:
+        results, total_jobs = evaluate(
+            static, partitionable, n_cpus, ram, disk_space, n_gpus, max_nodes,
+            verbose or output is not None, engine
         )
-
-        results['slots'].append(node_dict)
-        results['preview'].append(preview_node)
-
-    for node in static:
-        node_dict, preview_node = check_slot_by_type(
-            slot=node,
-            n_cpu=n_cpus,
-            n_gpu=n_gpus,
-            ram=ram,
-            disk=disk_space,
-            slot_type='Static'
+        stats['slots'] = len(static) + len(partitionable)
+    if excluded is not None:
+        results['excluded'] = excluded
+    if rejected is not None:
+        results['rejected'] = rejected
+    if current:
+        results['current'] = True
+
+    pools = {}
+    for pool in dict.fromkeys(slot['Pool'] for slot in partitionable + static if 'Pool' in slot):
+        _, pools[pool] = evaluate(
+            [slot for slot in static if slot.get('Pool') == pool],
+            [slot for slot in partitionable if slot.get('Pool') == pool],
+            n_cpus, ram, disk_space, n_gpus, max_nodes, False, engine
         )
-        results['slots'].append(node_dict)
-        results['preview'].append(preview_node)
-
-    results['preview'] = order_node_preview(results['preview'])
 
-    if max_nodes != 0 and len(results['preview']) > max_nodes:
-        results['preview'] = results['preview'][:max_nodes]
+    simulation = None
+    if simulate and n_jobs > 0 and job_duration > 0.0:
+        from htcrystalball import simulate as simulator
+
+        nodes = set(map(node_key, results['preview'])) if max_nodes != 0 else None
+        with timing.phase('simulate'):
+            simulation = simulator.simulate(partitionable + static, n_cpus, ram, disk_space,
+                                            n_gpus, n_jobs, job_duration, nodes)
+
+    with timing.phase('display') as stats:
+        if output is not None:
+            display.write_results(results, output, n_cpus, n_jobs, job_duration,
+                                  total_jobs=total_jobs, simulation=simulation, pools=pools,
+                                  only_fitting=only_fitting, top=top, calibration=calibration)
+        else:
+            display.results(results, verbose, max_nodes != 0, n_cpus, n_jobs, job_duration,
+                            total_jobs=total_jobs, simulation=simulation, pools=pools,
+                            only_fitting=only_fitting, top=top, group=group,
+                            calibration=calibration)
+        stats['rows'] = len(results['preview'])
+
+    if watch_log is not None:
+        from htcrystalball import watch
+
+        def recount() -> int:
+            config = reload()
+            fresh_static, fresh_partitionable, _, _ = select_slots(
+                filter_slots(config, 'Static'), filter_slots(config, 'Partitionable'),
+                requirements, start)
+            return evaluate(fresh_static, fresh_partitionable, n_cpus, ram, disk_space, n_gpus,
+                            max_nodes, False, engine)[1]
 
-    results['preview'] = natsorted(results['preview'], key=lambda y: y["Machine"].lower())
-    display.results(results, verbose, max_nodes != 0, n_cpus, n_jobs, job_duration)
+        try:
+            watch.follow(watch_log, total_jobs, job_duration, interval,
+                         recount=recount if reload is not None else None)
+        except (OSError, ValueError) as e:
+            LOGGER.warning("Cannot read the job event log --- ABORTING\n"+str(e))
 
     return results
 
 
-def default_preview(slot_name: str, slot_type: str) -> dict:
+def evaluate(static: list, partitionable: list, n_cpus: int, ram: float,
+             disk_space: float, n_gpus: int, max_nodes: int, verbose: bool,
+             engine: str = 'dict', index: object = None) -> (dict, int):
     """
-    Defines the default dictionary for slots that don't fit the job.
+    Checks all slots for a job request without printing anything.
+
+    The 'dict' engine builds a preview for every slot in verbose mode.
+    Otherwise it finds the slots that fit a job with an index.FitIndex and
+    only builds their previews, and those of all slots of the suggested
+    nodes with max_nodes. The 'numpy' engine checks all slots in a single
+    vectorized pass and only builds the previews that are printed for the
+    given verbose and max_nodes values. It falls back to the 'dict' engine if
+    NumPy is not installed.
 
     Args:
-        slot_name (str): the name of the slot, e.g. "cpu1"
-        slot_type (str): the type of slot, allowed {'Partitionable', 'Static'}
+        index: Optional. The index.FitIndex of the slots, which is built
+            if it is needed and not given
 
     Returns:
-        dict: default values for a previewed slot
-
+        The result dictionary with the previews, and the total
+        number of jobs that can run.
     """
-    return {
-        'Machine': slot_name,
-        'SlotType': slot_type,
-        'fits': 'NO',
-        'TotalSlotCpus': 0,
-        'requested_cpu': 0,
-        'TotalSlotGPUs': 0,
-        'requested_gpu': 0,
-        'TotalSlotMemory': 0,
-        'requested_ram': 0,
-        'TotalSlotDisk': 0,
-        'requested_disk': 0,
-        'sim_jobs': 0
-    }
+    from natsort import natsorted
+
+    if engine == 'numpy':
+        try:
+            from htcrystalball import columnar
+        except ImportError:
+            LOGGER.warning("NumPy is not installed, falling back to the dict engine")
+        else:
+            results, total_jobs = columnar.check_slots(
+                static, partitionable, n_cpus, ram, disk_space, n_gpus, max_nodes, verbose
+            )
+            with timing.phase('sort'):
+                results['preview'] = natsorted(results['preview'], key=lambda y: y["Machine"].lower())
+            return results, total_jobs
+    elif engine != 'dict':
+        raise ValueError(f'engine must be dict or numpy, not {engine}')
+
+    if verbose:
+        checked = [(slot, 'Partitionable') for slot in partitionable] + \
+            [(slot, 'Static') for slot in static]
+    else:
+        # without the verbose table, the slots that do not fit a job are not needed
+        if index is None:
+            from htcrystalball.index import FitIndex
+
+            index = FitIndex(static, partitionable)
+        checked = index.fitting(n_cpus, ram, disk_space, n_gpus)
+
+    results = {'preview': []}
+
+    for slot, slot_type in checked:
+        _, preview_node = check_slot_by_type(
+            slot=slot,
+            n_cpu=n_cpus,
+            n_gpu=n_gpus,
+            ram=ram,
+            disk=disk_space,
+            slot_type=slot_type
+        )
+        results['preview'].append(preview_node)
+
+    with timing.phase('sort'):
+        results['preview'] = order_node_preview(results['preview'])
+
+        if max_nodes != 0:
+            node_jobs = {}
+            for slot in results['preview']:
+                node = node_key(slot)
+                node_jobs[node] = node_jobs.get(node, 0) + slot['sim_jobs']*slot['SimSlots']
+            nodes = best_nodes(node_jobs, max_nodes)
+            if verbose:
+                results['preview'] = [slot for slot in results['preview'] if node_key(slot) in nodes]
+            else:
+                # the suggested nodes are listed with all of their slots
+                results['preview'] = order_node_preview([
+                    check_slot_by_type(slot, n_cpus, ram, disk_space, slot_type, n_gpus)[1]
+                    for slot, slot_type in index.node_slots(nodes)
+                ])
+
+        results['preview'] = natsorted(results['preview'], key=lambda y: y["Machine"].lower())
+    total_jobs = sum(slot['sim_jobs']*slot['SimSlots'] for slot in results['preview'])
+
+    return results, total_jobs
 
 
 def check_slot_by_type(slot: dict, n_cpu: int, ram: float, disk: float,
@@ -198,43 +497,84 @@ def check_slot_by_type(slot: dict, n_cpu: int, ram: float, disk: float,
         raise ValueError(f'slot_type must be Static or Partitionable'
                          f'not {slot_type}')
 
-    preview = default_preview(slot['Machine'], slot_type)
-    preview['TotalSlotCpus'] = slot['TotalSlotCpus']
-    preview['TotalSlotMemory'] = slot['TotalSlotMemory']
-    preview['TotalSlotDisk'] = slot['TotalSlotDisk']
-    preview['TotalSlotGPUs'] = slot['TotalSlotGPUs']
-
-    preview['requested_cpu'] = n_cpu
-    preview['requested_gpu'] = n_gpu
-    preview['requested_ram'] = ram
-    preview['requested_disk'] = disk
+    machine, total_cpus, total_memory, total_disk, total_gpus, sim_slots = slot_fields(slot)
 
-    fits_job = n_cpu <= slot['TotalSlotCpus'] and ram <= slot['TotalSlotMemory'] \
-        and disk <= slot["TotalSlotDisk"] and n_gpu <= slot['TotalSlotGPUs']
+    fits_job = n_cpu <= total_cpus and ram <= total_memory \
+        and disk <= total_disk and n_gpu <= total_gpus
 
     if fits_job:
-        preview['fits'] = 'YES'
-
-        sim_jobs = int(preview['TotalSlotCpus'] / n_cpu) if n_cpu > 0 else 0
-        sim_jobs = min(sim_jobs, int(preview['TotalSlotMemory'] / ram)) if ram > 0.0 else sim_jobs
-        sim_jobs = min(sim_jobs, int(preview['TotalSlotDisk'] / disk)) if disk > 0.0 else sim_jobs
-        sim_jobs = min(sim_jobs, int(preview['TotalSlotGPUs'] / n_gpu)) if n_gpu > 0 else sim_jobs
-        preview['sim_jobs'] = sim_jobs
-
-        preview['requested_cpu'] = n_cpu*sim_jobs
-        preview['requested_gpu'] = n_gpu*sim_jobs
-        preview['requested_ram'] = ram*sim_jobs
-        preview['requested_disk'] = disk*sim_jobs
+        sim_jobs = slot_jobs(total_cpus, total_memory, total_disk, total_gpus, n_cpu, ram, disk, n_gpu)
         # pct_gpu = int(round((n_gpu / total_gpus) * 100 * preview['sim_jobs'], 0))
-
     else:
-        preview['fits'] = 'NO'
-        preview['sim_jobs'] = 0
-    # add number of similar slots to the result
-    preview['SimSlots'] = slot['SimSlots']
+        sim_jobs = 0
+
+    # the preview is built in one go, the requested resources are those of all
+    # similar jobs if the job fits and of a single job otherwise
+    scale = sim_jobs if fits_job else 1
+    preview = PreviewRecord(
+        Machine=machine,
+        SlotType=slot_type,
+        fits='YES' if fits_job else 'NO',
+        TotalSlotCpus=total_cpus,
+        requested_cpu=n_cpu*scale,
+        TotalSlotGPUs=total_gpus,
+        requested_gpu=n_gpu*scale,
+        TotalSlotMemory=total_memory,
+        requested_ram=ram*scale,
+        TotalSlotDisk=total_disk,
+        requested_disk=disk*scale,
+        sim_jobs=sim_jobs,
+        # add number of similar slots to the result
+        SimSlots=sim_slots,
+        Pool=slot.get('Pool')
+    )
     return [slot, preview]
 
 
+def slot_jobs(total_cpus: int, total_memory: float, total_disk: float, total_gpus: int,
+              n_cpu: int, ram: float, disk: float, n_gpu: int) -> int:
+    """
+    Calculates the number of similar jobs a slot runs, given a single job fits.
+
+    The scarcest requested resource limits the number of jobs.
+    """
+    sim_jobs = int(total_cpus / n_cpu) if n_cpu > 0 else 0
+    sim_jobs = min(sim_jobs, int(total_memory / ram)) if ram > 0.0 else sim_jobs
+    sim_jobs = min(sim_jobs, int(total_disk / disk)) if disk > 0.0 else sim_jobs
+    sim_jobs = min(sim_jobs, int(total_gpus / n_gpu)) if n_gpu > 0 else sim_jobs
+    return sim_jobs
+
+
+def node_key(slot: dict) -> tuple:
+    """
+    Returns the node of a slot or preview as its (Pool, Machine).
+
+    Machine names are only unique within a pool, so nodes of the same name
+    in different pools, see collect.merge_pools, are different nodes.
+    """
+    return slot.get('Pool'), slot['Machine']
+
+
+def best_nodes(node_jobs: dict, max_nodes: int) -> set:
+    """
+    Selects the nodes that together run the most jobs within a node budget.
+
+    The jobs of a node do not depend on the other selected nodes, so the
+    max_nodes nodes with the most jobs are the best selection. They are
+    found with a top-k heap instead of sorting all nodes. Ties are broken by
+    the order of node_jobs, and nodes without jobs are never selected.
+
+    Args:
+        node_jobs: The number of jobs that can run per node, e.g. per node_key
+        max_nodes: The maximum number of nodes to select
+
+    Returns:
+        The keys of the selected nodes.
+    """
+    candidates = ((node, jobs) for node, jobs in node_jobs.items() if jobs > 0)
+    return {node for node, _ in heapq.nlargest(max_nodes, candidates, key=lambda item: item[1])}
+
+
 def order_node_preview(node_preview: list) -> list:
     """
     Order the list of checked nodes by fits/fits not and number of similar
@@ -0,0 +1,91 @@
+"""Sorted per-resource index of slot configurations for fast job fit queries."""
+
+from bisect import bisect_left
+
+from htcrystalball.examine import node_key, slot_fields, slot_jobs
+
+# The resources a job asks for, in the order of the dimensions of the index
+DIMENSIONS = ('TotalSlotCpus', 'TotalSlotMemory', 'TotalSlotDisk', 'TotalSlotGPUs')
+
+
+class FitIndex:
+    """
+    The slot configurations of a pool, sorted by each of their resources.
+
+    A job fits a slot if the slot has at least the requested amount of every
+    resource, so the slots that have enough of one resource are a suffix of
+    the slots sorted by it, found by binary search. A query only checks the
+    slots of the shortest of these suffixes, so its cost grows with the
+    number of slots that have enough of the scarcest requested resource
+    instead of with the size of the pool. Like server.PoolModel, an index is
+    never changed after its creation.
+
+    Attributes:
+        slots: The partitionable and then the static slot configurations
+        slot_types: The type of each slot, 'Partitionable' or 'Static'
+        resources: The Machine, CPUs, memory, disk, GPUs and SimSlots of
+            each slot, see examine.slot_fields
+        orders: The positions of the slots sorted by each dimension
+        keys: The values of each dimension in the order of orders
+    """
+
+    def __init__(self, static: list, partitionable: list):
+        self.slots = partitionable + static
+        self.slot_types = ['Partitionable'] * len(partitionable) + ['Static'] * len(static)
+        self.resources = list(map(slot_fields, self.slots))
+        self._nodes = None
+
+        self.orders = []
+        self.keys = []
+        for dimension in range(1, len(DIMENSIONS) + 1):
+            values = [resources[dimension] for resources in self.resources]
+            order = sorted(range(len(values)), key=values.__getitem__)
+            self.orders.append(order)
+            self.keys.append([values[position] for position in order])
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def candidates(self, n_cpu: int, ram: float, disk: float, n_gpu: int,
+                   ordered: bool = True) -> list:
+        """
+        Finds the slots that fit a single job, as in examine.check_slot_by_type.
+
+        Returns:
+            The positions of the fitting slots, in ascending order, which is
+            the order of slots, unless ordered is False.
+        """
+        request = (n_cpu, ram, disk, n_gpu)
+        starts = [bisect_left(keys, value) for keys, value in zip(self.keys, request)]
+        dimension = max(range(len(DIMENSIONS)), key=starts.__getitem__)
+        resources = self.resources
+        positions = [position for position in self.orders[dimension][starts[dimension]:]
+                     if n_cpu <= resources[position][1] and ram <= resources[position][2]
+                     and disk <= resources[position][3] and n_gpu <= resources[position][4]]
+        if ordered:
+            positions.sort()
+        return positions
+
+    def fitting(self, n_cpu: int, ram: float, disk: float, n_gpu: int) -> list:
+        """Returns the slots that fit a single job with their types, in the order of slots."""
+        return [(self.slots[position], self.slot_types[position])
+                for position in self.candidates(n_cpu, ram, disk, n_gpu)]
+
+    def node_slots(self, nodes: set) -> list:
+        """Returns all slots of the given examine.node_key nodes with their types, in the order of slots."""
+        if self._nodes is None:
+            # only needed for max_nodes, so the positions per node are collected on first use
+            self._nodes = {}
+            for position, slot in enumerate(self.slots):
+                self._nodes.setdefault(node_key(slot), []).append(position)
+        positions = sorted(position for node in nodes for position in self._nodes.get(node, ()))
+        return [(self.slots[position], self.slot_types[position]) for position in positions]
+
+    def count(self, n_cpu: int, ram: float, disk: float, n_gpu: int) -> int:
+        """Counts the jobs of a given shape that can run on the slots at once."""
+        resources = self.resources
+        total = 0
+        for position in self.candidates(n_cpu, ram, disk, n_gpu, ordered=False):
+            _, cpus, memory, slot_disk, gpus, sim_slots = resources[position]
+            total += slot_jobs(cpus, memory, slot_disk, gpus, n_cpu, ram, disk, n_gpu) * sim_slots
+        return total
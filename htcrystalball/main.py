@@ -2,17 +2,50 @@
 
 import argparse
 import sys
+import time
 
-import htcondor
+from argparse import ArgumentTypeError
 
-from htcrystalball import examine, LOGGER
-from htcrystalball.utils import validate_storage_size, validate_duration
+from htcrystalball import timing, LOGGER
+from htcrystalball.utils import validate_storage_size, validate_duration, split_num_str, to_minutes
 
 QUERY_DATA = ["SlotType", "Machine", "TotalSlotCpus", "TotalSlotDisk",
-              "TotalSlotMemory", "TotalSlotGPUs"]
+              "TotalSlotMemory", "TotalSlotGPUs", "Mips", "KFlops"]
+
+# Identify slot ads and their last update for incremental refreshes of the cache
+SNAPSHOT_DATA = ["Name", "LastHeardFrom"]
 
 
 def main() -> None:
+    """
+    Parses the command line arguments and runs the selected command
+    """
+    parser = build_parser()
+    args = parser.parse_args()
+
+    if len(sys.argv) <= 1:
+        parser.print_help()
+        return
+
+    if args.timings is not None:
+        timing.enable()
+    profiler = None
+    if args.profile is not None:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        args.run(args, parsers=[parser])
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        if args.timings is not None:
+            timing.report(args.timings)
+
+
+def build_parser() -> argparse.ArgumentParser:
     """
     Defines the command line parser and argument properties
     """
@@ -24,7 +57,15 @@ def main() -> None:
     )
     usage = (
         '%(prog)s -c CPU -r RAM [-g GPU] [-d DISK] [-j JOBS] '
-        '[-t TIME] [-m MAX_NODES] [-f FILE] [-v]'
+        '[-t TIME | --calibrate-from LOGFILE] [-m MAX_NODES] [-f FILE] [--requirements EXPR] [--start] '
+        '[-v] [--only-fitting] [--top N] [--group] '
+        '[--max-age AGE] [--refresh] [--current] '
+        '[--pool HOST [--pool-timeout TIME]] [--progress] '
+        '[--output {json,jsonl,csv}] [--timings {text,json}] [--profile FILE] '
+        '[--simulate] [--engine {dict,numpy}] [--batch FILE] [--mix FILE] '
+        '[--optimize BOUNDS [--work-model {core-hours,per-core}]] '
+        '[--watch-log LOGFILE] [--serve SOCKET] [--interval TIME] '
+        '[--connect SOCKET]'
     )
 
     # Main command
@@ -64,9 +105,10 @@ def main() -> None:
     )
     parser.add_argument(
         "-j", "--jobs",
-        help="The number of jobs to be executed.",
+        help="The number of jobs to be executed. Defaults to the number of jobs queued by the --file "
+             "submit file, or 1.",
         type=int,
-        default=1,
+        default=None,
         dest='jobs'
     )
     parser.add_argument(
@@ -75,6 +117,16 @@ def main() -> None:
         type=validate_duration,
         dest='time'
     )
+    parser.add_argument(
+        "--calibrate-from",
+        help="A path to the HTCondor job event log (user log) of an earlier run of the same jobs. "
+             "The median runtime of its completed jobs replaces --time, and the 90th percentile "
+             "is reported as a pessimistic estimate.",
+        type=str,
+        default=None,
+        metavar='LOGFILE',
+        dest='calibrate_from'
+    )
     parser.add_argument(
         "-m", "--maxnodes",
         help="The maximum number of nodes where jobs can be executed on. Sometimes necessary "
@@ -86,44 +138,531 @@ def main() -> None:
     parser.add_argument(
         "-f", "--file",
         help="A path to an htcondor .submit-file. Uses parsed requirements instead of typed hardware "
-             "requirements for CPU, GPU, RAM and DISK.",
+             "requirements for CPU, GPU, RAM and DISK, and the number of queued jobs unless --jobs "
+             "is given.",
         type=str,
-        default=0,
+        default="",
         dest='file'
     )
+    parser.add_argument(
+        "--requirements",
+        help="A ClassAd expression the slots must match, e.g. 'OpSys == \"LINUX\" && "
+             "CUDACapability >= 7.0'. Combined with the requirements of the --file submit file. "
+             "The slot attributes it reads are queried from the collector.",
+        type=str,
+        default=None,
+        dest='requirements'
+    )
+    parser.add_argument(
+        "--start",
+        help="Evaluates the START expression of every slot against the job, built from the requested "
+             "resources and the +attributes of the --file submit file, and leaves out the slots that "
+             "would reject it. Queries the complete slot ads.",
+        action='store_true',
+        dest='start'
+    )
     parser.add_argument(
         "-v", "--verbose",
         help="Prints a table listing each node, its resources, and proposed usage.",
         action='store_true',
         dest='verbose'
     )
+    parser.add_argument(
+        "--only-fitting",
+        help="Lists only the slots (or with --group the machines) that fit a job in the --verbose "
+             "table. Implies --verbose.",
+        action='store_true',
+        dest='only_fitting'
+    )
+    parser.add_argument(
+        "--top",
+        help="Lists only the N slots (or with --group the machines) with the most jobs in the "
+             "--verbose table, ordered by the number of jobs. Implies --verbose.",
+        type=int,
+        default=None,
+        metavar='N',
+        dest='top'
+    )
+    parser.add_argument(
+        "--group",
+        help="Lists one summary row per machine in the --verbose table instead of one row per slot "
+             "configuration. Implies --verbose.",
+        action='store_true',
+        dest='group'
+    )
+    parser.add_argument(
+        "--simulate",
+        help="Estimates the wall time by simulating the jobs on the matching slots, taking the speed "
+             "(Mips/KFlops) of each node into account. Needs --jobs and --time.",
+        action='store_true',
+        dest='simulate'
+    )
+    parser.add_argument(
+        "--pool",
+        help="The host of a collector to query instead of the default one. Can be given several "
+             "times to query flocked pools concurrently and combine their slots.",
+        type=str,
+        action='append',
+        default=None,
+        dest='pool'
+    )
+    parser.add_argument(
+        "--pool-timeout",
+        help="The time to wait for the collectors of --pool, including a unit (e.g. 30s). Pools "
+             "that do not answer in time are skipped.",
+        type=validate_duration,
+        default="1m",
+        dest='pool_timeout'
+    )
+    parser.add_argument(
+        "--progress",
+        help="Reports the number of slot ads received from the collector on stderr.",
+        action='store_true',
+        dest='progress'
+    )
+    parser.add_argument(
+        "--output",
+        help="Writes the results as JSON, JSON lines or CSV instead of tables, with one record per "
+             "slot configuration and the totals, for further processing.",
+        choices=['json', 'jsonl', 'csv'],
+        default=None,
+        dest='output'
+    )
+    parser.add_argument(
+        "--timings",
+        help="Reports the wall time, counts and peak memory of each phase of the run "
+             "(query, collect, check, sort, display, ...) on stderr as text or JSON.",
+        choices=['text', 'json'],
+        default=None,
+        dest='timings'
+    )
+    parser.add_argument(
+        "--profile",
+        help="Profiles the run with cProfile and writes the statistics to the given file, "
+             "which can be read with python -m pstats.",
+        type=str,
+        default=None,
+        dest='profile'
+    )
+    parser.add_argument(
+        "--max-age",
+        help="The maximum age of the cached slot configuration, including a unit (e.g. 10m). "
+             "Older caches are updated with the slots that changed since. 0 always updates the cache.",
+        type=validate_duration,
+        default="5m",
+        dest='max_age'
+    )
+    parser.add_argument(
+        "--refresh",
+        help="Ignores the cached slot configuration and queries all slots from the collector.",
+        action='store_true',
+        dest='refresh'
+    )
+    parser.add_argument(
+        "--current",
+        help="Accounts for the jobs running right now: the resources claimed by the dynamic slots are "
+             "subtracted from their partitionable slots, and claimed static slots are left out. Tells "
+             "how many jobs could start now. Always queries the collector.",
+        action='store_true',
+        dest='current'
+    )
+    parser.add_argument(
+        "--engine",
+        help="The engine used for checking the slots. 'numpy' checks all slots in one vectorized pass "
+             "and is faster on large pools; it requires NumPy.",
+        choices=['dict', 'numpy'],
+        default='dict',
+        dest='engine'
+    )
+    parser.add_argument(
+        "--batch",
+        help="A path to a CSV or JSON lines file of job shapes ('-' for stdin) with the columns cpu, ram "
+             "and optionally gpu, disk, jobs and time. Writes one result row per shape in the same format.",
+        type=str,
+        default=None,
+        dest='batch'
+    )
+    parser.add_argument(
+        "--mix",
+        help="A path to a CSV or JSON lines file of job shapes as in --batch, where jobs is the number of "
+             "jobs of a shape, or a .sub/.submit file. Packs the whole mix into the pool and prints the "
+             "running jobs per shape.",
+        type=str,
+        default=None,
+        dest='mix'
+    )
+    parser.add_argument(
+        "--optimize",
+        help="Searches the job shapes within the given bounds, e.g. cpu=1:16,ram=2G:64G, that complete "
+             "the --jobs soonest, and lists those that no shape needing fewer resources beats. Needs "
+             "--time for the work model.",
+        type=str,
+        default=None,
+        metavar='BOUNDS',
+        dest='optimize'
+    )
+    parser.add_argument(
+        "--work-model",
+        help="How a job changes with its CPUs for --optimize: 'core-hours' (default) keeps the "
+             "core-hours and the RAM of the requested job, 'per-core' also scales its RAM with its CPUs.",
+        choices=['core-hours', 'per-core'],
+        default='core-hours',
+        dest='work_model'
+    )
+    parser.add_argument(
+        "--watch-log",
+        help="A path to the HTCondor job event log of submitted jobs. Follows the log and prints "
+             "the running, completed and idle jobs and when they will complete whenever new "
+             "events are written, every --interval.",
+        type=str,
+        default=None,
+        metavar='LOGFILE',
+        dest='watch_log'
+    )
+    parser.add_argument(
+        "--serve",
+        help="Runs as a server that keeps the slot configuration in memory and answers queries of "
+             "--connect clients on the given Unix socket path.",
+        type=str,
+        default=None,
+        dest='serve'
+    )
+    parser.add_argument(
+        "--interval",
+        help="The interval for refreshing the slot configuration of --serve, or for reading the "
+             "new events of --watch-log, including a unit (e.g. 10m). 0 disables refreshing.",
+        type=validate_duration,
+        default="5m",
+        dest='interval'
+    )
+    parser.add_argument(
+        "--connect",
+        help="Sends the job request to an htcrystalball server (see --serve) listening on the given "
+             "Unix socket path instead of querying the pool.",
+        type=str,
+        default=None,
+        dest='connect'
+    )
 
-    # Parse arguments
-    args = parser.parse_args()
-
-    if len(sys.argv) <= 1:
-        parser.print_help()
-    else:
-        args.run(args, parsers=[parser])
+    return parser
 
 
 def peek(params, parsers):
     """Peek into the crystal ball to see the future."""
-    coll = htcondor.Collector()
+    if params.connect is not None:
+        ask_server(params)
+        sys.exit(0)
+
+    # the modules of each mode are imported only when needed to keep the startup fast
+    if params.serve is not None:
+        from htcrystalball import server
+
+        try:
+            server.serve(params.serve, lambda: load_pools(params, refresh=True),
+                         interval_seconds(params), engine=params.engine)
+        except FileExistsError as e:
+            LOGGER.error(f"Cannot serve on {params.serve}: {e}")
+        sys.exit(0)
+
+    calibration = None
+    if params.calibrate_from is not None:
+        from htcrystalball import userlog
+
+        try:
+            with timing.phase('calibrate'):
+                calibration = userlog.calibrate(params.calibrate_from)
+        except (OSError, ValueError) as e:
+            LOGGER.warning("Cannot calibrate the job duration from the log --- ABORTING\n"+str(e))
+            sys.exit(0)
+
+    with timing.phase('load') as stats:
+        attributes = requirement_attributes(params) + (['start'] if params.start else [])
+        config = load_pools(params, attributes=attributes)
+        stats['nodes'] = len(config)
+        stats['configs'] = sum(len(slots) for slots in config.values())
+
+    if params.batch is not None:
+        from htcrystalball import batch
+
+        batch.run(config, params.batch, engine=params.engine)
+        sys.exit(0)
+
+    if params.mix is not None:
+        from htcrystalball import display, packing
+
+        try:
+            mix = packing.read_mix(params.mix)
+        except (OSError, ValueError) as e:
+            LOGGER.warning("Wrong job mix given --- ABORTING\n"+str(e))
+            sys.exit(0)
+        display.mix_results(packing.pack(config, mix))
+        sys.exit(0)
+
+    if params.optimize is not None:
+        from htcrystalball import optimize
+
+        optimize.run(config, cpu=params.cpu, gpu=params.gpu, ram=params.ram, disk=params.disk,
+                     jobs=params.jobs, job_duration=params.time, file=params.file,
+                     bounds=params.optimize, work_model=params.work_model, engine=params.engine,
+                     calibration=calibration, maxnodes=params.maxnodes, requirements=params.requirements,
+                     start=params.start, current=params.current)
+        sys.exit(0)
+
+    from htcrystalball import examine
+
+    examine.prepare(
+        cpu=params.cpu, gpu=params.gpu, ram=params.ram, disk=params.disk,
+        jobs=params.jobs, job_duration=params.time, maxnodes=params.maxnodes, file=params.file,
+        verbose=verbose_table(params), content=None, config=config, engine=params.engine,
+        simulate=params.simulate, output=params.output, only_fitting=params.only_fitting,
+        top=params.top, group=params.group, requirements=params.requirements,
+        start=params.start, current=params.current, calibration=calibration,
+        watch_log=params.watch_log, interval=interval_seconds(params),
+        reload=lambda: load_pools(params, refresh=True, attributes=attributes))
+    sys.exit(0)
+
+
+def interval_seconds(params) -> float:
+    """Returns the --interval in seconds."""
+    [interval, interval_unit] = split_num_str(params.interval, 0.0, 'min')
+    return to_minutes(interval, interval_unit) * 60
+
+
+def requirement_attributes(params) -> list:
+    """
+    Returns the slot attributes read by the job requirements of --requirements and --file.
+
+    They are queried in addition to QUERY_DATA. Malformed requirements need
+    no attributes here and are reported by examine.prepare.
+    """
+    if not params.requirements and not params.file:
+        return []
+
+    from htcrystalball import classad, examine
+
+    try:
+        requirements = examine.job_requirements(params.file, params.requirements)
+        if not requirements:
+            return []
+        return classad.compile_expression(requirements).attributes(classad.job_ad(0, 0, 0.0, 0.0))
+    except (ArgumentTypeError, ValueError, OSError):
+        return []
+
+
+def verbose_table(params) -> bool:
+    """Returns whether the verbose table is printed, which the table options imply."""
+    return params.verbose or params.only_fitting or params.top is not None or params.group
+
+
+def ask_server(params) -> None:
+    """Sends the job request to an htcrystalball server and displays its answer."""
+    from htcrystalball import display, examine, server
+
+    unsupported = unsupported_by_server(params)
+    cpu, gpu, ram, disk, jobs = params.cpu, params.gpu, params.ram, params.disk, params.jobs
+    if params.file:
+        try:
+            cpu, gpu, ram, disk, jobs = examine.apply_submit_file(params.file, cpu, gpu, ram, disk,
+                                                                  jobs)
+            if examine.job_requirements(params.file):
+                unsupported.append(f"the requirements of {params.file}")
+        except (ArgumentTypeError, ValueError, OSError) as e:
+            LOGGER.warning("Wrong input in .submit file --- ABORTING\n"+str(e))
+            return
+    if unsupported:
+        LOGGER.warning("The htcrystalball server only answers job requests without "
+                       f"{', '.join(unsupported)} --- ABORTING")
+        return
+    if jobs is None:
+        jobs = 1
+
+    query = {'cpu': cpu, 'gpu': gpu, 'ram': ram, 'disk': disk, 'jobs': jobs,
+             'time': params.time, 'maxnodes': params.maxnodes,
+             'verbose': verbose_table(params) or params.output is not None}
+    try:
+        response = server.request(params.connect, query)
+    except OSError as e:
+        LOGGER.error(f"Could not reach the htcrystalball server at {params.connect}: {e}")
+        return
+
+    if response['error'] is not None:
+        LOGGER.warning(response['error'] + " --- ABORTING")
+        return
+
+    [job_duration, duration_unit] = split_num_str(params.time, 0.0, 'min')
+    if params.output is not None:
+        display.write_results({'preview': response.get('preview', [])}, params.output, cpu,
+                              jobs, to_minutes(job_duration, duration_unit),
+                              total_jobs=response['total_jobs'],
+                              only_fitting=params.only_fitting, top=params.top)
+        return
+    display.results({'preview': response.get('preview', [])}, verbose_table(params),
+                    params.maxnodes != 0, cpu, jobs,
+                    to_minutes(job_duration, duration_unit), total_jobs=response['total_jobs'],
+                    only_fitting=params.only_fitting, top=params.top, group=params.group)
+
+
+def unsupported_by_server(params) -> list:
+    """
+    Returns the given options that a --connect server cannot take into account.
 
+    The server answers from the slot configuration it keeps in memory, which
+    has neither the attributes of the job requirements and the START
+    policies nor the resources in use, so these options would be dropped.
+    The attributes of a .submit file only matter for its requirements.
+    """
+    options = {'--requirements': params.requirements, '--start': params.start,
+               '--current': params.current, '--simulate': params.simulate,
+               '--calibrate-from': params.calibrate_from, '--watch-log': params.watch_log,
+               '--batch': params.batch, '--mix': params.mix, '--optimize': params.optimize}
+    return [option for option, value in options.items() if value]
+
+
+def load_pools(params, refresh: bool = False, attributes: list = ()) -> dict:
+    """
+    Loads the slot configuration of all --pool collectors, or of the default one.
+
+    The collectors are queried concurrently, so the total latency is that of
+    the slowest collector. Collectors that fail or do not answer within
+    --pool-timeout are skipped with a warning. The slots of the merged
+    configuration are tagged with their pool. The further slot attributes
+    are queried and kept as in load_config.
+    """
+    from htcrystalball import collect
+
+    if not params.pool:
+        return load_config(params, refresh, attributes=attributes)
+
+    [timeout, timeout_unit] = split_num_str(params.pool_timeout, 0.0, 'min')
+    configs, errors = collect.query_pools(lambda pool: load_config(params, refresh, pool, attributes),
+                                          params.pool, to_minutes(timeout, timeout_unit) * 60)
+    for pool, error in errors.items():
+        LOGGER.warning(f"Skipping pool {pool}: {error}")
+    if not configs:
+        LOGGER.error("None of the given pools could be queried.")
+        sys.exit(0)
+
+    return collect.merge_pools(configs)
+
+
+def load_config(params, refresh: bool = False, pool: str = None, attributes: list = ()) -> dict:
+    """
+    Loads the slot configuration from the cache or from the collector.
+
+    A cache older than --max-age, or any cache if refresh is given, is
+    brought up to date by querying only the slots that changed since it was
+    taken. --refresh skips the cache and queries all slots. The result is
+    stored in the cache.
+
+    Args:
+        params: The parsed command line arguments
+        refresh: Optional. Update any cache, regardless of its age
+        pool: Optional. The collector host to query instead of the default one
+        attributes: Optional. Further slot attributes to query and keep in
+            the Attributes of the slots, e.g. those of the job requirements.
+            They are part of the cache key, like QUERY_DATA. The complete
+            ads are queried for a policy of collect.POLICIES, e.g. 'start',
+            since the attributes it reads are only known from the ads.
+    """
+    import htcondor
+
+    from htcrystalball import collect
+
+    if params.current:
+        return load_current(params, pool, attributes)
+
+    host = pool or htcondor.param.get('COLLECTOR_HOST', '')
+    [max_age, max_age_unit] = split_num_str(params.max_age, 0.0, 'min')
+    max_age = 0.0 if refresh else to_minutes(max_age, max_age_unit)
+
+    query_data = QUERY_DATA + list(attributes)
+    snapshot = None if params.refresh else collect.load_snapshot(host, query_data)
+    if snapshot is not None and max_age > 0.0 \
+            and time.time() - snapshot['created'] <= max_age * 60:
+        return snapshot['slots']
+
+    coll = htcondor.Collector(pool) if pool else htcondor.Collector()
     # Ignore dynamic slots, which are the ephemeral children of partitionable slots, and thus noise.
     # Partitionable slot definitions remain unaltered by the process of dynamic slot creation.
+    constraint = 'SlotType != "Dynamic"'
+    projection = query_data + SNAPSHOT_DATA
+    if any(policy in attributes for policy in collect.POLICIES):
+        # an empty projection queries all attributes
+        projection = []
+
+    if snapshot is not None and 'members' in snapshot:
+        changed = query_collector(
+            coll, f'{constraint} && LastHeardFrom >= {snapshot["last_heard"]}', projection)
+        changed = timing.counted(changed, 'query', 'ads')
+        if params.progress:
+            changed = collect.report_progress(changed)
+        names = (slot['Name'] for slot in query_collector(coll, constraint, ['Name']))
+        with timing.phase('collect'):
+            snapshot = collect.refresh_slots(snapshot, changed, names, attributes)
+    else:
+        content = timing.counted(query_collector(coll, constraint, projection), 'query', 'ads')
+        if params.progress:
+            content = collect.report_progress(content)
+        with timing.phase('collect'):
+            snapshot = collect.snapshot_slots(content, attributes)
+
+    collect.store_snapshot(snapshot, host, query_data)
+    return snapshot['slots']
+
+
+def load_current(params, pool: str = None, attributes: list = ()) -> dict:
+    """
+    Loads the slot configuration with the resources in use subtracted (--current).
+
+    The dynamic slots are queried first and their claimed resources summed
+    up per partitionable parent in one pass. The other slots are then
+    streamed with these sums subtracted, see collect.subtract_claimed. The
+    load changes all the time, so neither the cache nor the snapshot is used.
+
+    Args:
+        params: The parsed command line arguments
+        pool: Optional. The collector host to query instead of the default one
+        attributes: Optional. Further slot attributes as in load_config
+    """
+    import htcondor
+
+    from htcrystalball import collect
+
+    coll = htcondor.Collector(pool) if pool else htcondor.Collector()
+    dynamic = timing.counted(query_collector(coll, 'SlotType == "Dynamic"', ['Name', *collect.CLAIMED]),
+                             'query', 'ads')
+    with timing.phase('claimed') as stats:
+        claimed = collect.claimed_resources(dynamic)
+        stats['parents'] = len(claimed)
+
+    projection = QUERY_DATA + list(attributes) + SNAPSHOT_DATA + ['State']
+    if any(policy in attributes for policy in collect.POLICIES):
+        projection = []
+    content = timing.counted(query_collector(coll, 'SlotType != "Dynamic"', projection), 'query', 'ads')
+    if params.progress:
+        content = collect.report_progress(content)
+    with timing.phase('collect'):
+        return collect.collect_slots(collect.subtract_claimed(content, claimed), attributes)
+
+
+def query_collector(coll, constraint: str, projection: list) -> object:
+    """
+    Hands out the startd ads of the collector and exits if there is no pool.
+
+    The ads are handed out one at a time, so the callers can fold them into
+    the slot configuration without building a list of their own. The
+    htcondor.Collector of the bindings only has query, which returns all
+    ads at once, so the list of all ads of the pool is still held in memory
+    while it is read. A streaming xquery, as the mock collector has, is used
+    if the collector provides one.
+    """
+    import htcondor
+
+    query = getattr(coll, 'xquery', None) or coll.query
     try:
-        content = coll.query(htcondor.AdTypes.Startd,
-                             constraint='SlotType != "Dynamic"', projection=QUERY_DATA)
+        yield from query(htcondor.AdTypes.Startd, constraint=constraint, projection=projection)
     except htcondor.HTCondorLocateError as e:
         LOGGER.error(str(e)+"\n You seem to run HTCrystalBall on a system that has no htcondor pool.\n"
                             "For information about htcondor pools, you can go to\n"
                             "https://htcondor.readthedocs.io/en/latest/admin-manual/introduction-admin-manual.html")
         sys.exit(0)
-
-    examine.prepare(
-        cpu=params.cpu, gpu=params.gpu, ram=params.ram, disk=params.disk,
-        jobs=params.jobs, job_duration=params.time, maxnodes=params.maxnodes, file=params.file,
-        verbose=params.verbose, content=content)
-    sys.exit(0)
@@ -0,0 +1,249 @@
+"""Searches the job shapes that complete a job cluster the soonest on a pool."""
+
+import re
+
+from argparse import ArgumentTypeError
+
+from htcrystalball import display, examine, timing, LOGGER
+from htcrystalball.utils import parse_submit_file, split_num_str, to_binary_gigabyte, to_minutes, \
+    validate_storage_size, wall_time
+
+# How the runtime and memory of a job change with its number of CPUs: with
+# 'core-hours' a job needs the same core-hours and memory with any number of
+# CPUs, with 'per-core' its memory also grows with its CPUs
+WORK_MODELS = ('core-hours', 'per-core')
+
+BOUND = re.compile(r'^\s*(cpu|ram|disk)\s*=\s*([^:]*):([^:]*)\s*$')
+
+
+def parse_bounds(text: str) -> dict:
+    """
+    Parses the search bounds of --optimize, e.g. 'cpu=1:16,ram=2G:64G'.
+
+    Either side of a range may be left out, e.g. 'ram=:32G'.
+
+    Returns:
+        The (minimum, maximum) of each given resource, the CPUs as numbers
+        and the RAM and disk in GiB, with None for a missing side.
+
+    Raises:
+        ValueError: If a bound is malformed or a minimum exceeds its maximum
+    """
+    bounds = {}
+    for part in text.split(','):
+        match = BOUND.match(part)
+        if match is None:
+            raise ValueError(f"Malformed bound '{part}', expected e.g. cpu=1:16 or ram=2G:64G")
+        resource, limits = match.group(1), []
+        for limit in (match.group(2).strip(), match.group(3).strip()):
+            if not limit:
+                limits.append(None)
+            elif resource == 'cpu':
+                limits.append(int(limit))
+            else:
+                try:
+                    size = validate_storage_size(limit)
+                except ArgumentTypeError as e:
+                    raise ValueError(str(e)) from e
+                limits.append(to_binary_gigabyte(*split_num_str(size, 0.0, 'GiB')))
+        if None not in limits and limits[0] > limits[1]:
+            raise ValueError(f"The minimum of {resource} exceeds its maximum")
+        bounds[resource] = tuple(limits)
+    if 'cpu' in bounds and bounds['cpu'][0] is not None and bounds['cpu'][0] < 1:
+        raise ValueError("A job needs at least 1 CPU")
+    return bounds
+
+
+def candidate_shapes(n_cpu: int, ram: float, disk: float, bounds: dict,
+                     work_model: str = 'core-hours') -> list:
+    """
+    Lists the job shapes within the bounds that are worth evaluating.
+
+    Every number of CPUs within the cpu bounds (by default 1 to twice the
+    requested CPUs) is a candidate. A shape with more RAM or disk than
+    another with the same CPUs never runs more jobs at once, so it is
+    dominated, and only the least RAM and disk a shape can ask for is kept:
+    the requested amount, scaled by the CPUs for the 'per-core' work model,
+    raised to the lower bound. Shapes that would exceed an upper bound are
+    left out.
+
+    Returns:
+        The (CPUs, RAM, disk) of each candidate in ascending order of CPUs.
+    """
+    if work_model not in WORK_MODELS:
+        raise ValueError(f"work_model must be one of {', '.join(WORK_MODELS)}, not {work_model}")
+
+    cpu_min, cpu_max = bounds.get('cpu', (None, None))
+    ram_min, ram_max = bounds.get('ram', (None, None))
+    disk_min, disk_max = bounds.get('disk', (None, None))
+    cpu_min = 1 if cpu_min is None else cpu_min
+    cpu_max = max(2 * n_cpu, cpu_min) if cpu_max is None else cpu_max
+
+    shapes = []
+    for cpus in range(cpu_min, cpu_max + 1):
+        shape_ram = ram * cpus / n_cpu if work_model == 'per-core' else ram
+        shape_ram = max(shape_ram, ram_min or 0.0)
+        shape_disk = max(disk, disk_min or 0.0)
+        if (ram_max is None or shape_ram <= ram_max) and (disk_max is None or shape_disk <= disk_max):
+            shapes.append((cpus, shape_ram, shape_disk))
+    return shapes
+
+
+def count_jobs(static: list, partitionable: list, shapes: list, n_gpu: int,
+               engine: str = 'dict', max_nodes: int = 0) -> list:
+    """
+    Counts the jobs of every shape that can run on the slots at once.
+
+    The 'numpy' engine evaluates all shapes on all slots in vectorized
+    passes with columnar.count_jobs. The 'dict' engine queries an
+    index.FitIndex of the slots for each shape. Both use the fit semantics of
+    examine.check_slot_by_type. With max_nodes, the best nodes depend on the
+    shape, so every shape is evaluated on its own by examine.evaluate.
+
+    Returns:
+        The number of jobs of each shape.
+    """
+    if max_nodes != 0:
+        fit_index = None
+        if engine == 'dict':
+            from htcrystalball.index import FitIndex
+
+            fit_index = FitIndex(static, partitionable)
+        return [examine.evaluate(static, partitionable, cpus, ram, disk, n_gpu, max_nodes, False,
+                                 engine, fit_index)[1]
+                for cpus, ram, disk in shapes]
+
+    if engine == 'numpy':
+        try:
+            import numpy as np
+
+            from htcrystalball import columnar
+        except ImportError:
+            LOGGER.warning("NumPy is not installed, falling back to the dict engine")
+        else:
+            columns = columnar.to_columns(partitionable + static)
+            return columnar.count_jobs(
+                columns, np.array([shape[0] for shape in shapes], dtype=np.int64),
+                np.array([shape[1] for shape in shapes]), np.array([shape[2] for shape in shapes]),
+                n_gpu
+            ).tolist()
+    elif engine != 'dict':
+        raise ValueError(f'engine must be dict or numpy, not {engine}')
+
+    from htcrystalball.index import FitIndex
+
+    fit_index = FitIndex(static, partitionable)
+    return [fit_index.count(cpus, ram, disk, n_gpu) for cpus, ram, disk in shapes]
+
+
+def dominated(shape: dict, other: dict) -> bool:
+    """Returns whether other needs no more resources and time than shape, and less of one."""
+    keys = ('cpu', 'ram', 'disk', 'makespan')
+    return all(other[key] <= shape[key] for key in keys) and any(other[key] < shape[key] for key in keys)
+
+
+def optimize(static: list, partitionable: list, n_cpu: int, ram: float, disk: float,
+             n_gpu: int, n_jobs: int, job_duration: float, bounds: dict,
+             work_model: str = 'core-hours', engine: str = 'dict', max_nodes: int = 0) -> dict:
+    """
+    Finds the job shapes that complete n_jobs jobs the soonest.
+
+    The requested shape defines the work of a job: job_duration minutes on
+    n_cpu CPUs. A shape with other CPUs takes job_duration * n_cpu / CPUs
+    minutes, so the core-hours stay the same, and its makespan is estimated
+    as in utils.wall_time. The shapes that need more resources than another
+    one without finishing sooner are dominated and left out. With max_nodes,
+    the jobs of a shape only run on its best max_nodes nodes, as with
+    --maxnodes.
+
+    Returns:
+        The evaluated requested shape as 'reference', the shapes that are not
+        dominated as 'shapes', best makespan first, and the number of
+        'evaluated' shapes. Each shape has its cpu, ram, disk, gpu, the
+        jobs that run at once as total_jobs, the job duration and the
+        makespan in minutes, which is None if the shape does not fit.
+    """
+    shapes = candidate_shapes(n_cpu, ram, disk, bounds, work_model)
+    reference = (n_cpu, ram, disk)
+    totals = count_jobs(static, partitionable, [reference] + shapes, n_gpu, engine, max_nodes)
+
+    evaluated = []
+    for (cpus, shape_ram, shape_disk), total_jobs in zip([reference] + shapes, totals):
+        duration = job_duration * n_cpu / cpus
+        evaluated.append({
+            'cpu': cpus, 'ram': shape_ram, 'disk': shape_disk, 'gpu': n_gpu,
+            'total_jobs': total_jobs, 'duration': duration,
+            'makespan': wall_time(n_jobs, total_jobs, duration) if total_jobs > 0 else None
+        })
+
+    fitting = [shape for shape in evaluated[1:] if shape['makespan'] is not None]
+    front = [shape for shape in fitting if not any(dominated(shape, other) for other in fitting)]
+    front.sort(key=lambda shape: (shape['makespan'], shape['cpu'], shape['ram'], shape['disk']))
+    return {'reference': evaluated[0], 'shapes': front, 'evaluated': len(shapes)}
+
+
+def run(config: dict, cpu: int, gpu: int, ram: str, disk: str, jobs: int, job_duration: str,
+        file: str, bounds: str, work_model: str = 'core-hours', engine: str = 'dict',
+        calibration: dict = None, maxnodes: int = 0, requirements: str = None,
+        start: bool = False, current: bool = False) -> bool:
+    """
+    Handles the user input of --optimize and prints the best job shapes.
+
+    Takes the requested shape from the arguments or the .submit file, and
+    the job duration from the arguments or the calibration, as in
+    examine.prepare. The slots that the job requirements or the START
+    policies reject for the requested shape are left out before the search,
+    as in examine.check_slots, and maxnodes limits the nodes of every shape.
+
+    Returns:
+        If all needed parameters were given
+    """
+    attributes = {}
+    try:
+        if file != "":
+            cpu, gpu, ram, disk, jobs = examine.apply_submit_file(file, cpu, gpu, ram, disk, jobs)
+            requirements = examine.job_requirements(file, requirements)
+            attributes = parse_submit_file(file)["attributes"]
+        search = parse_bounds(bounds)
+    except ArgumentTypeError:
+        LOGGER.warning("Wrong storage unit given in .submit file --- ABORTING")
+        return False
+    except ValueError as e:
+        LOGGER.warning("Wrong job shape or bounds given --- ABORTING\n"+str(e))
+        return False
+    except OSError as e:
+        LOGGER.warning("Cannot read the item data of the .submit file --- ABORTING\n"+str(e))
+        return False
+    jobs = 1 if jobs is None else jobs
+
+    ram = to_binary_gigabyte(*split_num_str(ram, 0.0, 'GiB'))
+    disk = to_binary_gigabyte(*split_num_str(disk, 0.0, 'GiB'))
+    job_duration = to_minutes(*split_num_str(job_duration, 0.0, 'min'))
+    if calibration is not None and job_duration == 0.0:
+        job_duration = calibration['p50']
+
+    try:
+        matches, policy = examine.job_matchers(cpu, gpu, ram, disk, attributes, requirements, start)
+    except ValueError as e:
+        LOGGER.warning("Wrong job requirements or attributes given --- ABORTING\n"+str(e))
+        return False
+
+    if cpu == 0:
+        LOGGER.warning("No number of CPU workers given --- ABORTING")
+    elif ram == 0.0:
+        LOGGER.warning("No RAM amount given --- ABORTING")
+    elif job_duration == 0.0 or jobs == 0:
+        LOGGER.warning("The work model needs the --jobs and the --time of the jobs --- ABORTING")
+    else:
+        static, partitionable, _, _ = examine.select_slots(
+            examine.filter_slots(config, 'Static'), examine.filter_slots(config, 'Partitionable'),
+            matches, policy
+        )
+        with timing.phase('optimize') as stats:
+            report = optimize(static, partitionable, cpu, ram, disk, gpu, jobs, job_duration,
+                              search, work_model, engine, maxnodes)
+            stats['shapes'] = report['evaluated']
+        with timing.phase('display'):
+            display.optimize_results(report, jobs, current)
+        return True
+    return False
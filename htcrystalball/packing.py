@@ -0,0 +1,142 @@
+"""Packs a mix of differently sized jobs into the slots of a pool."""
+
+from htcrystalball import batch, examine
+
+RESOURCES = ('TotalSlotCpus', 'TotalSlotMemory', 'TotalSlotDisk', 'TotalSlotGPUs')
+
+
+def read_mix(source: str) -> list:
+    """
+    Reads a job mix from a CSV or JSON lines file, or from a submit file.
+
+    Each row is a job shape as in --batch, where jobs is the number of jobs
+    of this shape. A submit file (.sub or .submit) contributes every job
+    shape it queues.
+
+    Returns:
+        A list of shapes (cpu, ram, disk, gpu, count) in the order of the file.
+
+    Raises:
+        ValueError: If a row is malformed
+    """
+    if source.endswith(('.sub', '.submit')):
+        from htcrystalball import submit
+
+        mix = []
+        for shape in submit.parse(source)['shapes']:
+            cpu, ram, disk, gpu, jobs, _ = batch.parse_shape(shape)
+            mix.append((cpu, ram, disk, gpu, jobs))
+        return mix
+
+    with open(source, 'r', newline='') as stream:
+        _, rows = batch.read_shapes(stream)
+        mix = []
+        for row in rows:
+            cpu, ram, disk, gpu, jobs, _ = batch.parse_shape(row)
+            mix.append((cpu, ram, disk, gpu, jobs))
+    return mix
+
+
+def slots_per_job(free: list, shape: tuple, static: bool) -> int:
+    """Returns how many jobs of a shape fit into the free resources of one slot."""
+    if not any(need > 0 for need in shape[:4]):
+        return 0
+    fits = min(int(avail / need) for avail, need in zip(free, shape[:4]) if need > 0)
+    if static:
+        return min(fits, 1)
+    return fits
+
+
+def pack(config: dict, mix: list) -> dict:
+    """
+    Packs a job mix into the Static and Partitionable slots of a pool.
+
+    Uses a best-fit decreasing heuristic: shapes are placed largest first,
+    each into the slots with the least free CPUs that still fit it. Identical
+    slots are handled as groups with a counter, like the SimSlots of the
+    slot configuration, so the runtime depends on the number of shapes and
+    slot configurations but not on the number of jobs. Groups are indexed by
+    their free CPUs, so only slots with enough free CPUs are visited.
+
+    A Static slot runs a single job; a Partitionable slot is split into as
+    many jobs as its resources allow.
+
+    Args:
+        config: The slot configuration as created by collect.collect_slots
+        mix: A list of shapes (cpu, ram, disk, gpu, count) with RAM and disk
+            in GiB
+
+    Returns:
+        A report with the running and waiting jobs per shape in 'shapes', the
+        free resources of all slots in 'free', and the free resources of
+        slots that cannot take any job of the mix anymore in 'stranded'.
+    """
+    # a group is [free cpu, free ram, free disk, free gpu, number of slots, static]
+    buckets = {}
+    closed = []
+    for slot_type in ('Partitionable', 'Static'):
+        for slot in examine.filter_slots(config, slot_type):
+            group = [slot[resource] for resource in RESOURCES] + [slot['SimSlots'], slot_type == 'Static']
+            buckets.setdefault(group[0], []).append(group)
+
+    largest = [max([slot[resource] for node in config.values() for slot in node] + [1])
+               for resource in RESOURCES]
+    order = sorted(range(len(mix)), reverse=True,
+                   key=lambda i: max(need / top for need, top in zip(mix[i][:4], largest)))
+
+    running = [0] * len(mix)
+    for i in order:
+        shape = mix[i]
+        remaining = shape[4]
+        for free_cpus in sorted(cpus for cpus in buckets if cpus >= shape[0]):
+            if remaining == 0:
+                break
+            kept = []
+            for group in buckets.pop(free_cpus):
+                per_slot = slots_per_job(group[:4], shape, group[5]) if remaining > 0 else 0
+                if per_slot == 0:
+                    kept.append(group)
+                    continue
+
+                full = min(group[4], remaining // per_slot)
+                partial = remaining - full * per_slot if full < group[4] else 0
+                remaining -= full * per_slot + partial
+                untouched = group[4] - full - (1 if partial else 0)
+
+                for n_slots, n_jobs in ((full, per_slot), (1 if partial else 0, partial)):
+                    if n_slots == 0:
+                        continue
+                    used = [round(avail - n_jobs * need, 6) for avail, need in zip(group[:4], shape[:4])]
+                    new_group = used + [n_slots, group[5]]
+                    if group[5]:
+                        closed.append(new_group)
+                    else:
+                        buckets.setdefault(new_group[0], []).append(new_group)
+                if untouched:
+                    kept.append(group[:4] + [untouched, group[5]])
+
+            if kept:
+                buckets.setdefault(free_cpus, []).extend(kept)
+        running[i] = shape[4] - remaining
+
+    # slots that cannot take another job of the mix strand their free resources,
+    # this includes every Static slot that runs a job
+    free = [0.0] * 4
+    stranded = [0.0] * 4
+    open_groups = [group for groups in buckets.values() for group in groups]
+    for group, usable in [(group, any(slots_per_job(group[:4], shape, group[5]) > 0 for shape in mix))
+                          for group in open_groups] + [(group, False) for group in closed]:
+        for index in range(4):
+            free[index] += group[index] * group[4]
+            if not usable:
+                stranded[index] += group[index] * group[4]
+
+    return {
+        'shapes': [
+            {'cpu': shape[0], 'ram': shape[1], 'disk': shape[2], 'gpu': shape[3],
+             'jobs': shape[4], 'running': running[i], 'waiting': shape[4] - running[i]}
+            for i, shape in enumerate(mix)
+        ],
+        'free': dict(zip(RESOURCES, [round(value, 2) for value in free])),
+        'stranded': dict(zip(RESOURCES, [round(value, 2) for value in stranded]))
+    }
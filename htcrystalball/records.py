@@ -0,0 +1,172 @@
+"""Compact records for slot configurations and previews with dict-style access."""
+
+from collections.abc import Mapping, MutableMapping
+from operator import attrgetter, itemgetter
+
+
+class Record(MutableMapping):
+    """
+    A mapping with a fixed set of keys that stores its values in __slots__.
+
+    A record needs a fraction of the memory of a dict with the same items,
+    because it has no hash table and no per-instance __dict__. It can be used
+    wherever the slot dicts were used before: items are read and written with
+    record[key], a key that was never set is missing, and records compare
+    equal to dicts with the same items. Keys that are not in __slots__
+    cannot be set.
+
+    The subclasses take their fields as arguments of __init__ and assign
+    them directly, which is faster than creating a dict.
+    """
+
+    __slots__ = ()
+
+    def __getitem__(self, key: str) -> object:
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key) from None
+
+    def __setitem__(self, key: str, value: object) -> None:
+        try:
+            setattr(self, key, value)
+        except (AttributeError, TypeError):
+            raise KeyError(f'{type(self).__name__} has no field {key}') from None
+
+    def __delitem__(self, key: str) -> None:
+        try:
+            delattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key) from None
+
+    def get(self, key: str, default: object = None) -> object:
+        """Returns the value of key, or default if it is missing."""
+        if key not in self.__slots__:
+            return default
+        return getattr(self, key, default)
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, str) and key in self.__slots__ and hasattr(self, key)
+
+    def __iter__(self) -> object:
+        return (key for key in self.__slots__ if hasattr(self, key))
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        return dict(self) == dict(other)
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({dict(self)!r})'
+
+    def copy(self) -> 'Record':
+        """Returns a shallow copy of the record."""
+        return type(self)(**self)
+
+    __copy__ = copy
+
+
+class SlotRecord(Record):
+    """
+    A slot configuration as created by collect.collect_slots.
+
+    Machine is added by examine.filter_slots, Mips and KFlops only exist if
+    the slot ad has them, Pool is added when several pools are merged, and
+    Attributes holds further slot ad attributes by lower case name, e.g.
+    those read by the job requirements.
+    Optional fields given as None are left out. A slot dict, e.g. from the
+    cache, is converted with SlotRecord(**slot).
+    """
+
+    __slots__ = ('TotalSlotCpus', 'TotalSlotGPUs', 'TotalSlotDisk', 'TotalSlotMemory',
+                 'SlotType', 'SimSlots', 'Machine', 'Mips', 'KFlops', 'Pool', 'Attributes')
+
+    def __init__(self, TotalSlotCpus: int, TotalSlotGPUs: int, TotalSlotDisk: float,
+                 TotalSlotMemory: float, SlotType: str, SimSlots: int = None,
+                 Machine: str = None, Mips: int = None, KFlops: int = None, Pool: str = None,
+                 Attributes: dict = None):
+        self.TotalSlotCpus = TotalSlotCpus
+        self.TotalSlotGPUs = TotalSlotGPUs
+        self.TotalSlotDisk = TotalSlotDisk
+        self.TotalSlotMemory = TotalSlotMemory
+        self.SlotType = SlotType
+        if SimSlots is not None:
+            self.SimSlots = SimSlots
+        if Machine is not None:
+            self.Machine = Machine
+        if Mips is not None:
+            self.Mips = Mips
+        if KFlops is not None:
+            self.KFlops = KFlops
+        if Pool is not None:
+            self.Pool = Pool
+        if Attributes is not None:
+            self.Attributes = Attributes
+
+
+class PreviewRecord(Record):
+    """
+    The occupancy of a slot configuration for a job, as built by
+    examine.check_slot_by_type. The defaults are those of a slot that does
+    not fit the job.
+    """
+
+    __slots__ = ('Machine', 'SlotType', 'fits', 'TotalSlotCpus', 'requested_cpu',
+                 'TotalSlotGPUs', 'requested_gpu', 'TotalSlotMemory', 'requested_ram',
+                 'TotalSlotDisk', 'requested_disk', 'sim_jobs', 'SimSlots', 'Pool')
+
+    def __init__(self, Machine: str, SlotType: str, fits: str = 'NO', TotalSlotCpus: int = 0,
+                 requested_cpu: int = 0, TotalSlotGPUs: int = 0, requested_gpu: int = 0,
+                 TotalSlotMemory: float = 0, requested_ram: float = 0, TotalSlotDisk: float = 0,
+                 requested_disk: float = 0, sim_jobs: int = 0, SimSlots: int = None,
+                 Pool: str = None):
+        self.Machine = Machine
+        self.SlotType = SlotType
+        self.fits = fits
+        self.TotalSlotCpus = TotalSlotCpus
+        self.requested_cpu = requested_cpu
+        self.TotalSlotGPUs = TotalSlotGPUs
+        self.requested_gpu = requested_gpu
+        self.TotalSlotMemory = TotalSlotMemory
+        self.requested_ram = requested_ram
+        self.TotalSlotDisk = TotalSlotDisk
+        self.requested_disk = requested_disk
+        self.sim_jobs = sim_jobs
+        if SimSlots is not None:
+            self.SimSlots = SimSlots
+        if Pool is not None:
+            self.Pool = Pool
+
+
+def field_getter(*keys: str) -> object:
+    """
+    Creates a function that reads several fields of a record or dict at once.
+
+    Records are read with a single attrgetter call instead of one __getitem__
+    call per field, which matters in the loops over all slots.
+
+    Returns:
+        A function (record) -> tuple of the values of keys.
+    """
+    by_attribute = attrgetter(*keys)
+    by_item = itemgetter(*keys)
+
+    def get_fields(record: Mapping) -> tuple:
+        return by_attribute(record) if isinstance(record, Record) else by_item(record)
+
+    return get_fields
+
+
+def to_slot_records(slots: dict) -> dict:
+    """Converts the slot dicts of a slot configuration, e.g. from the cache, into records."""
+    return {node: [SlotRecord(**slot) for slot in node_slots] for node, node_slots in slots.items()}
+
+
+def to_dicts(slots: dict) -> dict:
+    """Converts the records of a slot configuration into plain dicts, e.g. for JSON."""
+    return {node: [dict(slot) for slot in node_slots] for node, node_slots in slots.items()}
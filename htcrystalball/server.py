@@ -0,0 +1,197 @@
+"""Serves job fit queries from an in-memory slot configuration over a Unix socket."""
+
+import json
+import os
+import socket
+import socketserver
+import stat
+import threading
+import time
+
+from htcrystalball import batch, examine, index, LOGGER
+from htcrystalball.utils import wall_time, core_hours
+
+
+class PoolModel:
+    """
+    A slot configuration prepared for answering many job fit queries.
+
+    A model is never changed after its creation. A refresh builds a new model
+    and replaces the reference, so queries never see a half updated pool.
+    The slots are sorted into an index.FitIndex once, so a query only checks
+    the slots that can fit its job.
+    """
+
+    def __init__(self, config: dict, engine: str = 'dict'):
+        self.static = examine.filter_slots(config, 'Static')
+        self.partitionable = examine.filter_slots(config, 'Partitionable')
+        self.engine = engine
+        self.index = index.FitIndex(self.static, self.partitionable)
+        self.count_jobs = batch.job_counter(self.static, self.partitionable, engine, self.index)
+        self.created = time.time()
+
+    def query(self, request: dict) -> dict:
+        """
+        Answers a job fit query.
+
+        Args:
+            request: A job shape with the keys cpu, ram and optionally gpu,
+                disk, jobs and time as in batch.parse_shape, plus maxnodes and
+                verbose to request previews
+
+        Returns:
+            The total number of matching jobs, the core-hours, the wall time
+            in minutes, an error message, the age of the slot configuration
+            in seconds, and the previews if verbose or maxnodes are given.
+        """
+        response = {field: None for field in batch.RESULT_FIELDS}
+        response['age'] = time.time() - self.created
+
+        try:
+            cpu, ram, disk, gpu, jobs, duration = batch.parse_shape(request)
+            max_nodes = int(request.get('maxnodes') or 0)
+        except (ValueError, TypeError) as e:
+            response['error'] = str(e)
+            return response
+
+        if request.get('verbose') or max_nodes != 0:
+            result, response['total_jobs'] = examine.evaluate(
+                self.static, self.partitionable, cpu, ram, disk, gpu, max_nodes,
+                bool(request.get('verbose')), self.engine, self.index
+            )
+            response['preview'] = [dict(preview) for preview in result['preview']]
+        else:
+            response['total_jobs'] = self.count_jobs(cpu, ram, disk, gpu)
+
+        if duration > 0.0 and response['total_jobs'] > 0:
+            response['core_hours'] = core_hours(jobs, duration, cpu)
+            response['wall_time'] = wall_time(jobs, response['total_jobs'], duration)
+
+        return response
+
+
+class QueryHandler(socketserver.StreamRequestHandler):
+    """Answers newline delimited JSON queries until the client disconnects."""
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                response = self.server.model.query(json.loads(line))
+            except (ValueError, TypeError, AttributeError) as e:
+                response = {'error': f'Invalid query: {e}'}
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+            self.wfile.flush()
+
+
+class PoolServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    A Unix socket server that keeps the slot configuration in memory.
+
+    The configuration is reloaded in a background thread every interval
+    seconds, while queries are answered from the previous configuration.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path: str, load: object, interval: float, engine: str = 'dict'):
+        """
+        Args:
+            path: The path of the Unix socket. A socket left behind by a
+                server that stopped is replaced, see remove_stale_socket.
+            load: A function without arguments returning a fresh slot
+                configuration as created by collect.collect_slots
+            interval: The number of seconds between two refreshes, 0 disables
+                refreshing
+            engine: Optional. The engine used for checking the slots
+        """
+        remove_stale_socket(path)
+        self.load = load
+        self.interval = interval
+        self.engine = engine
+        self.model = PoolModel(load(), engine)
+        self.stopped = threading.Event()
+
+        self.socket_id = None
+        super().__init__(path, QueryHandler)
+        self.socket_id = socket_id(path)
+
+    def refresh_forever(self) -> None:
+        """Reloads the slot configuration every interval until the server is closed."""
+        while not self.stopped.wait(self.interval):
+            try:
+                self.model = PoolModel(self.load(), self.engine)
+            except (Exception, SystemExit) as e:
+                LOGGER.warning("Refreshing the slot configuration failed, "
+                               "keeping the previous one: " + str(e))
+
+    def serve_forever(self, poll_interval: float = 0.5) -> None:
+        if self.interval > 0:
+            threading.Thread(target=self.refresh_forever, daemon=True).start()
+        super().serve_forever(poll_interval)
+
+    def server_close(self) -> None:
+        self.stopped.set()
+        super().server_close()
+        # another server may have taken over the path in the meantime
+        if socket_id(self.server_address) == self.socket_id:
+            os.unlink(self.server_address)
+
+
+def socket_id(path: str) -> tuple:
+    """Returns the device and inode of the socket at path, or None if there is none."""
+    try:
+        info = os.lstat(path)
+    except FileNotFoundError:
+        return None
+    return (info.st_dev, info.st_ino) if stat.S_ISSOCK(info.st_mode) else None
+
+
+def remove_stale_socket(path: str) -> None:
+    """
+    Removes the socket a server left behind at path, so a new one can listen there.
+
+    Raises:
+        FileExistsError: If path is not a socket, or a server still listens on it
+    """
+    if not os.path.lexists(path):
+        return
+    if socket_id(path) is None:
+        raise FileExistsError(f"{path} exists and is not a socket")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(path)
+        except ConnectionRefusedError:
+            os.unlink(path)
+            return
+    raise FileExistsError(f"Another htcrystalball server is listening on {path}")
+
+
+def serve(path: str, load: object, interval: float, engine: str = 'dict') -> None:
+    """Runs a PoolServer on path until it is interrupted."""
+    with PoolServer(path, load, interval, engine) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def request(path: str, query: dict, timeout: float = 10.0) -> dict:
+    """
+    Sends a single job fit query to a running PoolServer.
+
+    Args:
+        path: The path of the server's Unix socket
+        query: The query as described in PoolModel.query
+        timeout: Optional. The number of seconds to wait for the answer
+
+    Returns:
+        The server's response.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(path)
+        client.sendall(json.dumps(query).encode() + b'\n')
+        with client.makefile('rb') as answer:
+            return json.loads(answer.readline())
@@ -0,0 +1,110 @@
+"""Discrete-event simulation of running a job cluster on the slots of a pool."""
+
+import heapq
+import statistics
+
+from htcrystalball import examine
+
+
+def speed_factors(slots: list) -> dict:
+    """
+    Calculates the relative speed of each node from its benchmark ratings.
+
+    The rating of a node is its Mips, or its KFlops if Mips is missing. The
+    speed factor is the rating divided by the median rating of all rated
+    nodes, so a job duration given by the user is taken as the duration on a
+    typical node. Nodes without ratings get a factor of 1.
+
+    Args:
+        slots: Slot configurations as returned by examine.filter_slots
+
+    Returns:
+        The speed factor per node, as examine.node_key, so nodes of the same
+        name in different pools keep their own ratings.
+    """
+    mips = {examine.node_key(slot): float(slot['Mips']) for slot in slots if slot.get('Mips')}
+    kflops = {examine.node_key(slot): float(slot['KFlops']) for slot in slots if slot.get('KFlops')}
+    ratings = mips if mips else kflops
+
+    if not ratings:
+        return {examine.node_key(slot): 1.0 for slot in slots}
+
+    reference = statistics.median(ratings.values())
+    return {node: ratings.get(node, reference) / reference for node in map(examine.node_key, slots)}
+
+
+def simulate(slots: list, n_cpu: int, ram: float, disk: float, n_gpu: int,
+             n_jobs: int, job_duration: float, nodes: set = None) -> dict:
+    """
+    Simulates running n_jobs jobs of a given size on the slots of a pool.
+
+    Every slot runs as many jobs at once as check_slot_by_type allows. A job
+    takes job_duration divided by the speed factor of its node. Whenever job
+    slots become free, waiting jobs start there, on the fastest nodes first.
+    Identical job slots of a slot configuration finish at the same time, so
+    they are simulated as one event and the number of events depends on the
+    number of job waves, not on the number of jobs.
+
+    Args:
+        slots: Slot configurations as returned by examine.filter_slots
+        n_cpu: The number of CPU cores for a single job
+        ram: The amount of RAM for a single job
+        disk: The amount of disk space for a single job
+        n_gpu: The number of GPU units for a single job
+        n_jobs: The number of jobs to run
+        job_duration: The duration of a single job on a typical node in minutes
+        nodes: Optional. Only use the slots of these nodes, as
+            examine.node_key, e.g. of --maxnodes
+
+    Returns:
+        The makespan in minutes, the number of jobs that could be placed, and
+        per node, as examine.node_key, the speed factor, the number of jobs
+        run and the utilization of its job slots over the makespan.
+    """
+    speeds = speed_factors(slots)
+
+    # a lane group is a set of identical job slots: [node, speed, number of slots]
+    groups = []
+    for slot in slots:
+        node = examine.node_key(slot)
+        if nodes is not None and node not in nodes:
+            continue
+        _, preview = examine.check_slot_by_type(slot, n_cpu, ram, disk, slot['SlotType'], n_gpu)
+        lanes = preview['sim_jobs'] * slot['SimSlots']
+        if lanes > 0:
+            groups.append([node, speeds[node], lanes])
+
+    report = {'makespan': 0.0, 'jobs': 0, 'nodes': {}}
+    if not groups or n_jobs <= 0:
+        return report
+
+    # events are (time, -speed, group, free job slots), so the fastest nodes are served first
+    events = [(0.0, -speed, index, lanes) for index, (_, speed, lanes) in enumerate(groups)]
+    heapq.heapify(events)
+    busy = [0.0] * len(groups)
+    started = [0] * len(groups)
+    remaining = n_jobs
+    makespan = 0.0
+
+    while events and remaining > 0:
+        now, neg_speed, index, free = heapq.heappop(events)
+        starting = min(free, remaining)
+        remaining -= starting
+        duration = job_duration / -neg_speed
+        busy[index] += starting * duration
+        started[index] += starting
+        makespan = max(makespan, now + duration)
+        heapq.heappush(events, (now + duration, neg_speed, index, starting))
+
+    report['makespan'] = makespan
+    report['jobs'] = n_jobs - remaining
+    for index, (node, speed, lanes) in enumerate(groups):
+        stats = report['nodes'].setdefault(node, {'speed': speed, 'jobs': 0, 'busy': 0.0, 'lanes': 0})
+        stats['jobs'] += started[index]
+        stats['busy'] += busy[index]
+        stats['lanes'] += lanes
+
+    for stats in report['nodes'].values():
+        stats['utilization'] = stats.pop('busy') / (stats.pop('lanes') * makespan) if makespan > 0 else 0.0
+
+    return report
@@ -0,0 +1,413 @@
+"""Parser for HTCondor submit files with macros, arithmetic and queue statements."""
+
+import ast
+import glob
+import operator
+import os
+import re
+import sys
+
+from argparse import ArgumentTypeError
+
+from htcrystalball.utils import validate_storage_size
+
+# The submit commands of the job shape and the keys of a shape
+REQUESTS = {'request_cpus': 'cpu', 'request_gpus': 'gpu',
+            'request_memory': 'ram', 'request_disk': 'disk'}
+
+# The submit commands whose value is a ClassAd expression, kept as text
+EXPRESSIONS = {'requirements': 'requirements'}
+
+SHAPE_KEYS = ('cpu', 'gpu', 'ram', 'disk', 'requirements')
+
+# The unit of request_memory and request_disk if none is given
+DEFAULT_UNITS = {'ram': 'MiB', 'disk': 'KiB'}
+
+# Macros that change with every job of a queue statement
+JOB_MACROS = {'process', 'procid', 'step', 'itemindex', 'row', 'node'}
+
+MACRO = re.compile(r'\$(ENV)?\(([A-Za-z_][\w.]*)(?::([^)]*))?\)', re.IGNORECASE)
+STORAGE = re.compile(r'^([0-9]+(?:\.[0-9]+)?)\s*([kKmMgGtTpP]i?[bB]?)$')
+JOB_ATTRIBUTE = re.compile(r'^(?:\+|MY\.)([A-Za-z_]\w*)$', re.IGNORECASE)
+QUEUE = re.compile(r'^queue(?:\s+(.*))?$', re.IGNORECASE)
+QUEUE_MODE = re.compile(r'(?:^|\s)(in|from|matching)(?=\s|\(|$)', re.IGNORECASE)
+
+OPERATORS = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+             ast.Mod: operator.mod, ast.FloorDiv: operator.floordiv}
+
+# ast.parse returns numbers as Num nodes before Python 3.8 and as Constant nodes since
+LEGACY_NUMBERS = sys.version_info < (3, 8)
+
+# Parsed submit files by absolute path: (modification times of all files read, result)
+_CACHE = {}
+
+
+def parse(path: str) -> dict:
+    """
+    Parses a submit file into the job shapes it queues.
+
+    Macros ($(name), $(name:default) and $ENV(name)) are expanded, request
+    values are evaluated as arithmetic (e.g. 4 * 1024), and every queue
+    statement (queue N, queue ... in/from/matching ...) is expanded into its
+    jobs. Item data files are read line by line and jobs are only counted,
+    so the memory needed grows with the number of distinct job shapes, not
+    with the number of jobs. Requests that depend on the item or the job
+    are evaluated for every item or job.
+
+    The result is cached by the path and the modification times of the
+    submit file and all files it read.
+
+    Args:
+        path: The path to the submit file
+
+    Returns:
+        The job shapes as dicts with the keys cpu and gpu (0 if not
+        requested), ram and disk (a storage size in command line notation,
+        '' if not requested) and jobs, in the order of their first job, and
+        the total number of jobs. Shapes with a requirements expression
+        have it as text in requirements. Custom job attributes (+Name or
+        MY.Name) are given as ClassAd expression text by lower case name in
+        attributes, if the file sets any.
+
+    Raises:
+        OSError: If the submit file or an item data file cannot be read
+        ValueError: If a request or queue statement is malformed
+    """
+    path = os.path.abspath(path)
+    cached = _CACHE.get(path)
+    if cached is not None and cached[0] == stamps(name for name, _ in cached[0]):
+        return cached[1]
+
+    files = [path]
+    shapes = {}
+    macros = {}
+    attributes = {}
+    directory = os.path.dirname(path)
+    with open(path, 'r') as stream:
+        lines = logical_lines(stream)
+        for line in lines:
+            queue = QUEUE.match(line)
+            if queue is not None:
+                statement = queue.group(1) or ''
+                if statement.rstrip().endswith('('):
+                    statement += inline_items(lines)
+                for shape, jobs in queue_jobs(statement, macros, directory, files):
+                    shapes[shape] = shapes.get(shape, 0) + jobs
+                continue
+
+            key, sep, value = line.partition('=')
+            if not sep:
+                continue
+            attribute = JOB_ATTRIBUTE.match(key.strip())
+            if attribute is not None:
+                attributes[attribute.group(1).lower()] = expand(value.strip(), macros)
+                continue
+            macros[key.strip().lower()] = value.strip()
+
+    result = {'shapes': [shape_dict(shape, jobs) for shape, jobs in shapes.items() if jobs > 0],
+              'jobs': sum(shapes.values())}
+    if attributes:
+        result['attributes'] = attributes
+    _CACHE[path] = (stamps(files), result)
+    return result
+
+
+def stamps(paths: object) -> tuple:
+    """Returns the paths with their modification times, None for missing files."""
+    result = []
+    for path in paths:
+        try:
+            result.append((path, os.stat(path).st_mtime_ns))
+        except OSError:
+            result.append((path, None))
+    return tuple(result)
+
+
+def logical_lines(stream: object) -> object:
+    """Yields the lines of a submit file without comments, joining continued lines."""
+    pending = ''
+    for line in stream:
+        line = line.strip()
+        if line.endswith('\\'):
+            pending += line[:-1] + ' '
+            continue
+        line = (pending + line).strip()
+        pending = ''
+        if line and not line.startswith('#'):
+            yield line
+    if pending.strip():
+        yield pending.strip()
+
+
+def inline_items(lines: object) -> str:
+    """Reads the items of a multi-line queue list up to the closing parenthesis."""
+    items = []
+    for line in lines:
+        if line.startswith(')'):
+            return '\n'.join(items) + ')'
+        items.append(line)
+    raise ValueError("Queue item list is not closed by ')'")
+
+
+def expand(value: str, macros: dict, depth: int = 0) -> str:
+    """
+    Expands the macros in a value.
+
+    Undefined macros without a default expand to an empty string, as in
+    condor_submit.
+
+    Raises:
+        ValueError: If the macros reference each other in a loop
+    """
+    if depth > 32:
+        raise ValueError(f"Macros nested too deeply in {value}")
+
+    def replace(match: 're.Match') -> str:
+        env, name, default = match.groups()
+        if env:
+            return os.environ.get(name, default or '')
+        if name.lower() in macros:
+            return expand(macros[name.lower()], macros, depth + 1)
+        return default or ''
+
+    return MACRO.sub(replace, value)
+
+
+def references(value: str, macros: dict, depth: int = 0) -> set:
+    """Returns the names of all macros a value references, directly or through other macros."""
+    names = set()
+    if depth > 32:
+        return names
+    for env, name, _ in MACRO.findall(value):
+        if env:
+            continue
+        names.add(name.lower())
+        if name.lower() in macros:
+            names |= references(macros[name.lower()], macros, depth + 1)
+    return names
+
+
+def evaluate(expression: str) -> object:
+    """
+    Evaluates an arithmetic expression of numbers, e.g. 4 * 1024.
+
+    Integer division truncates, as in ClassAd expressions.
+
+    Raises:
+        ValueError: If the expression is not plain arithmetic
+    """
+    try:
+        tree = ast.parse(expression.strip(), mode='eval')
+    except SyntaxError:
+        raise ValueError(f"Cannot evaluate {expression}") from None
+
+    def value(node: ast.AST) -> object:
+        if isinstance(node, ast.Expression):
+            return value(node.body)
+        if isinstance(node, ast.Num if LEGACY_NUMBERS else ast.Constant):
+            number = node.n if LEGACY_NUMBERS else node.value
+            if isinstance(number, (int, float)) and not isinstance(number, bool):
+                return number
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+            operand = value(node.operand)
+            return -operand if isinstance(node.op, ast.USub) else operand
+        if isinstance(node, ast.BinOp):
+            left, right = value(node.left), value(node.right)
+            if isinstance(node.op, ast.Div):
+                if isinstance(left, int) and isinstance(right, int):
+                    return int(left / right)
+                return left / right
+            if type(node.op) in OPERATORS:
+                return OPERATORS[type(node.op)](left, right)
+        raise ValueError(f"Cannot evaluate {expression}")
+
+    try:
+        return value(tree)
+    except ZeroDivisionError:
+        raise ValueError(f"Division by zero in {expression}") from None
+
+
+def request_value(key: str, value: str) -> object:
+    """
+    Converts an expanded request into the notation of the command line.
+
+    Returns:
+        An int for cpu and gpu. A storage size for ram and disk, either as
+        given (e.g. 6GB) or computed in the default unit of condor_submit.
+
+    Raises:
+        ValueError: If the value is malformed
+    """
+    value = value.strip()
+    if key in DEFAULT_UNITS:
+        storage = STORAGE.match(value)
+        if storage is not None:
+            number, unit = storage.groups()
+        else:
+            number, unit = evaluate(value), DEFAULT_UNITS[key]
+            if number < 0:
+                raise ValueError(f"Negative {key} request: {value}")
+        number = float(number)
+        # the storage notation of the command line allows a single decimal
+        number = f"{number:.0f}" if number == int(number) else f"{number:.1f}"
+        try:
+            return validate_storage_size(number + unit)
+        except ArgumentTypeError as e:
+            raise ValueError(str(e)) from None
+
+    number = evaluate(value)
+    if number != int(number) or number < 0:
+        raise ValueError(f"Invalid {key} request: {value}")
+    return int(number)
+
+
+def job_shape(requests: dict, macros: dict) -> tuple:
+    """Returns the shape (cpu, gpu, ram, disk, requirements) of a job with the given macros."""
+    shape = {'cpu': 0, 'gpu': 0, 'ram': '', 'disk': '', 'requirements': ''}
+    for command, key in REQUESTS.items():
+        if command in requests:
+            value = expand(requests[command], macros)
+            if value.strip():
+                shape[key] = request_value(key, value)
+    for command, key in EXPRESSIONS.items():
+        if command in requests:
+            shape[key] = expand(requests[command], macros).strip()
+    return tuple(shape[key] for key in SHAPE_KEYS)
+
+
+def shape_dict(shape: tuple, jobs: int) -> dict:
+    """Returns a shape as dict with its number of jobs, without an empty requirements."""
+    result = dict(zip(SHAPE_KEYS, shape), jobs=jobs)
+    if not result['requirements']:
+        del result['requirements']
+    return result
+
+
+def queue_jobs(statement: str, macros: dict, directory: str, files: list) -> object:
+    """
+    Expands a queue statement into job shapes and their number of jobs.
+
+    Args:
+        statement: The queue statement without the queue keyword
+        macros: The macros defined before the statement
+        directory: The directory of the submit file, for relative paths
+        files: The list of files read, to which item data files are added
+
+    Returns:
+        A generator of (shape, jobs) pairs, shapes may repeat.
+
+    Raises:
+        ValueError: If the statement is malformed
+    """
+    mode = QUEUE_MODE.search(statement)
+    head = statement[:mode.start()] if mode else statement
+    tokens = head.replace(',', ' ').split()
+    names = ['Item']
+    count_expression = head
+    if mode:
+        if tokens and not re.match(r'^[A-Za-z_]\w*$', tokens[0]):
+            count_expression = tokens.pop(0)
+        else:
+            count_expression = ''
+        names = tokens or names
+
+    count = int(evaluate(expand(count_expression, macros))) if count_expression.strip() else 1
+    if count < 0:
+        raise ValueError(f"Negative queue count in: queue {statement}")
+
+    requests = {command: macros[command] for command in (*REQUESTS, *EXPRESSIONS) if command in macros}
+    referenced = set()
+    for value in requests.values():
+        referenced |= references(value, macros)
+
+    if not mode:
+        items = [None]
+    else:
+        items = queue_items(mode.group(1).lower(), statement[mode.end():], directory, files)
+
+    item_macros = {name.lower() for name in names} | {'item'}
+    # evaluate the shape once per statement, per item or per job, whatever it depends on
+    if not referenced & (item_macros | JOB_MACROS):
+        shape = job_shape(requests, macros)
+        yield shape, count * sum(1 for _ in items)
+        return
+
+    per_job = bool(referenced & JOB_MACROS)
+    # item data usually repeats a few shapes, so each is evaluated once per distinct value
+    dependencies = sorted(referenced)
+    known = {}
+
+    def shape_of(values: dict) -> tuple:
+        key = tuple(values.get(name) for name in dependencies)
+        if key not in known:
+            known[key] = job_shape(requests, values)
+        return known[key]
+
+    for index, item in enumerate(items):
+        values = dict(macros, itemindex=str(index), row=str(index))
+        if item is not None:
+            fields = re.split(r'[\s,]+', item.strip(), maxsplit=len(names) - 1) if len(names) > 1 \
+                else [item.strip()]
+            fields += [''] * (len(names) - len(fields))
+            values.update((name.lower(), field) for name, field in zip(names, fields))
+        if not per_job:
+            yield shape_of(values), count
+            continue
+        for step in range(count):
+            values.update(step=str(step), process=str(index * count + step),
+                          procid=str(index * count + step))
+            yield shape_of(values), 1
+
+
+def queue_items(mode: str, arguments: str, directory: str, files: list) -> object:
+    """
+    Returns the items of a queue statement.
+
+    Args:
+        mode: 'in', 'from' or 'matching'
+        arguments: The text after the mode, e.g. a list, a file or a pattern
+        directory: The directory of the submit file, for relative paths
+        files: The list of files read, to which item data files are added
+
+    Returns:
+        An iterable of item lines. Item data files are read lazily.
+    """
+    arguments = arguments.strip()
+    if arguments.startswith('('):
+        if not arguments.endswith(')'):
+            raise ValueError(f"Queue item list is not closed by ')': {arguments}")
+        arguments = arguments[1:-1]
+        lines = [line for line in arguments.splitlines() if line.strip()]
+        if mode == 'in' and len(lines) <= 1:
+            return [item.strip() for item in arguments.split(',') if item.strip()]
+        return [line.strip() for line in lines]
+
+    if mode == 'in':
+        return [item.strip() for item in arguments.split(',') if item.strip()]
+
+    if mode == 'from':
+        path = os.path.join(directory, arguments)
+        files.append(path)
+        return read_items(path)
+
+    words = arguments.split()
+    kind = None
+    if words and words[0].lower() in ('files', 'dirs'):
+        kind = words.pop(0).lower()
+    matches = []
+    for pattern in words:
+        files.append(os.path.dirname(os.path.join(directory, pattern)) or directory)
+        for match in sorted(glob.glob(os.path.join(directory, pattern))):
+            if kind == 'files' and not os.path.isfile(match) or kind == 'dirs' and not os.path.isdir(match):
+                continue
+            matches.append(os.path.relpath(match, directory))
+    return matches
+
+
+def read_items(path: str) -> object:
+    """Yields the non-empty lines of an item data file without reading it at once."""
+    with open(path, 'r') as stream:
+        for line in stream:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line
@@ -0,0 +1,160 @@
+"""Lightweight measurement of the phases of a run (--timings, --profile)."""
+
+import sys
+import threading
+import time
+
+from contextlib import contextmanager
+
+# The measured phases by name, or None while measuring is disabled
+PHASES = None
+
+# The phases running in each thread, innermost last, as the seconds spent in
+# the phases nested in them so far
+_RUNNING = threading.local()
+
+
+def enable() -> None:
+    """Starts measuring the phases, dropping earlier measurements."""
+    global PHASES
+    PHASES = {}
+
+
+def disable() -> None:
+    """Stops measuring the phases."""
+    global PHASES
+    PHASES = None
+
+
+def peak_memory() -> float:
+    """Returns the peak resident memory of the process in MiB, or None if it is unknown."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+def running() -> list:
+    """Returns the nested seconds of the phases running in the current thread."""
+    stack = getattr(_RUNNING, 'stack', None)
+    if stack is None:
+        stack = _RUNNING.stack = []
+    return stack
+
+
+def nest(seconds: float) -> None:
+    """Counts seconds measured by a phase as nested in the innermost running phase."""
+    stack = running()
+    if stack:
+        stack[-1] += seconds
+
+
+def record(name: str, seconds: float, counts: dict) -> None:
+    """
+    Adds a measurement to the phase name.
+
+    A phase that runs several times, e.g. once per pool, is reported once
+    with the summed wall time and counts and the number of calls.
+    """
+    stats = PHASES.setdefault(name, {'calls': 0, 'seconds': 0.0})
+    stats['calls'] += 1
+    stats['seconds'] += seconds
+    stats['peak_mib'] = peak_memory()
+    for key, value in counts.items():
+        stats[key] = stats.get(key, 0) + value
+
+
+@contextmanager
+def phase(name: str) -> dict:
+    """
+    Measures the wall time of a block as the phase name.
+
+    Phases may be nested, e.g. 'sort' runs within 'check'. The time of a
+    nested phase is only counted for the nested phase and left out of the
+    enclosing one, so the phases of a thread never add up to more than its
+    wall time.
+
+    Yields a dict for the counts of the phase, e.g. the number of slots,
+    which the block fills in. Does nothing while measuring is disabled.
+    """
+    counts = {}
+    if PHASES is None:
+        yield counts
+        return
+
+    stack = running()
+    stack.append(0.0)
+    start = time.perf_counter()
+    try:
+        yield counts
+    finally:
+        seconds = time.perf_counter() - start
+        nested = stack.pop()
+        nest(seconds)
+        record(name, seconds - nested, counts)
+
+
+def counted(items: object, name: str, unit: str) -> object:
+    """
+    Measures the time spent producing the items of an iterable as the phase name.
+
+    Used for the stream of slot ads, which the collector produces while they
+    are deduplicated, so that the wait for the collector is told apart from
+    the work on the ads. Like a nested phase, the time is left out of the
+    running phase. The number of items is counted as unit.
+
+    Returns:
+        items, or a generator of the items while measuring is enabled.
+    """
+    if PHASES is None:
+        return items
+    return _counted(items, name, unit)
+
+
+def _counted(items: object, name: str, unit: str) -> object:
+    iterator = iter(items)
+    seconds = 0.0
+    count = 0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed = time.perf_counter() - start
+                seconds += elapsed
+                nest(elapsed)
+            count += 1
+            yield item
+    finally:
+        if PHASES is not None:
+            record(name, seconds, {unit: count})
+
+
+def report(output_format: str, stream: object = None) -> None:
+    """
+    Writes the measured phases to stream (default: stderr).
+
+    Args:
+        output_format: 'text' for a table or 'json' for a JSON object by phase
+        stream: Optional. The file to write to
+    """
+    stream = stream or sys.stderr
+    phases = PHASES or {}
+    if output_format == 'json':
+        import json
+
+        stream.write(json.dumps({'phases': phases}) + '\n')
+        return
+
+    stream.write(f"{'phase':<10} {'calls':>5} {'seconds':>9} {'peak MiB':>9}  counts\n")
+    for name, stats in phases.items():
+        counts = ', '.join(f"{key}={value}" for key, value in stats.items()
+                           if key not in ('calls', 'seconds', 'peak_mib'))
+        peak = '-' if stats['peak_mib'] is None else f"{stats['peak_mib']:.1f}"
+        stream.write(f"{name:<10} {stats['calls']:>5} {stats['seconds']:>9.3f} {peak:>9}  {counts}\n")
@@ -0,0 +1,262 @@
+"""Streaming parser for HTCondor job event logs (user logs)."""
+
+import itertools
+import math
+import mmap
+import os
+import random
+import re
+
+from datetime import date
+
+# The header line of an event: code, cluster, proc, date and time. The leading
+# newline lets the regex engine skip ahead to the next line quickly.
+HEADER = rb'([0-9]{3}) \(([0-9]+)\.([0-9]+)\.[0-9]+\) (\S+)(?: ([0-9][0-9:.]*))?'
+FIRST_EVENT = re.compile(HEADER)
+NEXT_EVENT = re.compile(rb'\n' + HEADER)
+
+# The line that ends an event
+TERMINATOR = b'\n...\n'
+
+# The event codes that change the state of a job
+SUBMIT, EXECUTE, EVICTED, TERMINATED, ABORTED, HELD, RELEASED = \
+    b'000', b'001', b'004', b'005', b'009', b'012', b'013'
+
+IDLE, RUNNING, HELD_STATE = 'idle', 'running', 'held'
+
+# The percentiles of the runtimes reported by calibrate
+PERCENTILES = (50, 90, 95)
+
+# The number of runtimes a log keeps as a sample for the percentiles
+RUNTIME_SAMPLE = 10000
+
+
+class UserLog:
+    """
+    The jobs of a user log, updated event by event.
+
+    The log is read through mmap and only the events written since the last
+    update are parsed, starting at the byte offset after the last complete
+    event. The memory needed grows with the number of unfinished jobs, not
+    with the size of the log. Of the runtimes of the terminated jobs, only a
+    uniform sample of at most RUNTIME_SAMPLE is kept, along with their
+    number, sum and maximum.
+
+    Attributes:
+        path: The path to the user log
+        offset: The number of bytes parsed, up to the end of the last
+            complete event
+        jobs: The state (idle, running, held) and the start of the current
+            run in seconds of every unfinished job by (cluster, proc) as
+            written in the log
+        states: The number of unfinished jobs in each state
+        completed: The number of terminated jobs
+        removed: The number of aborted jobs
+        runtimes: A sample of the runtimes of the last run of the terminated
+            jobs whose start is in the log, in seconds, which holds all of
+            them up to RUNTIME_SAMPLE jobs
+        runtime_count: The number of these runtimes
+        runtime_total: The sum of the runtimes
+        runtime_max: The longest runtime, 0 if there is none
+        last_start: The time of the last execute event in seconds, or None
+        first: The time of the first event in seconds, or None
+        last: The time of the last event in seconds, or None
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.offset = 0
+        self.jobs = {}
+        self.states = {IDLE: 0, RUNNING: 0, HELD_STATE: 0}
+        self.completed = 0
+        self.removed = 0
+        self.runtimes = []
+        self.runtime_count = 0
+        self.runtime_total = 0
+        self.runtime_max = 0
+        self.last_start = None
+        self.first = None
+        self.last = None
+        self._days = {}
+        self._clocks = {}
+        self._year = date.today().year
+        self._random = random.Random(0)
+
+    def update(self) -> int:
+        """
+        Parses the events written since the last update.
+
+        A log that shrank was rotated or rewritten and is parsed from the
+        start again.
+
+        Returns:
+            The number of events parsed.
+
+        Raises:
+            OSError: If the log cannot be read
+        """
+        with open(self.path, 'rb') as stream:
+            size = os.fstat(stream.fileno()).st_size
+            if size < self.offset:
+                self.__init__(self.path)
+            if size == self.offset:
+                return 0
+            with mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                return self.parse(buffer)
+
+    def parse(self, buffer: object) -> int:
+        """
+        Parses the complete events of buffer after offset, see update.
+
+        Only the events up to the last terminating '...' line are complete,
+        the ones after it are still being written and are left for the next
+        update. Their headers are found by a single regex scan over the
+        buffer, so the bodies of the events are never copied.
+        """
+        last = buffer.rfind(TERMINATOR, max(self.offset - 1, 0))
+        if last == -1:
+            return 0
+        events = NEXT_EVENT.finditer(buffer, max(self.offset - 1, 0), last + 1)
+        if self.offset == 0:
+            first = FIRST_EVENT.match(buffer, 0, last + 1)
+            events = itertools.chain([first] if first is not None else [], events)
+
+        count = 0
+        event = self.event
+        days = self._days
+        clocks = self._clocks
+        for match in events:
+            code, cluster, proc, day, clock = match.groups()
+            # the dates and times repeat a lot, so they are converted once each
+            if clock is None or day not in days or clock not in clocks:
+                seconds = self.seconds(day, clock)
+            else:
+                seconds = days[day] + clocks[clock]
+            event(code, (cluster, proc), seconds)
+            count += 1
+        self.offset = last + len(TERMINATOR)
+        return count
+
+    def event(self, code: bytes, job: tuple, seconds: int) -> None:
+        """Advances the state of a job by one event with the given code."""
+        if self.first is None:
+            self.first = seconds
+        self.last = seconds
+
+        # the job leaves its previous state, and enters the new one unless it finished
+        previous = self.jobs.pop(job, None)
+        if previous is not None:
+            self.states[previous[0]] -= 1
+        if code == SUBMIT or code == EVICTED or code == RELEASED:
+            state = (IDLE, None)
+        elif code == EXECUTE:
+            state = (RUNNING, seconds)
+            self.last_start = seconds
+        elif code == HELD:
+            state = (HELD_STATE, None)
+        elif code == TERMINATED:
+            self.completed += 1
+            if previous is not None and previous[1] is not None:
+                self.add_runtime(seconds - previous[1])
+            return
+        elif code == ABORTED:
+            self.removed += 1
+            return
+        elif previous is not None:
+            # other events do not change the state
+            state = previous
+        else:
+            return
+        self.jobs[job] = state
+        self.states[state[0]] += 1
+
+    def add_runtime(self, runtime: int) -> None:
+        """Counts the runtime of a terminated job, keeping it in runtimes by reservoir sampling."""
+        self.runtime_count += 1
+        self.runtime_total += runtime
+        self.runtime_max = max(self.runtime_max, runtime)
+        if len(self.runtimes) < RUNTIME_SAMPLE:
+            self.runtimes.append(runtime)
+        else:
+            kept = self._random.randrange(self.runtime_count)
+            if kept < RUNTIME_SAMPLE:
+                self.runtimes[kept] = runtime
+
+    def seconds(self, day: bytes, clock: bytes) -> int:
+        """
+        Converts the time of an event header into seconds.
+
+        Understands the ISO format (2024-05-01 12:00:00 or
+        2024-05-01T12:00:00+01:00) and the old format without a year
+        (05/01 12:00:00), which is placed in the current year, or the next
+        one once the dates of the log wrap around. Fractions of seconds and
+        time zones are ignored.
+        """
+        if clock is None:
+            day, _, clock = day.partition(b'T')
+        if day not in self._days:
+            if b'/' in day:
+                month, day_of_month = day.split(b'/')
+                ordinal = date(self._year, int(month), int(day_of_month)).toordinal()
+                # a log without years that runs into the next year
+                if self.last is not None and ordinal * 86400 < self.last - 180 * 86400:
+                    self._year += 1
+                    ordinal = date(self._year, int(month), int(day_of_month)).toordinal()
+            else:
+                year, month, day_of_month = day.split(b'-')
+                ordinal = date(int(year), int(month), int(day_of_month)).toordinal()
+            self._days[day] = ordinal * 86400
+        if clock not in self._clocks:
+            self._clocks[clock] = int(clock[0:2]) * 3600 + int(clock[3:5]) * 60 + int(clock[6:8])
+        return self._days[day] + self._clocks[clock]
+
+    def counts(self) -> dict:
+        """Returns the number of idle, running, held, completed and removed jobs."""
+        return dict(self.states, completed=self.completed, removed=self.removed)
+
+
+def percentile(values: list, percent: float) -> float:
+    """Returns the percentile of sorted values by the nearest-rank method."""
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+
+def runtime_statistics(runtimes: list) -> dict:
+    """
+    Summarises runtimes in seconds.
+
+    Returns:
+        The number of jobs, and the mean, the PERCENTILES (as p50, ...) and
+        the maximum of the runtimes in minutes.
+
+    Raises:
+        ValueError: If there are no runtimes
+    """
+    if not runtimes:
+        raise ValueError("The log contains no completed job with its start")
+    values = sorted(runtimes)
+    statistics = {'jobs': len(values), 'mean': sum(values) / len(values) / 60}
+    for percent in PERCENTILES:
+        statistics[f'p{percent}'] = percentile(values, percent) / 60
+    statistics['max'] = values[-1] / 60
+    return statistics
+
+
+def calibrate(path: str) -> dict:
+    """
+    Derives the job duration from the user log of an earlier run.
+
+    Returns:
+        The runtime statistics of the terminated jobs, see runtime_statistics.
+        The percentiles are those of the sample in UserLog.runtimes, the
+        number of jobs, the mean and the maximum are exact.
+
+    Raises:
+        OSError: If the log cannot be read
+        ValueError: If the log contains no completed jobs, or a malformed time
+    """
+    log = UserLog(path)
+    log.update()
+    statistics = runtime_statistics(log.runtimes)
+    statistics.update(jobs=log.runtime_count, mean=log.runtime_total / log.runtime_count / 60,
+                      max=log.runtime_max / 60)
+    return statistics
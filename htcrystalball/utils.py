@@ -1,5 +1,6 @@
 """Various non-specific utilities."""
 
+import math
 import re
 import os
 
@@ -97,6 +98,19 @@ def hours_to_days(number: float) -> int:
     return int(number / 24.0 + 0.5)
 
 
+def wall_time(n_jobs: int, total_jobs: int, job_duration: float) -> int:
+    """
+    Estimates the wall time in minutes for n_jobs jobs of job_duration
+    minutes each, when total_jobs of them can run at the same time.
+    """
+    return int(max(math.ceil(n_jobs / total_jobs), 1)*job_duration + 0.5)
+
+
+def core_hours(n_jobs: int, job_duration: float, n_cores: int) -> int:
+    """Calculates the core-hours used by n_jobs jobs of job_duration minutes each."""
+    return math.ceil(n_jobs * job_duration * n_cores / 60.0)
+
+
 def compare_requested_available(req: float, avail: float) -> str:
     """
     Compares requested and available value to return a color code for the verbose output
@@ -117,26 +131,33 @@ def compare_requested_available(req: float, avail: float) -> str:
     return "green"
 
 
-def parse_submit_file(path):
-    params = {"cpu": 0,
-              "gpu": 0,
-              "ram": "",
-              "disk": ""
-              }
+def parse_submit_file(path: str) -> dict:
+    """
+    Reads the job request of a .submit file.
+
+    The file is parsed by submit.parse. If it queues several job shapes,
+    the shape with the most jobs is returned.
+
+    Returns:
+        The requested cpu and gpu (0 if not requested), ram and disk ('' if
+        not requested), the requirements expression ('' if none), the number
+        of jobs of the shape, the total number of jobs, the number of
+        shapes in the file and the custom job attributes. All are empty for
+        a missing file.
+
+    Raises:
+        ArgumentTypeError: If the file contains a malformed storage size
+        ValueError: If the file contains a malformed request or queue statement
+    """
+    params = {"cpu": 0, "gpu": 0, "ram": "", "disk": "", "requirements": "", "jobs": 0,
+              "total_jobs": 0, "shapes": 0, "attributes": {}}
     if os.path.isfile(path):
-        submit_file = open(path, "r")
-        for submit_line in submit_file:
-            # remove multiple blanks and whitespaces
-            submit_line = ' '.join(submit_line.split())
-            if "request_cpus" in submit_line:
-                params["cpu"] = int(submit_line.split("=")[1].strip())
-            elif "request_GPUs" in submit_line:
-                params["gpu"] = int(submit_line.split("=")[1].strip())
-            elif "request_memory" in submit_line:
-                params["ram"] = submit_line.split("=")[1].strip()
-                validate_storage_size(params["ram"])
-            elif "request_disk" in submit_line:
-                params["disk"] = submit_line.split("=")[1].strip()
-                validate_storage_size(params["disk"])
-        submit_file.close()
+        from htcrystalball import submit
+
+        parsed = submit.parse(path)
+        if parsed['shapes']:
+            params.update(max(parsed['shapes'], key=lambda shape: shape['jobs']))
+        params['total_jobs'] = parsed['jobs']
+        params['shapes'] = len(parsed['shapes'])
+        params['attributes'] = parsed.get('attributes', {})
     return params
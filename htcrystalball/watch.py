@@ -0,0 +1,109 @@
+"""Follows the job event log of a running job cluster and projects its completion."""
+
+import time
+
+from datetime import datetime
+
+from htcrystalball import display, userlog, LOGGER
+from htcrystalball.utils import wall_time
+
+
+def local_seconds(moment: datetime = None) -> int:
+    """Converts a local time, by default now, into seconds as in userlog.UserLog.seconds."""
+    moment = moment or datetime.now()
+    return moment.toordinal() * 86400 + moment.hour * 3600 + moment.minute * 60 + moment.second
+
+
+def project(log: userlog.UserLog, total_jobs: int, job_duration: float, now: int) -> dict:
+    """
+    Projects the time until the jobs of a log have completed.
+
+    The running jobs are done job_duration minutes after the last of them
+    started, and the idle jobs then run in waves of total_jobs jobs as in
+    utils.wall_time. Held jobs are left out, as they do not run until they
+    are released. Only the counters of the log are read, so a projection
+    takes the same time however long the log is.
+
+    Args:
+        log: The log of the job cluster
+        total_jobs: The number of jobs that can run on the pool at once
+        job_duration: The duration of a job in minutes. 0 takes the mean
+            runtime of the completed jobs of the log.
+        now: The current time in seconds, see local_seconds
+
+    Returns:
+        The counts of log.counts, the job_duration used and the remaining
+        minutes, which are None if no job duration is known yet.
+    """
+    status = log.counts()
+    if not job_duration and log.runtime_count:
+        job_duration = log.runtime_total / log.runtime_count / 60
+    status['job_duration'] = job_duration or None
+    status['remaining'] = None
+    if job_duration and total_jobs > 0:
+        remaining = 0.0
+        if status['running'] > 0 and log.last_start is not None:
+            remaining = max((log.last_start - now) / 60 + job_duration, 0.0)
+        if status['idle'] > 0:
+            remaining += wall_time(status['idle'], total_jobs, job_duration)
+        status['remaining'] = remaining
+    return status
+
+
+def finished(status: dict) -> bool:
+    """Returns whether all jobs of a projection have completed or were removed."""
+    return status['idle'] + status['running'] + status['held'] == 0 and \
+        status['completed'] + status['removed'] > 0
+
+
+def follow(path: str, total_jobs: int, job_duration: float, interval: float,
+           updates: int = None, clock: object = local_seconds,
+           recount: object = None) -> userlog.UserLog:
+    """
+    Reports the progress of a job cluster from its log until all jobs are done.
+
+    Every update only parses the events written since the one before, see
+    userlog.UserLog.update, and the projection is printed whenever there
+    were new events or the pool can run a different number of jobs.
+
+    Args:
+        path: The path to the job event log
+        total_jobs: The number of jobs that can run on the pool at once
+        job_duration: The duration of a job in minutes, see project
+        interval: The number of seconds between updates. 0 reads the log once.
+        updates: Optional. The maximum number of updates
+        clock: Optional. A function returning the current time, see
+            local_seconds
+        recount: Optional. A function without arguments returning the number
+            of jobs that can run on the pool as it is now, which replaces
+            total_jobs on every update after the first. If it fails, the
+            previous number is kept.
+
+    Returns:
+        The log as of the last update.
+
+    Raises:
+        OSError: If the log cannot be read
+        ValueError: If the log contains a malformed time
+    """
+    console = display.make_console()
+    log = userlog.UserLog(path)
+    count = 0
+    try:
+        while True:
+            previous = total_jobs
+            if recount is not None and count > 0:
+                try:
+                    total_jobs = recount()
+                except (Exception, SystemExit) as e:
+                    LOGGER.warning("Refreshing the slot configuration failed, "
+                                   "keeping the previous one: " + str(e))
+            if log.update() > 0 or count == 0 or total_jobs != previous:
+                status = project(log, total_jobs, job_duration, max(clock(), log.last or 0))
+                display.log_status(status, console)
+            count += 1
+            if finished(status) or interval <= 0 or (updates is not None and count >= updates):
+                return log
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        return log
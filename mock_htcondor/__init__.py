@@ -6,35 +6,62 @@ A) no htcondor module is available such as Macs and
 B) no htcondor pool is available.
 """
 
+import re
+
+from mock_htcondor.synthetic import synthetic_ads
+
+# Mocked configuration values of htcondor.param
+param = {}
+
+
+class AdTypes:
+    """
+    Class to mock the htcondor.AdTypes enumeration
+    """
+    Startd = "Startd"
+
+
+class HTCondorLocateError(Exception):
+    """
+    Class to mock the exception raised if no collector can be located
+    """
+
 
 class Collector:
     """
     Class to mock htcondor.Collector(), therefore named also Collector
     """
 
-    def __init__(self):
+    def __init__(self, pool=None):
         """
 
         Initialize the collector with a default list of slot configurations
         that mock the output of htcondor.Collector().query()
         """
+        self.pool = pool
         self.query_output = [
             {
+                "Name": "slot1@cpu2",
                 "Machine": "cpu2",
+                "LastHeardFrom": 1,
                 "TotalSlotCpus": "1",
                 "TotalSlotDisk": "287530000",
                 "TotalSlotMemory": "500000",
                 "SlotType": "Static",
             },
             {
+                "Name": "slot1@cpu3",
                 "Machine": "cpu3",
+                "LastHeardFrom": 1,
                 "TotalSlotCpus": "1",
                 "TotalSlotDisk": "287680000",
                 "TotalSlotMemory": "500000",
                 "SlotType": "Partitionable",
             },
             {
+                "Name": "slot1@gpu1",
                 "Machine": "gpu1",
+                "LastHeardFrom": 1,
                 "TotalSlotCpus": "1",
                 "TotalSlotGPUs": "4",
                 "TotalSlotDisk": "287680000",
@@ -42,11 +69,94 @@ class Collector:
                 "SlotType": "Partitionable",
             }]
 
-    def query(self):
+    @classmethod
+    def synthetic(cls, pool=None, **kwargs):
+        """
+        Creates a collector of a synthetic pool, see synthetic.synthetic_ads
+        for the keyword arguments.
+        """
+        collector = cls(pool)
+        collector.query_output = list(synthetic_ads(**kwargs))
+        return collector
+
+    def query(self, ad_type=None, constraint=None, projection=None):
         """
         Function to return the mocked Collector.query result of
-        htcondor which is a list of slot dictionaries.
+        htcondor which is a list of slot dictionaries. The attribute names
+        of the projection are case-insensitive, as in ClassAds.
+        Only constraints that combine comparisons of an attribute with a
+        literal by && are understood.
         Returns:
 
         """
-        return self.query_output
+        if constraint is None and projection is None:
+            return self.query_output
+
+        return [project(ad, projection) for ad in self.query_output if matches(ad, constraint)]
+
+    def xquery(self, ad_type=None, constraint=None, projection=None):
+        """
+        Function to mock a streaming collector query, which hands out the
+        same ads as query one by one from a generator. Counts the ads handed
+        out in self.streamed.
+        """
+        self.streamed = 0
+        for ad in self.query_output:
+            if matches(ad, constraint):
+                self.streamed += 1
+                yield project(ad, projection)
+
+    def update(self, name, **attributes):
+        """
+        Simulates an update of a slot ad, which is added if it does not exist.
+        The LastHeardFrom of the ad is advanced beyond all other ads.
+        """
+        clock = max([int(ad.get("LastHeardFrom", 0)) for ad in self.query_output] + [0]) + 1
+        for ad in self.query_output:
+            if ad.get("Name") == name:
+                ad.update(attributes, LastHeardFrom=clock)
+                return
+        self.query_output.append(dict(attributes, Name=name, LastHeardFrom=clock))
+
+    def remove(self, name):
+        """
+        Simulates a slot ad vanishing from the pool.
+        """
+        self.query_output = [ad for ad in self.query_output if ad.get("Name") != name]
+
+
+def project(ad, projection):
+    """
+    Returns the attributes of an ad that are in the projection, all of them
+    without a projection or with an empty one, as in the bindings. Attribute
+    names are compared case-insensitively.
+    """
+    if not projection:
+        return dict(ad)
+    names = {name.lower() for name in projection}
+    return {key: ad[key] for key in ad if key.lower() in names}
+
+
+def matches(ad, constraint):
+    """
+    Evaluates a simple constraint like 'SlotType != "Dynamic" && LastHeardFrom >= 3'
+    against a mocked ad.
+    """
+    if not constraint:
+        return True
+
+    operators = {
+        "==": lambda a, b: a == b, "!=": lambda a, b: a != b,
+        ">=": lambda a, b: a >= b, "<=": lambda a, b: a <= b,
+        ">": lambda a, b: a > b, "<": lambda a, b: a < b,
+    }
+    for clause in constraint.split("&&"):
+        attribute, operator, value = re.match(r'\s*(\w+)\s*(==|!=|>=|<=|>|<)\s*(.+?)\s*$', clause).groups()
+        if attribute not in ad:
+            return False
+        if value.startswith('"'):
+            if not operators[operator](str(ad[attribute]), value.strip('"')):
+                return False
+        elif not operators[operator](float(ad[attribute]), float(value)):
+            return False
+    return True
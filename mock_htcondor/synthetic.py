@@ -0,0 +1,81 @@
+"""
+Seeded generator of synthetic HTCondor pools for tests and benchmarks.
+The generated slot ads look like the ones returned by
+htcondor.Collector().query() on a heterogeneous pool, so every stage of
+htcrystalball can be measured on realistic pools without a collector.
+"""
+
+import random
+
+# Node hardware as (CPUs, memory in MiB, disk in KiB)
+NODE_TYPES = [
+    (12, 66560, 3580000000),
+    (24, 215040, 3580000000),
+    (32, 257024, 1690000000),
+    (64, 512000, 7160000000),
+    (128, 1031168, 7160000000),
+]
+
+# GPUs per GPU node
+GPU_COUNTS = [1, 2, 4, 8]
+
+
+def synthetic_ads(nodes=1000, slots_per_node=8, partitionable_ratio=0.7,
+                  gpu_share=0.1, duplicate_ratio=0.9, seed=42):
+    """
+    Generates the slot ads of a synthetic pool.
+
+    Every node gets a random hardware type. A partitionable node offers its
+    resources in slots_per_node partitionable slots, a static node in
+    slots_per_node static slots, each with an equal share of the node.
+    The GPUs of a node are spread over its slots, one more to the first
+    slots if they do not divide evenly, so slots may get none. Apart from
+    its GPUs, a slot is an exact duplicate of the node's first slot with the
+    probability duplicate_ratio, otherwise its memory and disk are up to an
+    eighth smaller, as happens with hand-tuned slot layouts, and it becomes
+    a slot configuration of its own.
+
+    Args:
+        nodes: The number of nodes
+        slots_per_node: The number of slot ads per node
+        partitionable_ratio: The share of nodes with partitionable slots
+        gpu_share: The share of nodes with GPUs
+        duplicate_ratio: The probability that a slot duplicates the first
+            slot of its node
+        seed: The seed of the random generator, equal arguments always
+            generate equal pools
+
+    Returns:
+        A generator of nodes * slots_per_node slot ads.
+    """
+    rng = random.Random(seed)
+
+    for node in range(nodes):
+        machine = f"node{node:07d}.htc.test.com"
+        cpus, memory, disk = rng.choice(NODE_TYPES)
+        gpus = rng.choice(GPU_COUNTS) if rng.random() < gpu_share else 0
+        slot_type = "Partitionable" if rng.random() < partitionable_ratio else "Static"
+        mips = rng.randint(15000, 45000)
+
+        slot_cpus = max(1, cpus // slots_per_node)
+        slot_memory = memory // slots_per_node
+        slot_disk = disk // slots_per_node
+        slot_gpus, extra_gpus = divmod(gpus, slots_per_node)
+
+        for slot in range(slots_per_node):
+            ad = {
+                "Name": f"slot{slot + 1}@{machine}",
+                "Machine": machine,
+                "LastHeardFrom": 1,
+                "SlotType": slot_type,
+                "TotalSlotCpus": slot_cpus,
+                "TotalSlotMemory": slot_memory,
+                "TotalSlotDisk": slot_disk,
+                "TotalSlotGPUs": slot_gpus + (slot < extra_gpus),
+                "Mips": mips,
+            }
+            if slot > 0 and rng.random() >= duplicate_ratio:
+                # up to an eighth less, so the slot keeps most of its share
+                ad["TotalSlotMemory"] = slot_memory - slot_memory * rng.randint(1, 64) // 512
+                ad["TotalSlotDisk"] = slot_disk - slot_disk * rng.randint(1, 64) // 512
+            yield ad
@@ -68,6 +68,10 @@ setup(
         'testfixtures>=6.17.0'
     ],
     extras_require={
+        'numpy': [
+            # for the vectorized slot checking engine (--engine numpy)
+            'numpy',
+        ],
         'devel-docs': [
             # for converting README.md -> .rst for long description
             'pypandoc',
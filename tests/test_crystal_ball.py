@@ -1,14 +1,24 @@
 """Module for testing the htcrystalball module."""
 
 import argparse
+import csv
+import datetime
+import heapq
+import io
+import itertools
+import json
+import os
 import sys
+import threading
+import time
 
 from pytest import raises as praises
 from testfixtures import TempDirectory
 sys.modules['htcondor'] = __import__('mock_htcondor')
 from htcondor import Collector as mocked_collector
 
-from htcrystalball import examine, collect, utils
+from htcrystalball import batch, display, examine, collect, index, main, optimize, packing, records, server, simulate, userlog, \
+    utils, watch
 
 
 def test_storage_validator():
@@ -143,6 +153,73 @@ def test_submit_parser():
         assert not utils.parse_submit_file(d.path+'/test.submit')["ram"] == "6000MB"
 
 
+def test_submit_queue_expansion(monkeypatch):
+    """
+    Tests macros, arithmetic and queue statements of the .submit file parser.
+    :return:
+    """
+    from htcrystalball import submit
+
+    with TempDirectory() as d:
+        d.write('items.txt', b'small 1024\nbig 4096\n\nsmall 1024\n')
+        d.write('a.dat', b'')
+        d.write('b.dat', b'')
+        d.write('job.submit', b'# a comment\n'
+                              b'mem = 4 * \\\n 1024\n'
+                              b'request_cpus = $(cpus:2)\n'
+                              b'request_memory = $(mem)\n'
+                              b'request_disk = 2 GB\n'
+                              b'queue 3\n'
+                              b'request_memory = $(size)\n'
+                              b'queue 2 name, size from items.txt\n'
+                              b'request_memory = 512 * ($(Step) + 1)\n'
+                              b'queue 2 in (x, y)\n'
+                              b'request_cpus = 1\n'
+                              b'request_GPUs = $ENV(HTCB_GPUS)\n'
+                              b'request_memory = 1GB\n'
+                              b'queue file matching files *.dat\n'
+                              b'queue from (\n a\n b\n)\n')
+        monkeypatch.setenv("HTCB_GPUS", "1")
+        path = d.path + '/job.submit'
+        assert submit.parse(path) == {'jobs': 17, 'shapes': [
+            {'cpu': 2, 'gpu': 0, 'ram': '4096MiB', 'disk': '2GB', 'jobs': 5},
+            {'cpu': 2, 'gpu': 0, 'ram': '1024MiB', 'disk': '2GB', 'jobs': 6},
+            {'cpu': 2, 'gpu': 0, 'ram': '512MiB', 'disk': '2GB', 'jobs': 2},
+            {'cpu': 1, 'gpu': 1, 'ram': '1GB', 'disk': '2GB', 'jobs': 4},
+        ]}
+
+        # the shape with the most jobs is used, with its number of jobs unless --jobs is given
+        assert examine.apply_submit_file(path, 4, 0, "1GB", "1GB") == (2, 0, '1024MiB', '2GB', 6)
+        assert examine.apply_submit_file(path, 4, 0, "1GB", "1GB", 10)[4] == 10
+        assert [shape[4] for shape in packing.read_mix(path)] == [5, 6, 2, 4]
+
+        # the result is cached until the submit file or an item data file changes
+        assert submit.parse(path) is submit.parse(path)
+        first = submit.parse(path)
+        d.write('items.txt', b'big 4096\n')
+        os.utime(d.path + '/items.txt', ns=(0, 0))
+        assert submit.parse(path) is not first and submit.parse(path)['jobs'] == 13
+
+        # item data is streamed: a long item list only keeps the distinct shapes
+        with open(d.path + '/many.txt', 'w') as many:
+            many.writelines(f"{i % 2 + 1}\n" for i in range(100000))
+        d.write('many.submit', b'request_cpus = $(n)\nrequest_memory = 2 * 1024 / 3\nqueue n from many.txt\n')
+        assert submit.parse(d.path + '/many.submit')['shapes'] == [
+            {'cpu': 1, 'gpu': 0, 'ram': '682MiB', 'disk': '', 'jobs': 50000},
+            {'cpu': 2, 'gpu': 0, 'ram': '682MiB', 'disk': '', 'jobs': 50000}]
+
+        for broken in [b'request_cpus = 1.5\nqueue', b'request_memory = max(1, 2)\nqueue',
+                       b'request_cpus = 1\nqueue -1', b'queue from (\n a\n']:
+            d.write('broken.submit', broken)
+            with praises(ValueError):
+                submit.parse(d.path + '/broken.submit')
+        d.write('missing.submit', b'queue from nothing.txt\n')
+        with praises(OSError):
+            submit.parse(d.path + '/missing.submit')
+
+        assert main.build_parser().parse_args(["-c", "1", "-r", "1GB"]).jobs is None
+
+
 def test_calc_manager():
     """
     Tests the method for preparing the slot checking.
@@ -277,21 +354,16 @@ def test_slot_checking():
         examine.filter_slots(slots, "partitionable"),
         1, 10.0, 0.0, 0, 1, 0.0, 0, verbose=False
     )
-    assert "slots" in examine.check_slots(
-        examine.filter_slots(slots, "static"),
-        examine.filter_slots(slots, "partitionable"),
-        1, 10.0, 0.0, 0, 1, 0.0, 0, verbose=False
-    )
     assert examine.check_slots(
         examine.filter_slots(slots, "static"),
         examine.filter_slots(slots, "partitionable"),
         0, 10.0, 0.0, 0, 1, 0.0, 0, verbose=False
-    ) == {'slots': [], 'preview': []}
+    ) == {'preview': []}
     assert examine.check_slots(
         examine.filter_slots(slots, "static"),
         examine.filter_slots(slots, "partitionable"),
         0, 10.0, 0.0, 0, 1, 0.0, 0, verbose=False
-    ) == {'slots': [], 'preview': []}
+    ) == {'preview': []}
 
 
 def test_slot_result():
@@ -304,12 +376,10 @@ def test_slot_result():
     slots = collect.collect_slots(mocked_content)
 
     ram = 10.0
-    result = examine.check_slots(
-        examine.filter_slots(slots, "Static"),
-        examine.filter_slots(slots, "Partitionable"),
-        1, ram, 0.0, 0, 1, 0.0, 0, verbose=False
-    )
-    slots = result["slots"]
+    static = examine.filter_slots(slots, "Static")
+    partitionable = examine.filter_slots(slots, "Partitionable")
+    result = examine.check_slots(static, partitionable, 1, ram, 0.0, 0, 1, 0.0, 0, verbose=False)
+    slots = static + partitionable
     previews = result["preview"]
 
     for preview in previews:
@@ -416,3 +486,1213 @@ def test_slot_reader():
     """
     mocked_content = mocked_collector().query()
     collect.collect_slots(mocked_content)
+
+
+def test_slot_deduplication():
+    """
+    Tests that identical slots of a node are merged and counted in SimSlots
+    :return:
+    """
+    static = {"Machine": "cpu1", "TotalSlotCpus": "1", "TotalSlotDisk": "1048576",
+              "TotalSlotMemory": "1024", "SlotType": "Static"}
+    partitionable = dict(static, TotalSlotCpus="8", SlotType="Partitionable")
+    content = [static, partitionable, static, dict(static, Machine="cpu2"), static]
+
+    slots = collect.collect_slots(content)
+
+    assert list(slots) == ["cpu1", "cpu2"]
+    assert slots["cpu1"] == [
+        {"TotalSlotCpus": 1, "TotalSlotGPUs": 0, "TotalSlotDisk": 1.0,
+         "TotalSlotMemory": 1.0, "SlotType": "Static", "SimSlots": 3},
+        {"TotalSlotCpus": 8, "TotalSlotGPUs": 0, "TotalSlotDisk": 1.0,
+         "TotalSlotMemory": 1.0, "SlotType": "Partitionable", "SimSlots": 1},
+    ]
+    assert slots["cpu2"][0]["SimSlots"] == 1
+
+
+def test_slot_cache():
+    """
+    Tests storing and loading the slot configuration cache
+    :return:
+    """
+    snapshot = collect.snapshot_slots(mocked_collector().query())
+    query_data = ["SlotType", "Machine"]
+
+    with TempDirectory() as d:
+        assert collect.load_snapshot("host", query_data, directory=d.path) is None
+
+        start = time.time()
+        collect.store_snapshot(snapshot, "host", query_data, directory=d.path)
+        cached = collect.load_snapshot("host", query_data, directory=d.path)
+        assert cached["slots"] == snapshot["slots"] and cached["members"] == snapshot["members"]
+        assert cached["last_heard"] == snapshot["last_heard"] and cached["created"] >= start
+        # other collector and other projection are misses
+        assert collect.load_snapshot("other", query_data, directory=d.path) is None
+        assert collect.load_snapshot("host", query_data + ["Name"], directory=d.path) is None
+
+        # the snapshots of other projections do not pile up, the most recent ones are kept
+        for attribute in range(collect.CACHE_FILES + 4):
+            collect.store_snapshot(snapshot, "host", query_data + [f"Attribute{attribute}"], directory=d.path)
+        assert len(os.listdir(d.path)) == collect.CACHE_FILES
+        assert collect.load_snapshot("host", query_data, directory=d.path) is None
+        collect.store_snapshot(snapshot, "host", query_data, directory=d.path)
+        os.utime(collect.cache_file("host", query_data, d.path), (start + 60, start + 60))
+        collect.prune_cache(d.path, keep=1)
+        assert os.listdir(d.path) == [os.path.basename(collect.cache_file("host", query_data, d.path))]
+
+
+def test_peek_uses_cache(monkeypatch):
+    """
+    Tests that peek only queries the collector if there is no valid cache
+    :return:
+    """
+    queries = []
+
+    def xquery(self, *args, **kwargs):
+        queries.append(args)
+        return iter(self.query_output)
+
+    monkeypatch.setattr(mocked_collector, "xquery", xquery)
+    params = main.build_parser().parse_args(["--cpu", "1", "--ram", "10GB"])
+
+    with TempDirectory() as d:
+        monkeypatch.setattr(collect, "SLOTS_CONFIGURATION", d.path)
+        for refresh, expected_queries in [(False, 1), (False, 1), (True, 2)]:
+            params.refresh = refresh
+            with praises(SystemExit):
+                main.peek(params, parsers=[])
+            assert len(queries) == expected_queries
+
+        # an expired cache is refreshed with the changed slots and the names of all slots
+        params.refresh, params.max_age = False, "0"
+        with praises(SystemExit):
+            main.peek(params, parsers=[])
+        assert len(queries) == 4
+
+
+def test_numpy_engine():
+    """
+    Tests that the numpy engine gives the same totals and previews as the dict engine
+    :return:
+    """
+    content = [
+        {"Machine": f"cpu{i % 7}", "TotalSlotCpus": str(1 + i % 16), "TotalSlotGPUs": str(i % 3),
+         "TotalSlotDisk": str(1048576 * (10 + i % 50)), "TotalSlotMemory": str(1024 * (4 + i % 60)),
+         "SlotType": "Static" if i % 4 else "Partitionable"}
+        for i in range(400)
+    ]
+    slots = collect.collect_slots(content)
+    static = examine.filter_slots(slots, "Static")
+    partitionable = examine.filter_slots(slots, "Partitionable")
+
+    for cpu, ram, disk, gpu in [(1, 2.0, 0.0, 0), (2, 10.0, 20.0, 1), (0, 1.0, 0.0, 0),
+                                (8, 30.0, 5.5, 2), (32, 1.0, 0.0, 0)]:
+        for max_nodes, verbose in [(0, True), (3, False), (0, False)]:
+            expected = examine.evaluate(static, partitionable, cpu, ram, disk, gpu,
+                                        max_nodes, verbose, engine="dict")
+            result = examine.evaluate(static, partitionable, cpu, ram, disk, gpu,
+                                      max_nodes, verbose, engine="numpy")
+            assert result[1] == expected[1]
+            if verbose or max_nodes:
+                assert result[0]["preview"] == expected[0]["preview"]
+            else:
+                assert result[0]["preview"] == []
+
+    assert examine.prepare(
+        cpu=1, gpu=0, ram="10GB", disk="", jobs=1, job_duration="10m",
+        maxnodes=0, file="", verbose=True, content=content, engine="numpy"
+    )
+
+
+def test_batch(monkeypatch):
+    """
+    Tests evaluating a stream of job shapes in CSV and JSON lines format
+    :return:
+    """
+    slots = collect.collect_slots(mocked_collector().query())
+
+    for engine in ["dict", "numpy"]:
+        with TempDirectory() as d:
+            d.write('shapes.csv', b'name,cpu,ram,gpu,jobs,time\n'
+                                  b'small,1,10G,,100,10m\n'
+                                  b'gpu,1,20G,1,,\n'
+                                  b'broken,1,10,,,\n'
+                                  b'ragged,1,10G,,1,1h,extra\n'
+                                  b'short,1,10G\n')
+            output = io.StringIO()
+            assert batch.run(slots, d.path + '/shapes.csv', engine=engine, output=output) == 5
+
+            rows = list(csv.DictReader(io.StringIO(output.getvalue())))
+            assert [row["name"] for row in rows] == ["small", "gpu", "broken", "ragged", "short"]
+            assert rows[0]["total_jobs"] == "3"
+            assert rows[0]["core_hours"] == "17"
+            assert rows[0]["wall_time"] == "340"
+            assert rows[1]["total_jobs"] == "1"
+            assert rows[1]["wall_time"] == ""
+            assert rows[2]["error"]
+            # a row with more fields than the header is reported without aborting the batch
+            assert rows[3]["error"] == "The row has more fields than the header: extra"
+            assert rows[3]["total_jobs"] == "" and None not in rows[3]
+            assert rows[4]["total_jobs"] == "3"
+
+    monkeypatch.setattr(sys, "stdin", io.StringIO('{"cpu": 1, "ram": "10G", "jobs": 6, "time": "1h"}\n'
+                                                  '\n'
+                                                  '{"cpu": 0, "ram": "10G"}\n'
+                                                  '[1, 2]\n'
+                                                  '4\n'
+                                                  '{"cpu": 1,\n'
+                                                  '{"cpu": 1, "ram": "10G"}\n'
+                                                  '{"cpu": 1, "ram": "10G", "jobs": 0, "time": "1h"}\n'
+                                                  '{"cpu": -1, "ram": "10G"}\n'
+                                                  '{"cpu": 1, "ram": "10G", "gpu": -1}\n'
+                                                  '{"cpu": 1, "ram": "10G", "jobs": -6}\n'
+                                                  '{"cpu": 1, "ram": "10G", "jobs": "", "time": "1h"}\n'))
+    output = io.StringIO()
+    assert batch.run(slots, '-', output=output) == 11
+    rows = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert rows[0]["total_jobs"] == 3
+    assert rows[0]["wall_time"] == 120
+    assert rows[1]["total_jobs"] is None
+    assert rows[1]["error"]
+    # lines that are no job shape object are reported without aborting the batch
+    assert rows[2]["error"] == "A job shape must be a JSON object, not [1, 2]"
+    assert rows[3]["error"] and rows[4]["error"].startswith("Malformed JSON line")
+    assert rows[5]["total_jobs"] == 3
+    # no jobs or negative resources are errors, only a missing number of jobs means one
+    assert rows[6]["error"] == "The number of jobs must be positive" and rows[6]["core_hours"] is None
+    assert all(row["error"] and row["total_jobs"] is None for row in rows[7:10])
+    assert rows[10]["core_hours"] == 1 and rows[10]["wall_time"] == 60
+
+
+def test_server():
+    """
+    Tests answering queries from the in-memory slot configuration of a server
+    :return:
+    """
+    loads = []
+
+    def load():
+        loads.append(1)
+        return collect.collect_slots(mocked_collector().query())
+
+    with TempDirectory() as d:
+        path = d.path + '/htcb.sock'
+        with server.PoolServer(path, load, interval=0.05) as pool_server:
+            thread = threading.Thread(target=pool_server.serve_forever, kwargs={"poll_interval": 0.01})
+            thread.start()
+            try:
+                response = server.request(path, {"cpu": 1, "ram": "10G", "jobs": 6, "time": "1h"})
+                assert response["total_jobs"] == 3
+                assert response["wall_time"] == 120
+                assert "preview" not in response
+
+                response = server.request(path, {"cpu": 1, "ram": "10G", "maxnodes": 1})
+                assert response["total_jobs"] == 1
+                assert len(response["preview"]) == 1
+
+                assert server.request(path, {"cpu": 0, "ram": "10G"})["error"]
+                assert server.request(path, [])["error"]
+                # wrong-typed fields are answered with an error, and the connection stays usable
+                assert server.request(path, {"cpu": [4], "ram": "10G"})["error"]
+                assert server.request(path, {"cpu": 1, "ram": "10G", "maxnodes": {}})["error"] is None
+                assert server.request(path, {"cpu": 1, "ram": "10G", "maxnodes": [1]})["error"]
+
+                params = main.build_parser().parse_args(["--cpu", "1", "--ram", "10G", "--connect", path])
+                with praises(SystemExit):
+                    main.peek(params, parsers=[])
+
+                # a second server refuses the socket of the running one
+                with praises(FileExistsError):
+                    server.PoolServer(path, load, interval=0)
+                assert server.request(path, {"cpu": 1, "ram": "10G"})["total_jobs"] == 3
+
+                # the slot configuration is refreshed in the background
+                for _ in range(100):
+                    if len(loads) > 1:
+                        break
+                    time.sleep(0.01)
+            finally:
+                pool_server.shutdown()
+                thread.join()
+
+        assert len(loads) > 1
+        assert not os.path.exists(path)
+
+        # a socket left behind by a stopped server is replaced, any other file is kept
+        import socket
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+            stale.bind(path)
+        with server.PoolServer(path, load, interval=0) as pool_server:
+            pass
+        assert not os.path.exists(path)
+        d.write('htcb.sock', b'not a socket')
+        with praises(FileExistsError):
+            server.PoolServer(path, load, interval=0)
+        assert d.read('htcb.sock') == b'not a socket'
+
+
+def test_connect_refuses_unsupported_options(monkeypatch, caplog):
+    """
+    Tests that --connect refuses the options a server cannot take into account
+    :return:
+    """
+    def request(path, query):
+        raise AssertionError("the server must not be asked")
+
+    monkeypatch.setattr(server, "request", request)
+    with TempDirectory() as d:
+        d.write("job.submit", b'request_cpus = 1\nrequest_memory = 1GB\nrequirements = OpSys == "LINUX"\nqueue\n')
+        for options in (["--requirements", 'OpSys == "LINUX"'], ["--start"], ["--current"], ["--simulate"],
+                        ["--file", d.path + "/job.submit"]):
+            caplog.clear()
+            params = main.build_parser().parse_args(["--cpu", "1", "--ram", "10G", "--connect", "htcb.sock",
+                                                     *options])
+            main.ask_server(params)
+            assert "only answers job requests without" in caplog.text
+            assert options[0] in caplog.text or "requirements of" in caplog.text
+
+
+def test_incremental_refresh(monkeypatch):
+    """
+    Tests that refreshing a snapshot with changed and vanished slots gives the
+    same configuration as collecting the whole pool again
+    :return:
+    """
+    coll = mocked_collector()
+    coll.update("slot2@cpu2", Machine="cpu2", TotalSlotCpus="1", TotalSlotDisk="287530000",
+                TotalSlotMemory="500000", SlotType="Static")
+    snapshot = collect.snapshot_slots(coll.query())
+    assert snapshot["slots"]["cpu2"][0]["SimSlots"] == 2
+    assert snapshot["last_heard"] == 2
+
+    # one slot changes, one appears, one vanishes
+    coll.update("slot1@cpu2", TotalSlotCpus="4")
+    coll.update("slot1@cpu4", Machine="cpu4", TotalSlotCpus="8", TotalSlotDisk="287530000",
+                TotalSlotMemory="500000", SlotType="Partitionable")
+    coll.remove("slot1@gpu1")
+
+    changed = coll.query(constraint=f'LastHeardFrom >= {snapshot["last_heard"]}', projection=None)
+    assert len(changed) == 3
+    names = [ad["Name"] for ad in coll.query(constraint='SlotType != "Dynamic"', projection=["Name"])]
+    collect.refresh_slots(snapshot, changed, names)
+
+    expected = collect.collect_slots(coll.query())
+    assert {node: sorted(slots, key=str) for node, slots in snapshot["slots"].items()} == \
+        {node: sorted(slots, key=str) for node, slots in expected.items()}
+    assert "gpu1" not in snapshot["slots"]
+    assert snapshot["last_heard"] == 4
+
+    # load_config refreshes an outdated cache incrementally
+    import htcondor
+    monkeypatch.setattr(htcondor, "Collector", lambda: coll)
+    params = main.build_parser().parse_args(["--cpu", "1", "--ram", "10GB"])
+    with TempDirectory() as d:
+        monkeypatch.setattr(collect, "SLOTS_CONFIGURATION", d.path)
+        assert main.load_config(params) == expected
+
+        coll.update("slot1@cpu4", TotalSlotMemory="1000000")
+        queries = []
+        xquery = coll.xquery
+
+        def counting_xquery(ad_type=None, constraint=None, projection=None):
+            queries.append(constraint)
+            return xquery(ad_type, constraint, projection)
+
+        monkeypatch.setattr(coll, "xquery", counting_xquery)
+        assert main.load_config(params)["cpu4"][0]["TotalSlotMemory"] == 488.28
+        assert queries == []
+        assert main.load_config(params, refresh=True)["cpu4"][0]["TotalSlotMemory"] == 976.56
+        assert "LastHeardFrom >= 4" in queries[0]
+
+
+def test_streaming_ingestion(monkeypatch, capsys):
+    """
+    Tests that the slot ads are folded into the configuration while they are
+    streamed from the collector
+    :return:
+    """
+    coll = mocked_collector()
+    import htcondor
+    monkeypatch.setattr(htcondor, "Collector", lambda: coll)
+
+    # the ads are handed out one by one and counted while they arrive
+    ads = main.query_collector(coll, 'SlotType != "Dynamic"', main.QUERY_DATA + main.SNAPSHOT_DATA)
+    assert next(ads)["Name"] == "slot1@cpu2"
+    assert coll.streamed == 1
+    assert len(list(collect.report_progress(ads))) == 2
+    assert capsys.readouterr().err == "\rCollected 2 slot ads\n"
+
+    # collectors without xquery are read through query
+    monkeypatch.setattr(coll, "xquery", None)
+    assert len(list(main.query_collector(coll, 'SlotType == "Static"', ["Name"]))) == 1
+
+    # a long stream of identical ads only keeps one configuration, and its slots are grouped under one key
+    def stream(n_ads):
+        for i in range(n_ads):
+            yield dict(coll.query_output[0], Name=f"slot{i}@cpu2")
+    snapshot = collect.snapshot_slots(stream(100000))
+    assert snapshot["slots"] == {"cpu2": [dict(collect.format_slot(coll.query_output[0]), SimSlots=100000)]}
+    assert [len(names) for names in snapshot["members"]["cpu2"]] == [100000]
+
+    params = main.build_parser().parse_args(["--cpu", "1", "--ram", "10GB", "--progress", "--refresh"])
+    with TempDirectory() as d:
+        monkeypatch.setattr(collect, "SLOTS_CONFIGURATION", d.path)
+        assert main.load_config(params) == collect.collect_slots(coll.query())
+    assert "Collected 3 slot ads" in capsys.readouterr().err
+
+
+def test_multiple_pools(monkeypatch):
+    """
+    Tests querying several pools concurrently and combining their slots
+    :return:
+    """
+    collectors = {"pool-a": mocked_collector("pool-a"), "pool-b": mocked_collector("pool-b"),
+                  "slow": mocked_collector("slow")}
+    collectors["pool-b"].update("slot1@cpu9", Machine="cpu9", TotalSlotCpus="8", TotalSlotDisk="287530000",
+                                TotalSlotMemory="500000", SlotType="Partitionable")
+
+    # pool-a and pool-b only answer once both are queried, the slow pool not before the end of the test
+    both_queried = threading.Barrier(2, timeout=10)
+    released = threading.Event()
+
+    def xquery(self, *args, **kwargs):
+        if self.pool == "slow":
+            released.wait()
+            raise RuntimeError("released")
+        both_queried.wait()
+        return iter(self.query_output)
+
+    import htcondor
+    monkeypatch.setattr(mocked_collector, "xquery", xquery)
+    monkeypatch.setattr(htcondor, "Collector", lambda pool=None: collectors[pool])
+    params = main.build_parser().parse_args(["--cpu", "1", "--ram", "10GB", "--pool", "pool-a",
+                                             "--pool", "pool-b", "--pool", "slow", "--pool-timeout", "2s"])
+
+    with TempDirectory() as d:
+        monkeypatch.setattr(collect, "SLOTS_CONFIGURATION", d.path)
+        try:
+            # the pools are queried at the same time, and the slow one is given up
+            config = main.load_pools(params, refresh=True)
+        finally:
+            released.set()
+        assert sorted(config) == ["cpu2", "cpu3", "cpu9", "gpu1"]
+        assert [slot["Pool"] for slot in config["cpu2"]] == ["pool-a", "pool-b"]
+
+        static = examine.filter_slots(config, "Static")
+        partitionable = examine.filter_slots(config, "Partitionable")
+        results = examine.check_slots(static, partitionable, 1, 1.0, 0.0, 0, 100, 60.0, 0, True)
+        assert {slot["Pool"] for slot in results["preview"]} == {"pool-a", "pool-b"}
+        _, total_jobs = examine.evaluate(static, partitionable, 1, 1.0, 0.0, 0, 0, False)
+        assert total_jobs == 3 + 3 + 8
+
+        # each pool gets its own cache
+        assert len(os.listdir(d.path)) == 2
+
+    configs, errors = collect.query_pools(lambda pool: 1 / 0 if pool == "bad" else {}, ["ok", "bad", "ok"], 1.0)
+    assert configs == {"ok": {}}
+    assert errors == {"bad": "division by zero"}
+
+
+def test_slot_records():
+    """
+    Tests that slot and preview records behave like the dicts they replace
+    :return:
+    """
+    slot = records.SlotRecord(TotalSlotCpus=4, TotalSlotGPUs=0, TotalSlotDisk=10.0,
+                              TotalSlotMemory=8.0, SlotType="Static", SimSlots=2)
+    assert slot == {"TotalSlotCpus": 4, "TotalSlotGPUs": 0, "TotalSlotDisk": 10.0,
+                    "TotalSlotMemory": 8.0, "SlotType": "Static", "SimSlots": 2}
+    assert "Machine" not in slot and slot.get("Machine") is None and slot.get("keys") is None
+    with praises(KeyError):
+        assert slot["Machine"]
+    with praises(KeyError):
+        slot["Unknown"] = 1
+
+    slot["Machine"] = "cpu1"
+    slot["SimSlots"] += 1
+    assert dict(slot)["Machine"] == "cpu1" and slot["SimSlots"] == 3
+    assert records.SlotRecord(**dict(slot)) == slot
+    assert not hasattr(slot, "__dict__")
+    assert sys.getsizeof(slot) < sys.getsizeof(dict(slot))
+
+    _, preview = examine.check_slot_by_type(slot, 1, 2.0, 0.0, "Static")
+    assert isinstance(preview, records.PreviewRecord)
+    assert (preview["sim_jobs"], preview["requested_ram"], preview["fits"]) == (4, 8.0, "YES")
+    assert json.loads(json.dumps(dict(preview)))["Machine"] == "cpu1"
+
+    # the cache is stored as JSON and loaded as records
+    config = collect.collect_slots(mocked_collector().query())
+    assert isinstance(config["cpu2"][0], records.SlotRecord)
+    with TempDirectory() as d:
+        collect.store_snapshot({"slots": config}, "host", ["a"], directory=d.path)
+        cached = collect.load_snapshot("host", ["a"], directory=d.path)["slots"]
+    assert cached == config
+    assert isinstance(cached["cpu2"][0], records.SlotRecord)
+
+
+def test_synthetic_pool():
+    """
+    Tests the seeded generator of synthetic pools
+    :return:
+    """
+    from mock_htcondor.synthetic import GPU_COUNTS, synthetic_ads
+
+    ads = list(synthetic_ads(nodes=200, slots_per_node=4, seed=1))
+    assert len(ads) == 800
+    assert ads == list(synthetic_ads(nodes=200, slots_per_node=4, seed=1))
+    assert ads != list(synthetic_ads(nodes=200, slots_per_node=4, seed=2))
+    assert len({ad["Name"] for ad in ads}) == 800
+
+    # all ads of a node share its slot type, the ratios apply per node
+    nodes = {ad["Machine"]: ad for ad in ads}
+    assert all(ad["SlotType"] == nodes[ad["Machine"]]["SlotType"] for ad in ads)
+    assert 100 < sum(ad["SlotType"] == "Partitionable" for ad in nodes.values()) < 180
+    assert not any(ad["TotalSlotGPUs"] for ad in synthetic_ads(nodes=50, gpu_share=0.0))
+    # the slots of a node share its GPUs, without claiming more than it has
+    gpus = {}
+    for ad in synthetic_ads(nodes=500, slots_per_node=4, gpu_share=0.5):
+        gpus.setdefault(ad["Machine"], []).append(ad["TotalSlotGPUs"])
+    assert {sum(slots) for slots in gpus.values()} == {0, *GPU_COUNTS}
+    assert all(max(slots) - min(slots) <= 1 for slots in gpus.values())
+    for ratio in [0.0, 0.9]:
+        assert all(ad["TotalSlotMemory"] > 0 and ad["TotalSlotDisk"] > 0
+                   for ad in synthetic_ads(nodes=500, slots_per_node=64, duplicate_ratio=ratio))
+
+    # duplicates collapse into one configuration per node, and one more for the slots with an extra GPU
+    ads = list(synthetic_ads(nodes=200, slots_per_node=4, duplicate_ratio=1.0))
+    config = collect.collect_slots(ads)
+    gpus = {}
+    for ad in ads:
+        gpus.setdefault(ad["Machine"], set()).add(ad["TotalSlotGPUs"])
+    assert sum(len(slots) for slots in config.values()) == sum(map(len, gpus.values())) > 200
+    config = collect.collect_slots(synthetic_ads(nodes=200, slots_per_node=4, duplicate_ratio=0.0))
+    assert sum(len(slots) for slots in config.values()) > 700
+
+    coll = mocked_collector.synthetic(nodes=10, slots_per_node=2)
+    assert len(coll.query()) == 20
+    assert len(list(coll.xquery(constraint='SlotType == "Static"'))) == \
+        sum(ad["SlotType"] == "Static" for ad in coll.query())
+
+
+def test_max_nodes_optimum():
+    """
+    Tests that --maxnodes picks the machines with the most jobs, counting all
+    slot configurations of a machine, against a brute force search
+    :return:
+    """
+    content = [
+        {"Machine": f"cpu{i % 6}", "TotalSlotCpus": str(1 + (i * 7) % 12), "TotalSlotGPUs": "0",
+         "TotalSlotDisk": "104857600", "TotalSlotMemory": str(1024 * (2 + (i * 5) % 40)),
+         "SlotType": "Static" if i % 3 else "Partitionable"}
+        for i in range(30)
+    ]
+    slots = collect.collect_slots(content)
+    static = examine.filter_slots(slots, "Static")
+    partitionable = examine.filter_slots(slots, "Partitionable")
+
+    node_jobs = {}
+    for slot in partitionable + static:
+        _, preview = examine.check_slot_by_type(slot, 2, 4.0, 0.0, slot["SlotType"])
+        node_jobs[slot["Machine"]] = node_jobs.get(slot["Machine"], 0) + preview["sim_jobs"] * slot["SimSlots"]
+
+    for max_nodes in range(1, len(node_jobs) + 1):
+        best = max(sum(node_jobs[node] for node in nodes)
+                   for nodes in itertools.combinations(node_jobs, max_nodes))
+        for engine in ["dict", "numpy"]:
+            result, total_jobs = examine.evaluate(static, partitionable, 2, 4.0, 0.0, 0,
+                                                  max_nodes, False, engine=engine)
+            assert total_jobs == best
+            assert len({slot["Machine"] for slot in result["preview"]}) <= max_nodes
+
+    assert examine.best_nodes({"a": 3, "b": 0, "c": 5, "d": 3}, 2) == {"c", "a"}
+    assert examine.best_nodes({"a": 3, "b": 0}, 5) == {"a"}
+
+
+def test_max_nodes_pools():
+    """
+    Tests that --maxnodes keeps nodes of the same name in different pools apart
+    :return:
+    """
+    content = [{"Machine": "cpu3", "TotalSlotCpus": "1", "TotalSlotGPUs": "0", "TotalSlotDisk": "104857600",
+                "TotalSlotMemory": "4096", "SlotType": "Static"}]
+    config = collect.merge_pools({"a": collect.collect_slots(content), "b": collect.collect_slots(content)})
+    static = examine.filter_slots(config, "Static")
+
+    for engine in ["dict", "numpy"]:
+        for verbose in [False, True]:
+            result, total_jobs = examine.evaluate(static, [], 1, 1.0, 0.0, 0, 1, verbose, engine=engine)
+            assert total_jobs == 1
+            assert len(result["preview"]) == 1
+        _, total_jobs = examine.evaluate(static, [], 1, 1.0, 0.0, 0, 2, False, engine=engine)
+        assert total_jobs == 2
+
+    report = simulate.simulate(static, 1, 1.0, 0.0, 0, 4, 60.0, {("a", "cpu3")})
+    assert report["jobs"] == 4 and report["makespan"] == 240.0
+
+
+def test_packing():
+    """
+    Tests packing a job mix into partitionable and static slots
+    :return:
+    """
+    node = {"TotalSlotDisk": "104857600", "TotalSlotGPUs": "0"}
+    content = [
+        dict(node, Machine="big", TotalSlotCpus="16", TotalSlotMemory=str(64 * 1024), SlotType="Partitionable"),
+        dict(node, Machine="mid", TotalSlotCpus="8", TotalSlotMemory=str(64 * 1024), SlotType="Partitionable"),
+    ] + [
+        dict(node, Machine="small", TotalSlotCpus="2", TotalSlotMemory=str(8 * 1024), SlotType="Static")
+    ] * 4
+    config = collect.collect_slots(content)
+
+    # 8-core jobs go first and use all cores of "big" and "mid", the 1-core jobs get the static slots
+    report = packing.pack(config, [(1, 4.0, 0.0, 0, 70), (8, 32.0, 0.0, 0, 30)])
+    assert [(shape["running"], shape["waiting"]) for shape in report["shapes"]] == [(4, 66), (3, 27)]
+    assert report["free"]["TotalSlotCpus"] == 4
+    assert report["free"]["TotalSlotMemory"] == 4 * 4.0 + 32.0
+    # static slots run a single job, and the memory left on "mid" has no cores
+    assert report["stranded"] == report["free"]
+
+    # identical slots are split into groups, so millions of jobs pack instantly
+    config = collect.collect_slots([dict(content[0], Machine=f"cpu{i}") for i in range(2000)])
+    report = packing.pack(config, [(1, 2.0, 0.0, 0, 5000000), (3, 5.0, 0.0, 0, 1001)])
+    assert report["shapes"][1]["running"] == 1001
+    assert report["shapes"][0]["running"] == 2000 * 16 - 1001 * 3
+    assert report["free"]["TotalSlotCpus"] == 0
+
+    with TempDirectory() as d:
+        d.write('mix.csv', b'cpu,ram,jobs\n1,4G,70\n8,32G,30\n')
+        assert packing.read_mix(d.path + '/mix.csv') == [(1, 4.0, 0.0, 0, 70), (8, 32.0, 0.0, 0, 30)]
+        display.mix_results(packing.pack(config, packing.read_mix(d.path + '/mix.csv')))
+
+
+def test_simulation(monkeypatch):
+    """
+    Tests the discrete-event wall-time simulation with node speeds
+    :return:
+    """
+    node = {"TotalSlotDisk": "104857600", "TotalSlotGPUs": "0", "TotalSlotMemory": "4096",
+            "TotalSlotCpus": "1", "SlotType": "Static"}
+    content = [dict(node, Machine="fast", Mips="2000"), dict(node, Machine="slow", Mips="1000"),
+               dict(node, Machine="other", Mips="1000"), dict(node, Machine="norating")]
+    config = collect.collect_slots(content)
+    slots = examine.filter_slots(config, "Static")
+
+    # the speed is relative to the median rating, unrated nodes are typical
+    assert simulate.speed_factors(slots) == {(None, "fast"): 2.0, (None, "slow"): 1.0, (None, "other"): 1.0,
+                                             (None, "norating"): 1.0}
+
+    # the fast node runs two 30 minute jobs while the slow one runs a single 60 minute job
+    report = simulate.simulate(slots, 1, 1.0, 0.0, 0, 3, 60.0, nodes={(None, "fast"), (None, "slow")})
+    assert report["jobs"] == 3
+    assert report["makespan"] == 60.0
+    assert report["nodes"][(None, "fast")]["jobs"] == 2
+    assert report["nodes"][(None, "slow")]["utilization"] == 1.0
+
+    # nodes of the same name in different pools keep their own speed
+    merged = examine.filter_slots(collect.merge_pools({
+        "pool-a": collect.collect_slots([dict(node, Machine="cpu", Mips="2000")]),
+        "pool-b": collect.collect_slots([dict(node, Machine="cpu", Mips="1000")])}), "Static")
+    assert simulate.speed_factors(merged) == {("pool-a", "cpu"): 4 / 3, ("pool-b", "cpu"): 2 / 3}
+    report = simulate.simulate(merged, 1, 1.0, 0.0, 0, 3, 60.0)
+    assert report["nodes"][("pool-a", "cpu")]["jobs"] == 2 and report["nodes"][("pool-b", "cpu")]["jobs"] == 1
+
+    # only the given nodes are used, and the ceil-wave estimate holds for equal speeds
+    report = simulate.simulate(slots, 1, 1.0, 0.0, 0, 10, 60.0, nodes={(None, "norating")})
+    assert report["makespan"] == utils.wall_time(10, 1, 60.0)
+    assert simulate.simulate(slots, 2, 1.0, 0.0, 0, 10, 60.0)["jobs"] == 0
+
+    # identical job slots are one event, so millions of jobs simulate instantly
+    config = collect.collect_slots([dict(node, Machine=f"cpu{i}", TotalSlotCpus="32",
+                                         TotalSlotMemory=str(64 * 1024), SlotType="Partitionable",
+                                         Mips=str(1000 + i)) for i in range(1000)])
+    pushes = []
+
+    def heappush(heap, item):
+        pushes.append(item)
+        heapq.heappush(heap, item)
+
+    monkeypatch.setattr(simulate, "heapq", argparse.Namespace(heapify=heapq.heapify, heappop=heapq.heappop,
+                                                              heappush=heappush))
+    report = simulate.simulate(examine.filter_slots(config, "Partitionable"), 1, 1.0, 0.0, 0,
+                               1000000, 60.0)
+    # one event per slot configuration and wave of its 32 jobs, at most twice as many on the fastest nodes
+    assert len(pushes) <= 1000 * 2 * 1000000 // (1000 * 32) + 1000
+    assert report["jobs"] == 1000000
+    assert sum(stats["jobs"] for stats in report["nodes"].values()) == 1000000
+
+    params = main.build_parser().parse_args(["-c", "1", "-r", "1GB", "-j", "3", "-t", "60", "--simulate"])
+    assert params.simulate
+    assert examine.prepare(
+        cpu=1, gpu=0, ram="1GB", disk="0", jobs=3, job_duration="60m", maxnodes=0, file="",
+        verbose=True, content=None, config=collect.collect_slots(content), simulate=True
+    )
+
+
+def test_fast_startup(monkeypatch, capsys):
+    """
+    Tests that the CLI starts without importing rich or other heavy modules,
+    and that output that is not a terminal is printed as plain text.
+    :return:
+    """
+    import subprocess
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root)
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", "import htcrystalball.main"],
+                             env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             universal_newlines=True, check=True)
+    imports = {}
+    for line in process.stderr.splitlines()[1:]:
+        _, cumulative, name = line.split("|")
+        imports[name.strip()] = int(cumulative)
+    assert not {"rich", "natsort", "numpy", "htcondor", "htcrystalball.examine"} & imports.keys()
+    # generous, a regression towards importing rich and natsort at startup takes far longer
+    assert imports["htcrystalball.main"] < 500000
+
+    # the plain output never imports rich
+    script = ("import sys; sys.modules['htcondor'] = __import__('mock_htcondor'); "
+              "from htcrystalball import examine; "
+              "examine.prepare(cpu=1, gpu=0, ram='10GB', disk='10GB', jobs=8, job_duration='10m', "
+              "maxnodes=0, file='', verbose=True, content=sys.modules['htcondor'].Collector().query()); "
+              "assert 'rich' not in sys.modules")
+    process = subprocess.run([sys.executable, "-c", script], cwd=root, env=env, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    assert "TOTAL MATCHES:" in process.stdout
+    assert "[red]" not in process.stdout and "\tNode\t" in process.stdout
+
+    preview = {"preview": [records.PreviewRecord(Machine="node", SlotType="Static", fits="YES",
+                                                 TotalSlotCpus=8, requested_cpu=8, sim_jobs=1,
+                                                 SimSlots=1)]}
+    monkeypatch.setattr(display, "PLAIN", True)
+    display.results(preview, True, False, 1, 1, 10.0)
+    assert "1\tnode\t1\t8/8\t" in capsys.readouterr().out
+
+    monkeypatch.setattr(display, "PLAIN", False)
+    display.results(preview, True, False, 1, 1, 10.0)
+    assert "8/8" in capsys.readouterr().out
+
+
+def test_timings(monkeypatch, capsys):
+    """
+    Tests the phase measurements of --timings and the profile of --profile
+    :return:
+    """
+    from htcrystalball import timing
+
+    # disabled phases measure nothing and pass iterables through
+    ads = [{"Name": "slot1"}]
+    with timing.phase("check") as stats:
+        stats["slots"] = 1
+    assert timing.PHASES is None and timing.counted(ads, "query", "ads") is ads
+
+    with TempDirectory() as d:
+        monkeypatch.setattr(collect, "SLOTS_CONFIGURATION", d.path)
+        profile = os.path.join(d.path, "run.prof")
+        monkeypatch.setattr(sys, "argv", ["htcb", "-c", "1", "-r", "10GB", "-v", "--refresh",
+                                          "--timings", "json", "--profile", profile])
+        start = time.perf_counter()
+        try:
+            with praises(SystemExit):
+                main.main()
+        finally:
+            timing.disable()
+        wall = time.perf_counter() - start
+        assert os.path.getsize(profile) > 0
+
+    phases = json.loads(capsys.readouterr().err.splitlines()[-1])["phases"]
+    assert set(phases) == {"query", "collect", "load", "check", "sort", "display"}
+    assert phases["query"]["ads"] == 3
+    assert phases["load"]["configs"] == 3 and phases["check"]["slots"] == 3
+    assert phases["display"]["rows"] == 3
+    # nested phases, e.g. sort in check and query in collect in load, are not counted twice
+    assert sum(stats["seconds"] for stats in phases.values()) <= wall
+
+    timing.enable()
+    with timing.phase("check"):
+        with timing.phase("sort"):
+            time.sleep(0.05)
+        assert list(timing.counted(ads, "query", "ads")) == ads
+    phases = timing.PHASES
+    timing.disable()
+    assert phases["sort"]["seconds"] >= 0.05 > phases["check"]["seconds"] + phases["query"]["seconds"]
+
+    # repeated phases are summed up, and the text report lists every phase
+    timing.enable()
+    for _ in range(2):
+        with timing.phase("sort") as stats:
+            stats["rows"] = 5
+    assert list(timing.counted(ads, "query", "ads")) == ads
+    stream = io.StringIO()
+    timing.report("text", stream)
+    timing.disable()
+    lines = stream.getvalue().splitlines()
+    assert lines[1].split()[:2] == ["sort", "2"] and lines[1].endswith("rows=10")
+    assert lines[2].startswith("query") and lines[2].endswith("ads=1")
+
+
+def test_machine_readable_output(capsys):
+    """
+    Tests the JSON, JSON lines and CSV output of --output
+    :return:
+    """
+    preview = [records.PreviewRecord(Machine="cpu1", SlotType="Partitionable", fits="YES",
+                                     TotalSlotCpus=8, requested_cpu=8, TotalSlotMemory=16.0,
+                                     requested_ram=4.0, sim_jobs=2, SimSlots=4, Pool="a"),
+               records.PreviewRecord(Machine="cpu2", SlotType="Static", SimSlots=1, Pool="b")]
+    result = {"preview": preview}
+
+    # the verbose table no longer turns SimSlots into strings
+    display.results(result, True, False, 4, 10, 60.0, pools={"a": 8, "b": 0})
+    assert "1..4" in capsys.readouterr().out
+    assert preview[0]["SimSlots"] == 4
+
+    stream = io.StringIO()
+    display.write_results(result, "json", 4, 10, 60.0, pools={"a": 8, "b": 0}, stream=stream)
+    output = json.loads(stream.getvalue())
+    assert output["total_jobs"] == 8 and output["core_hours"] == 40 and output["wall_time"] == 120
+    assert output["pools"] == {"a": 8, "b": 0}
+    assert output["preview"][0] == dict(preview[0], jobs=8)
+    assert output["preview"][1]["jobs"] == 0 and output["preview"][1]["fits"] == "NO"
+
+    stream = io.StringIO()
+    display.write_results(result, "jsonl", 4, 0, 0.0, stream=stream)
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [line["record"] for line in lines] == ["slot", "slot", "summary"]
+    assert lines[0]["TotalSlotMemory"] == 16.0 and "Pool" not in lines[0]
+    assert lines[-1]["total_jobs"] == 8 and lines[-1]["wall_time"] is None
+
+    stream = io.StringIO()
+    display.write_results(result, "csv", 4, 10, 60.0, stream=stream)
+    rows = list(csv.DictReader(io.StringIO(stream.getvalue())))
+    assert [row["jobs"] for row in rows] == ["8", "0"] and rows[0]["SimSlots"] == "4"
+
+    with praises(ValueError):
+        display.write_results(result, "xml", 4, 10, 60.0, stream=stream)
+
+    # the previews of all slots are written, not only those of verbose mode
+    content = mocked_collector().query()
+    assert examine.prepare(cpu=1, gpu=0, ram="10GB", disk="0", jobs=1, job_duration="", maxnodes=0,
+                           file="", verbose=False, content=content, engine="numpy", output="csv")
+    rows = list(csv.DictReader(io.StringIO(capsys.readouterr().out)))
+    assert len(rows) == 3 and sum(int(row["jobs"]) for row in rows) == 3
+    assert main.build_parser().parse_args(["-c", "1", "-r", "1GB", "--output", "jsonl"]).output == "jsonl"
+
+
+def test_streamed_table(monkeypatch, capsys):
+    """
+    Tests that the verbose table is printed in chunks and its row selections
+    :return:
+    """
+    def preview(machine, jobs, sim_slots=1):
+        return records.PreviewRecord(Machine=machine, SlotType="Static", fits="YES" if jobs else "NO",
+                                     TotalSlotCpus=4, requested_cpu=4 if jobs else 0, sim_jobs=jobs,
+                                     SimSlots=sim_slots, TotalSlotMemory=8.0)
+    previews = [preview("cpu1", 1, 2), preview("cpu1", 0), preview("cpu2", 0), preview("cpu3", 2)]
+    monkeypatch.setattr(display, "PLAIN", True)
+    monkeypatch.setattr(display, "CHUNK_ROWS", 3)
+
+    # the header is printed above the first chunk and the caption below the last one
+    rows = ((str(i), "[red]x[/red]") for i in range(7))
+    display.print_table(display.make_console(), "Caption", [("A", "right"), ("B", "left")], rows)
+    assert capsys.readouterr().out.splitlines() == \
+        ["A\tB", "0\tx", "1\tx", "2\tx", "3\tx", "4\tx", "5\tx", "6\tx", "Caption"]
+
+    # rows are formatted while they are printed, so the first chunk does not wait for the last
+    printed = []
+
+    def slow_rows():
+        for i in range(6):
+            printed.append(len(capsys.readouterr().out.splitlines()))
+            yield (str(i),)
+    display.print_table(display.make_console(), None, [("A", "right")], slow_rows())
+    assert printed == [0, 0, 0, 0, 4, 0]
+    assert capsys.readouterr().out.splitlines() == ["3", "4", "5"]
+
+    assert [slot["Machine"] for slot in display.select_previews(previews, only_fitting=True)] == \
+        ["cpu1", "cpu3"]
+    assert [slot["sim_jobs"] for slot in display.select_previews(previews, top=2)] == [1, 2]
+    groups = display.group_previews(previews)
+    assert [(group["Machine"], group["jobs"], group["slots"], group["fitting"]) for group in groups] == \
+        [("cpu1", 2, 3, 2), ("cpu2", 0, 1, 0), ("cpu3", 2, 1, 1)]
+    assert groups[0]["TotalSlotCpus"] == 12 and groups[0]["TotalSlotMemory"] == 24.0
+
+    display.results({"preview": previews}, True, False, 4, 1, 10.0, group=True, only_fitting=True)
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].split("\t")[:5] == ["Jobs", "Node", "Configs", "Slots", "CPUs"]
+    assert lines[1:3] == ["2\tcpu1\t2\t2/3\t12\t24.0G\t0.0G\t0", "2\tcpu3\t1\t1/1\t4\t8.0G\t0.0G\t0"]
+    assert "TOTAL MATCHES: 4" in lines
+
+    display.results({"preview": previews}, True, False, 4, 1, 10.0, top=1)
+    assert capsys.readouterr().out.splitlines()[1].startswith("2\tcpu1\t1..2\t4/4")
+
+    params = main.build_parser().parse_args(["-c", "1", "-r", "1GB", "--top", "5", "--group"])
+    assert main.verbose_table(params) and params.top == 5
+    assert not main.verbose_table(main.build_parser().parse_args(["-c", "1", "-r", "1GB"]))
+
+
+def test_job_requirements(monkeypatch, capsys):
+    """
+    Tests evaluating job requirements against the slots with --requirements
+    and the requirements of a submit file
+    :return:
+    """
+    from htcrystalball import classad
+
+    job = classad.job_ad(2, 0, 4.0, 1.0)
+    assert job["requestmemory"] == 4096 and job["requestdisk"] == 1024**2
+    requirements = classad.compile_expression('OpSys == "LINUX" && CUDACapability >= 7.0')
+    assert requirements is classad.compile_expression('OpSys == "LINUX" && CUDACapability >= 7.0')
+    assert requirements.attributes(job) == ["cudacapability", "opsys"]
+    assert requirements(job, {"opsys": "linux", "cudacapability": 7.5}) is True
+    assert requirements(job, {"opsys": "LINUX"}) is classad.UNDEFINED
+    assert requirements(job, {"opsys": "WINDOWS"}) is False
+    assert classad.compile_expression("TARGET.Memory >= RequestMemory * 2 && 7 / 2 == 3")(
+        job, {"memory": 8192}) is True
+    assert classad.compile_expression('"a" < 1 || false')(job, {}) is classad.ERROR
+    assert classad.compile_expression("ifThenElse(isUndefined(HasDocker), true, HasDocker)")(job, {}) is True
+    for broken in ["OpSys ==", "unknown(1)", "(Memory", "Memory Disk"]:
+        with praises(ValueError):
+            classad.compile_expression(broken)
+
+    # results are memoised by the values of the attributes the expression reads
+    matches = classad.matcher('OpSys == "LINUX"', job)
+    slots = [{"Attributes": {"opsys": "LINUX" if i % 3 else "WINDOWS", "memory": i}} for i in range(1000)]
+    assert sum(map(matches, slots)) == 666 and len(matches.evaluations) == 2
+
+    # the attributes are queried, kept in the slots and the cache, and part of the slot key
+    coll = mocked_collector()
+    coll.update("slot1@cpu2", OpSys="LINUX")
+    coll.update("slot1@cpu3", OpSys="WINDOWS")
+    coll.update("slot1@gpu1", opsys="LINUX", CUDACapability=8.0)
+    coll.update("slot2@gpu1", Machine="gpu1", TotalSlotCpus="1", TotalSlotGPUs="4", TotalSlotDisk="287680000",
+                TotalSlotMemory="500000", SlotType="Partitionable", OpSys="LINUX", CUDACapability=6.1)
+    import htcondor
+    monkeypatch.setattr(htcondor, "Collector", lambda: coll)
+    params = main.build_parser().parse_args(
+        ["-c", "1", "-r", "1GB", "--requirements", 'OpSys == "LINUX" && CUDACapability >= 7.0'])
+    attributes = main.requirement_attributes(params)
+    assert attributes == ["cudacapability", "opsys"]
+    with TempDirectory() as d:
+        monkeypatch.setattr(collect, "SLOTS_CONFIGURATION", d.path)
+        config = main.load_config(params, attributes=attributes)
+        assert [slot["Attributes"] for slot in config["gpu1"]] == [
+            {"cudacapability": 8.0, "opsys": "LINUX"}, {"cudacapability": 6.1, "opsys": "LINUX"}]
+        assert config["cpu3"][0]["Attributes"] == {"opsys": "WINDOWS"}
+        assert main.load_config(params) != config
+        coll.update("slot1@cpu3", OpSys="LINUX")
+        assert main.load_config(params, refresh=True, attributes=attributes)["cpu3"][0]["Attributes"] == \
+            {"opsys": "LINUX"}
+
+        assert examine.prepare(cpu=1, gpu=0, ram="1GB", disk="0", jobs=1, job_duration="", maxnodes=0,
+                               file="", verbose=False, content=None, config=config, output="json",
+                               requirements=params.requirements)
+        output = json.loads(capsys.readouterr().out)
+        assert output["excluded"] == 3 and output["total_jobs"] == 1
+        assert [slot["Machine"] for slot in output["preview"]] == ["gpu1"]
+
+        # the requirements of a submit file are combined with the typed ones
+        d.write("job.submit", b'request_cpus = 1\nrequest_memory = 1GB\nrequirements = CUDACapability >= 8\nqueue\n')
+        assert examine.job_requirements(d.path + "/job.submit", 'OpSys == "LINUX"') == \
+            '(CUDACapability >= 8) && (OpSys == "LINUX")'
+        assert examine.prepare(cpu=0, gpu=0, ram="", disk="0", jobs=None, job_duration="", maxnodes=0,
+                               file=d.path + "/job.submit", verbose=False, content=None, config=config)
+        out = capsys.readouterr().out
+        assert "1 jobs of this size" in out and "3 slots do not meet the job requirements" in out
+        assert not examine.prepare(cpu=1, gpu=0, ram="1GB", disk="0", jobs=1, job_duration="", maxnodes=0,
+                                   file="", verbose=False, content=None, config=config, requirements="OpSys ==")
+
+
+def test_start_policies(monkeypatch, capsys):
+    """
+    Tests leaving out the slots whose START expression rejects the job with --start
+    :return:
+    """
+    from htcrystalball import classad
+
+    job = classad.job_ad(1, 0, 2.0, 1.0, {"MaxRuntime": "2 * 3600"}, "alice")
+    accepts = classad.policy_matcher(job)
+    policies = ['TARGET.Owner == "alice" || TARGET.Owner == "bob"', "TARGET.MaxRuntime <= 3600",
+                "TARGET.RequestMemory <= Memory", "MaxRuntime =?= undefined", "broken ==", True, False]
+    slots = [{"Attributes": {"start": policy, "memory": 1024 * (i % 4)}}
+             for i in range(1000) for policy in [policies[i % len(policies)]]]
+    assert [accepts(slot) for slot in slots[:7]] == [True, False, True, False, False, True, False]
+    assert accepts({"Attributes": {"start": "TARGET.RequestMemory <= Memory", "memory": 4096}})
+    assert accepts({})
+    # 1000 slots with 7 policies and 4 memory sizes take at most 28 evaluations
+    assert sum(map(accepts, slots)) == 143 + 143 + 71 and len(accepts.evaluations) == 4 * len(policies) + 2
+
+    # the job ad is an idle vanilla job, unless the attributes of the submit file say otherwise
+    realistic = {"Attributes": {"start": "(TARGET.JobUniverse == 5 || TARGET.JobUniverse == 7) && "
+                                         "TARGET.NumJobStarts < 5 && TARGET.JobStatus == 1 && "
+                                         "TARGET.MaxHosts == 1 && TARGET.RequestMemory <= Memory",
+                                "memory": 4096}}
+    assert classad.policy_matcher(classad.job_ad(1, 0, 2.0, 1.0))(realistic)
+    assert not classad.policy_matcher(classad.job_ad(1, 0, 8.0, 1.0))(realistic)
+    assert not classad.policy_matcher(classad.job_ad(1, 0, 2.0, 1.0, {"JobUniverse": "9"}))(realistic)
+    assert classad.policy_matcher(classad.job_ad(1, 0, 2.0, 1.0, {"NumJobStarts": "4"}))(realistic)
+
+    # the policy and the slot attributes it reads are kept, other attributes are not
+    coll = mocked_collector()
+    coll.update("slot1@cpu2", Start="(Cpus > 0) && TARGET.RequestMemory <= MY.Memory", Cpus=1,
+                Memory=1024, Activity="Idle")
+    coll.update("slot1@cpu3", START='TARGET.Owner == "nobody"')
+    import htcondor
+    monkeypatch.setattr(htcondor, "Collector", lambda: coll)
+    monkeypatch.setattr(examine, "job_owner", lambda: "alice")
+    params = main.build_parser().parse_args(["-c", "1", "-r", "1GB", "--start"])
+    with TempDirectory() as d:
+        monkeypatch.setattr(collect, "SLOTS_CONFIGURATION", d.path)
+        config = main.load_config(params, attributes=["start"])
+        assert config["cpu2"][0]["Attributes"] == {
+            "start": "(Cpus > 0) && TARGET.RequestMemory <= MY.Memory", "cpus": 1, "memory": 1024}
+        assert "Attributes" not in config["gpu1"][0]
+
+        assert examine.prepare(cpu=1, gpu=0, ram="1GB", disk="0", jobs=1, job_duration="", maxnodes=0,
+                               file="", verbose=False, content=None, config=config, start=True)
+        out = capsys.readouterr().out
+        assert "2 jobs of this size" in out and "1 slots reject the job by their START policy" in out
+
+        # the job ad takes the custom attributes of the submit file
+        coll.update("slot1@gpu1", Start="TARGET.MaxRuntime <= 3600")
+        config = main.load_config(params, refresh=True, attributes=["start"])
+        d.write("job.submit", b"request_cpus = 1\nrequest_memory = 1GB\nhours = 2\n"
+                              b"+MaxRuntime = $(hours) * 3600\nqueue\n")
+        assert examine.prepare(cpu=0, gpu=0, ram="", disk="0", jobs=None, job_duration="", maxnodes=0,
+                               file=d.path + "/job.submit", verbose=False, content=None, config=config,
+                               output="json", start=True)
+        output = json.loads(capsys.readouterr().out)
+        assert output["rejected"] == 2 and output["total_jobs"] == 1
+
+
+def test_current_load(monkeypatch, capsys):
+    """
+    Tests subtracting the resources of running jobs from the pool with --current
+    :return:
+    """
+    dynamic = ({"Name": f"slot1_{i}@node{i % 500}", "TotalSlotCpus": 1, "TotalSlotMemory": 1024.0}
+               for i in range(20000))
+    claimed = collect.claimed_resources(itertools.chain(dynamic, [{"Name": "broken"}]))
+    assert len(claimed) == 500 and claimed["slot1@node7"] == [40, 0, 0.0, 40 * 1024.0]
+
+    coll = mocked_collector()
+    coll.update("slot1@cpu2", State="Claimed")
+    coll.update("slot1@cpu4", Machine="cpu4", TotalSlotCpus="8", TotalSlotMemory="32768",
+                TotalSlotDisk="1000000", SlotType="Partitionable", State="Unclaimed")
+    coll.update("slot1_1@cpu4", Machine="cpu4", TotalSlotCpus="2", TotalSlotMemory="8192",
+                TotalSlotDisk="1000", SlotType="Dynamic", State="Claimed")
+    coll.update("slot1_2@cpu4", Machine="cpu4", TotalSlotCpus="4", TotalSlotMemory="4096",
+                TotalSlotDisk="1000", SlotType="Dynamic", State="Claimed")
+    import htcondor
+    monkeypatch.setattr(htcondor, "Collector", lambda: coll)
+    params = main.build_parser().parse_args(["-c", "1", "-r", "1GB", "--current"])
+    with TempDirectory() as d:
+        monkeypatch.setattr(collect, "SLOTS_CONFIGURATION", d.path)
+        config = main.load_config(params)
+        assert os.listdir(d.path) == []
+    assert config["cpu4"] == [{"TotalSlotCpus": 2, "TotalSlotGPUs": 0, "TotalSlotDisk": 0.95,
+                               "TotalSlotMemory": 20.0, "SlotType": "Partitionable", "SimSlots": 1}]
+    assert config["cpu2"][0]["TotalSlotCpus"] == 0
+    # the ads of the collector are left as they are
+    assert coll.query_output[-3]["TotalSlotCpus"] == "8"
+
+    assert examine.prepare(cpu=1, gpu=0, ram="1GB", disk="0", jobs=1, job_duration="", maxnodes=0,
+                           file="", verbose=False, content=None, config=config, current=True)
+    out = capsys.readouterr().out
+    assert "4 jobs of this size" in out and "current load of the pool" in out
+
+
+def test_calibration(monkeypatch, capsys):
+    """
+    Tests calibrating the job duration from the user log of an earlier run
+    :return:
+    """
+    events = ("000 (012.000.000) 2024-05-01 10:00:00 Job submitted from host: <10.0.0.1>\n...\n"
+              "000 (012.001.000) 2024-05-01 10:00:00 Job submitted from host: <10.0.0.1>\n...\n"
+              "001 (012.000.000) 2024-05-01T10:30:00+02:00 Job executing on host: <10.0.0.2>\n...\n"
+              "005 (012.000.000) 2024-05-01T11:30:00+02:00 Job terminated.\n"
+              "\t(1) Normal termination (return value 0)\n...\n"
+              "001 (012.001.000) 05/01 12:00:00 Job executing on host: <10.0.0.3>\n...\n"
+              "005 (012.001.000) 05/01 15:00:00 Job terminated.\n")
+    with TempDirectory() as d:
+        d.write("job.log", events.encode())
+        log = userlog.UserLog(d.path + "/job.log")
+        assert log.update() == 5
+        # the last event is incomplete and left for the next update
+        assert log.counts() == {"idle": 0, "running": 1, "held": 0, "completed": 1, "removed": 0}
+        assert log.runtimes == [3600] and log.update() == 0
+        d.write("job.log", (events + "\t(1) Normal termination (return value 0)\n...\n").encode())
+        assert log.update() == 1 and log.runtimes == [3600, 10800] and log.completed == 2
+
+        statistics = userlog.calibrate(d.path + "/job.log")
+        assert statistics["jobs"] == 2 and statistics["p50"] == 60 and statistics["p90"] == 180
+        d.write("empty.log", b"")
+        with praises(ValueError):
+            userlog.calibrate(d.path + "/empty.log")
+
+    assert userlog.percentile(list(range(1, 101)), 95) == 95
+    config = {"cpu2": [{"TotalSlotCpus": 4, "TotalSlotGPUs": 0, "TotalSlotDisk": 100.0,
+                        "TotalSlotMemory": 16.0, "SlotType": "Static", "SimSlots": 1}]}
+    assert examine.prepare(cpu=1, gpu=0, ram="1GB", disk="0", jobs=8, job_duration="", maxnodes=0,
+                           file="", verbose=False, content=None, config=config, calibration=statistics)
+    out = capsys.readouterr().out
+    assert "calibrated from 2 completed" in out and "2 hour(s)" in out and "about 6 hour(s)" in out
+
+
+def test_watch_log(monkeypatch, capsys):
+    """
+    Tests following the job event log of a running job cluster with --watch-log
+    :return:
+    """
+    def event(code, proc, clock):
+        return f"{code} (042.{proc:03d}.000) 2024-05-01 {clock} Event\n...\n"
+
+    events = "".join([event("000", proc, "10:00:00") for proc in range(6)] +
+                     [event("001", proc, "10:00:00") for proc in range(4)] +
+                     [event("006", 1, "10:30:00"), event("005", 0, "11:00:00"),
+                      event("001", 4, "11:00:00")])
+    with TempDirectory() as d:
+        d.write("job.log", events.encode())
+        log = userlog.UserLog(d.path + "/job.log")
+        assert log.update() == 13
+        now = watch.local_seconds(datetime.datetime(2024, 5, 1, 11, 30))
+        status = watch.project(log, 4, 0.0, now)
+        assert (status["completed"], status["running"], status["idle"]) == (1, 4, 1)
+        # the last started job runs for another 30 minutes, then the idle job for 60
+        assert status["job_duration"] == 60 and status["remaining"] == 90
+        assert watch.project(log, 4, 120.0, now)["remaining"] == 210
+        assert not watch.finished(status)
+
+        # only the new events are parsed
+        offset = log.offset
+        events += "".join([event("001", 5, "11:30:00")] +
+                          [event("005", proc, "12:30:00") for proc in range(1, 6)])
+        d.write("job.log", events.encode())
+        assert log.update() == 6 and log.offset > offset and log.update() == 0
+        assert watch.finished(watch.project(log, 4, 0.0, now))
+
+        config = {"cpu2": [{"TotalSlotCpus": 4, "TotalSlotGPUs": 0, "TotalSlotDisk": 100.0,
+                            "TotalSlotMemory": 16.0, "SlotType": "Static", "SimSlots": 1}]}
+        assert examine.prepare(cpu=1, gpu=0, ram="1GB", disk="0", jobs=6, job_duration="", maxnodes=0,
+                               file="", verbose=False, content=None, config=config,
+                               watch_log=d.path + "/job.log")
+        out = capsys.readouterr().out
+        assert "4 jobs of this size" in out and "6 completed, 0 running, 0 idle: all jobs are done." in out
+
+        # the wall time follows the pool, which is counted again on every update
+        d.write("idle.log", "".join(event("000", proc, "10:00:00") for proc in range(4)).encode())
+        totals = iter([4, 2, 2])
+
+        def recount():
+            total = next(totals, None)
+            if total is None:
+                raise SystemExit(0)
+            return total
+
+        log = watch.follow(d.path + "/idle.log", 1, 60.0, 0.001, updates=5, recount=recount)
+        lines = capsys.readouterr().out.splitlines()
+        assert [line.split(": ")[1] for line in lines] == [
+            "the jobs will complete in about 4 hour(s).", "the jobs will complete in about 1 hour(s).",
+            "the jobs will complete in about 2 hour(s)."]
+        assert log.states["idle"] == 4
+
+    # only a sample of the runtimes is kept, their count, sum and maximum are exact
+    monkeypatch.setattr(userlog, "RUNTIME_SAMPLE", 3)
+    for runtime in range(1, 11):
+        log.add_runtime(runtime * 60)
+    assert len(log.runtimes) == 3 and log.runtime_count == 10
+    assert log.runtime_total == 55 * 60 and log.runtime_max == 600
+
+
+def test_fit_index():
+    """
+    Tests that the fit index finds the same slots and jobs as checking every slot
+    :return:
+    """
+    content = [
+        {"Machine": f"cpu{i % 9}", "TotalSlotCpus": str(1 + i % 16), "TotalSlotGPUs": str(i % 3),
+         "TotalSlotDisk": str(1048576 * (10 + i % 50)), "TotalSlotMemory": str(1024 * (4 + i % 60)),
+         "SlotType": "Static" if i % 4 else "Partitionable"}
+        for i in range(400)
+    ]
+    slots = collect.collect_slots(content)
+    static = examine.filter_slots(slots, "Static")
+    partitionable = examine.filter_slots(slots, "Partitionable")
+    fit_index = index.FitIndex(static, partitionable)
+    assert len(fit_index) == len(static) + len(partitionable)
+
+    for cpu, ram, disk, gpu in [(1, 2.0, 0.0, 0), (2, 10.0, 20.0, 1), (8, 30.0, 5.5, 2),
+                                (16, 63.0, 59.0, 2), (17, 1.0, 0.0, 0), (1, 1.0, 0.0, 3)]:
+        expected, total = examine.evaluate(static, partitionable, cpu, ram, disk, gpu, 0, True)
+        fitting = [preview for preview in expected["preview"] if preview["fits"] == "YES"]
+        assert fit_index.count(cpu, ram, disk, gpu) == total
+        assert len(fit_index.candidates(cpu, ram, disk, gpu)) == len(fitting)
+        result, indexed_total = examine.evaluate(static, partitionable, cpu, ram, disk, gpu, 0, False,
+                                                 index=fit_index)
+        assert indexed_total == total and result["preview"] == fitting
+
+        # the suggested nodes are listed with all of their slots, as in verbose mode
+        expected, total = examine.evaluate(static, partitionable, cpu, ram, disk, gpu, 3, True)
+        result, indexed_total = examine.evaluate(static, partitionable, cpu, ram, disk, gpu, 3, False)
+        assert indexed_total == total and result["preview"] == expected["preview"]
+
+    model = server.PoolModel(slots)
+    assert model.query({"cpu": 2, "ram": "10GiB", "disk": "20GiB", "gpu": 1})["total_jobs"] == \
+        fit_index.count(2, 10.0, 20.0, 1)
+
+
+def test_optimize(capsys):
+    """
+    Tests searching the job shapes with the shortest makespan with --optimize
+    :return:
+    """
+    config = {"cpu2": [{"TotalSlotCpus": 16, "TotalSlotGPUs": 0, "TotalSlotDisk": 100.0,
+                        "TotalSlotMemory": 64.0, "SlotType": "Partitionable", "SimSlots": 10,
+                        "Attributes": {"opsys": "LINUX"}}],
+              "cpu3": [{"TotalSlotCpus": 4, "TotalSlotGPUs": 0, "TotalSlotDisk": 100.0,
+                        "TotalSlotMemory": 16.0, "SlotType": "Static", "SimSlots": 20,
+                        "Attributes": {"opsys": "WINDOWS"}}]}
+    static = examine.filter_slots(config, "Static")
+    partitionable = examine.filter_slots(config, "Partitionable")
+
+    assert optimize.parse_bounds("cpu=1:8, ram=:16G") == {"cpu": (1, 8), "ram": (None, 16.0)}
+    for bounds in ("cpu=1-8", "cpu=8:1", "gpu=1:2", "cpu=0:4", "ram=1X:2G"):
+        with praises(ValueError):
+            optimize.parse_bounds(bounds)
+    assert len(optimize.candidate_shapes(4, 8.0, 0.0, {"cpu": (1, 8)})) == 8
+    # with 2G per core, only up to 4 CPUs stay within 8G
+    assert optimize.candidate_shapes(4, 8.0, 0.0, {"cpu": (1, 8), "ram": (4.0, 8.0)}, "per-core") == \
+        [(1, 4.0, 0.0), (2, 4.0, 0.0), (3, 6.0, 0.0), (4, 8.0, 0.0)]
+
+    for engine in ("dict", "numpy"):
+        report = optimize.optimize(static, partitionable, 4, 8.0, 0.0, 0, 100, 120.0,
+                                   {"cpu": (1, 8)}, engine=engine)
+        assert report["evaluated"] == 8
+        assert report["reference"]["total_jobs"] == 60 and report["reference"]["makespan"] == 240
+        # 2 CPUs are as fast as the requested 4, more CPUs are slower, and 1 CPU needs the least
+        assert [(shape["cpu"], shape["total_jobs"], shape["makespan"]) for shape in report["shapes"]] == \
+            [(2, 120, 240), (1, 120, 480)]
+    assert optimize.count_jobs(static, partitionable, [(8, 8.0, 0.0), (7, 8.0, 0.0)], 0, "numpy") == [20, 20]
+
+    assert optimize.run(config, cpu=4, gpu=0, ram="8GiB", disk="", jobs=100, job_duration="2h", file="",
+                        bounds="cpu=1:8")
+    out = capsys.readouterr().out
+    assert "Requesting 2 CPUs and 8G RAM per job, the 100 job(s) will complete in about 4 hour(s)." in out
+    assert "for an idle pool" in out
+    assert not optimize.run(config, cpu=4, gpu=0, ram="8GiB", disk="", jobs=100, job_duration="",
+                            file="", bounds="cpu=1:8")
+
+    # the node limit, the requirements and the load apply as in the regular output
+    for engine in ("dict", "numpy"):
+        assert optimize.count_jobs(static, partitionable, [(4, 8.0, 0.0), (2, 8.0, 0.0)], 0, engine,
+                                   max_nodes=1) == [40, 80]
+    capsys.readouterr()
+    assert optimize.run(config, cpu=4, gpu=0, ram="8GiB", disk="", jobs=100, job_duration="2h", file="",
+                        bounds="cpu=4:4", maxnodes=1)
+    assert "With the requested 4 CPUs and 8G RAM, they will complete in about 6 hour(s)." in capsys.readouterr().out
+    assert optimize.run(config, cpu=4, gpu=0, ram="8GiB", disk="", jobs=100, job_duration="2h", file="",
+                        bounds="cpu=4:4", requirements='OpSys == "WINDOWS"', current=True)
+    out = capsys.readouterr().out
+    assert "With the requested 4 CPUs and 8G RAM, they will complete in about 10 hour(s)." in out
+    assert "for the current load of the pool" in out
+    assert not optimize.run(config, cpu=4, gpu=0, ram="8GiB", disk="", jobs=100, job_duration="2h", file="",
+                            bounds="cpu=4:4", requirements="OpSys ==")